@@ -0,0 +1,438 @@
+import argparse
+import csv
+import glob
+import json
+from itertools import chain
+import os
+import sys
+import time
+
+import numpy as np
+
+from score_calculator import (
+    write_json, SCORE_DEFAULTS, SCORE_PARAMS, I_WEIGHT, D_WEIGHT, LEVEL_BASE,
+    DISTRACT_PENALTY, PHONE_PENALTY, RESULT_DESCRIPTION,
+)
+
+# --- 全域配置 ---
+TASK_GLOB = os.path.join('json', 'task', '*', 'input.json')
+CSV_FIELDS = ('task', 'total_score', 'incentive_score', 'penalty_score') + SCORE_PARAMS + ('error',)
+_NUMBER_TYPES = {int, float, bool}   # 與 calculate_plan_d_score 相同：可以參與乘法運算的型別
+
+def _float_error(value):
+    """value 無法轉為 float64 時回傳原因，可以時回傳 None。"""
+    if type(value) not in _NUMBER_TYPES:
+        return f"is not a number: {value!r}"
+    try:
+        float(value)
+    except OverflowError:
+        return "is too large to convert to float"
+    return None
+
+# --- 1. 讀取輸入 ---
+
+class ScoreBatch:
+    """
+    一批任務的輸入：每個參數一個 float64 欄位 (缺少的欄位以預設值填入)。
+
+    raw 保留每個任務原始的參數值 (例如整數 4 而不是 4.0)，讓寫出的 output.json
+    與 score_calculator.calculate_plan_d_score 的結果完全相同。
+    """
+
+    def __init__(self, tasks, records, output_paths=None, errors=None):
+        self.tasks = list(tasks)
+        self.raw = records
+        self.output_paths = output_paths or [None] * len(self.tasks)
+        self.errors = errors or [None] * len(self.tasks)
+        self.rows = []
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def build_columns(self, defaults=SCORE_DEFAULTS):
+        """
+        將原始記錄轉為 NumPy 欄位。rows 為每個任務 (參數順序同 SCORE_PARAMS) 的原始值，
+        寫出結果時直接用來組成 input_parameters。
+        不是數字的值 (字串、null) 與超出 float 範圍的整數在 calculate_plan_d_score 中會計算失敗，
+        這裡記錄錯誤並以 NaN 填入。
+        """
+        default_values = [defaults[name] for name in SCORE_PARAMS]
+        empty = {}
+        self.rows = [tuple(map((record if record is not None else empty).get, SCORE_PARAMS, default_values))
+                     for record in self.raw]
+
+        matrix = None
+        if set(map(type, chain.from_iterable(self.rows))) <= _NUMBER_TYPES:
+            try:
+                matrix = np.array(self.rows, dtype=np.float64).reshape(len(self.rows), len(SCORE_PARAMS))
+            except OverflowError:
+                pass   # 有超出 float 範圍的整數 (例如 10**400)，改用下面的逐值檢查
+        if matrix is None:
+            # 少數任務含無法轉為 float 的值：以物件陣列找出這些任務，整列設為 NaN 後再轉為 float64。
+            # 先只依型別篩選；轉換時溢位 (有超出 float 範圍的整數) 才逐值檢查
+            n, width = len(self.rows), len(SCORE_PARAMS)
+            values = list(chain.from_iterable(self.rows))
+            ok = np.fromiter(map(_NUMBER_TYPES.__contains__, map(type, values)),
+                             dtype=bool, count=n * width).reshape(n, width)
+            objects = np.empty((n, width), dtype=object)
+            objects[:] = self.rows
+            objects[~ok.all(axis=1)] = np.nan
+            try:
+                matrix = objects.astype(np.float64)
+            except OverflowError:
+                ok = np.fromiter((_float_error(value) is None for value in values),
+                                 dtype=bool, count=n * width).reshape(n, width)
+                objects[~ok.all(axis=1)] = np.nan
+                matrix = objects.astype(np.float64)
+            for i in np.flatnonzero(~ok.all(axis=1)):
+                if self.errors[i] is None:
+                    j = int(np.argmin(ok[i]))
+                    self.errors[i] = f"Calculation failed: parameter {SCORE_PARAMS[j]} {_float_error(self.rows[i][j])}"
+
+        for i, record in enumerate(self.raw):
+            if record is None:
+                matrix[i] = np.nan
+        self.columns = {name: np.ascontiguousarray(matrix[:, j]) for j, name in enumerate(SCORE_PARAMS)}
+        return self
+
+def load_glob(pattern=TASK_GLOB):
+    """
+    讀取符合 pattern 的所有 input.json；任務 ID 為所在資料夾名稱，
+    對應的輸出路徑為同一資料夾的 output.json。
+    """
+    paths = sorted(glob.glob(pattern))
+    tasks, records, outputs, errors = [], [], [], []
+    for path in paths:
+        folder = os.path.dirname(path)
+        tasks.append(os.path.basename(folder) or path)
+        outputs.append(os.path.join(folder, 'output.json'))
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                record = json.load(f)
+            if not isinstance(record, dict):
+                raise ValueError("內容不是 JSON 物件")
+            records.append(record)
+            errors.append(None)
+        except (OSError, ValueError) as e:
+            records.append(None)
+            errors.append(f"Error: Failed to read '{path}': {e}")
+    return ScoreBatch(tasks, records, outputs, errors)
+
+def _task_output_path(task):
+    return os.path.join('json', 'task', task, 'output.json')
+
+def load_jsonl(path):
+    """每行一個 JSON 物件；任務 ID 取自 'task' 或 'id' 欄位，沒有時以行號命名。"""
+    tasks, records, errors = [], [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("內容不是 JSON 物件")
+                error = None
+            except ValueError as e:
+                record, error = None, f"Error: line {line_no}: {e}"
+            task = str((record or {}).get('task') or (record or {}).get('id') or f"line_{line_no}")
+            tasks.append(task)
+            records.append(record)
+            errors.append(error)
+    return ScoreBatch(tasks, records, [_task_output_path(t) for t in tasks], errors)
+
+def load_csv(path):
+    """第一行為欄位名稱；空白欄位使用預設值。任務 ID 取自 'task' 或 'id' 欄位。"""
+    tasks, records, errors = [], [], []
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row_no, row in enumerate(csv.DictReader(f), 1):
+            record, error = {}, None
+            for name in SCORE_PARAMS:
+                text = (row.get(name) or '').strip()
+                if not text:
+                    continue
+                try:
+                    record[name] = float(text)
+                except ValueError:
+                    record[name] = text
+            tasks.append(str(row.get('task') or row.get('id') or f"row_{row_no}"))
+            records.append(record)
+            errors.append(error)
+    return ScoreBatch(tasks, records, [_task_output_path(t) for t in tasks], errors)
+
+def load_store(store=None, start=None, end=None):
+    """從任務資料庫 (task_store.py) 一次讀取所有 (或建立時間在 [start, end) 之間的) 任務輸入。"""
+    import task_store
+    store = store or task_store.TaskStore()
+    tasks, records, errors = [], [], []
+    for record in store.range(start, end, columns=('input',)):
+        if record['input'] is None:
+            continue
+        tasks.append(record['task'])
+        records.append(record['input'] if isinstance(record['input'], dict) else None)
+        errors.append(None if records[-1] is not None else "Error: input 不是 JSON 物件")
+    return ScoreBatch(tasks, records, [_task_output_path(t) for t in tasks], errors)
+
+def load_inputs(source=TASK_GLOB):
+    """
+    依 source 的形式選擇讀取方式：'store' (任務資料庫)、.jsonl / .csv 檔案、
+    資料夾 (底下的 */input.json) 或 glob 樣式。
+    """
+    if source == 'store':
+        return load_store()
+    if source.endswith('.jsonl'):
+        return load_jsonl(source)
+    if source.endswith('.csv'):
+        return load_csv(source)
+    if os.path.isdir(source):
+        source = os.path.join(source, '*', 'input.json')
+    return load_glob(source)
+
+# --- 2. 向量化計算 ---
+
+def score_columns(columns):
+    """
+    以 NumPy 欄位計算 PLAN D 分數，運算順序與 calculate_plan_d_score 相同。
+    np.power 與 Python 的 ** 偶爾相差 1 ulp，四捨五入到小數第二位後看不出來 (很大的值除外，見 score_batch)。
+
+    Returns:
+        tuple: (total, incentive, penalty) 三個 float64 陣列。
+    """
+    col = columns
+    with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+        incentive = col['r'] * col['T_est'] * col['P'] \
+            * (1 + I_WEIGHT * (col['I'] - LEVEL_BASE)) \
+            * (1 + D_WEIGHT * (col['D'] - LEVEL_BASE)) \
+            * np.power(col['c'], col['mu'])
+        penalty = (DISTRACT_PENALTY * col['T_distract']) + (PHONE_PENALTY * col['T_phone'])
+        total = incentive + penalty
+    return total, incentive, penalty
+
+def _power_errors(c, mu):
+    """
+    c ** mu 在 Python 中會拋出例外 (或得到複數) 的任務，回傳 {索引: 錯誤訊息}：
+    負數的 c 配上非整數的 mu (複數)、0 的負數次方，以及有限值相乘方後超出 float 範圍。
+    其他運算 (乘法、加法) 溢位時 Python 與 NumPy 一樣得到 inf / nan，不算錯誤。
+    """
+    with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+        finite = np.isfinite(c) & np.isfinite(mu)
+        power = np.power(c, mu)
+        checks = (
+            (finite & (c < 0) & (mu != np.floor(mu)), "result is not a real number"),
+            (finite & (c == 0) & (mu < 0), "0.0 cannot be raised to a negative power"),
+            (finite & ~np.isfinite(power), "(34, 'Numerical result out of range')"),
+        )
+    errors = {}
+    for mask, message in checks:
+        for i in np.flatnonzero(mask):
+            errors.setdefault(int(i), f"Calculation failed: {message}")
+    return errors
+
+def _rescore_large(batch, total, incentive, penalty, limit=1e13):
+    """
+    |incentive| 大於 limit 時，np.power 的 1 ulp 誤差在四捨五入到小數第二位後仍看得出來；
+    這些 (很少見的) 任務以 Python 依相同順序重新計算，結果與 calculate_plan_d_score 相同。
+    """
+    with np.errstate(invalid='ignore'):
+        large = np.flatnonzero(np.isfinite(incentive) & (np.abs(incentive) > limit))
+    for i in large:
+        values = dict(zip(SCORE_PARAMS, batch.rows[i]))
+        try:
+            value = values['r'] * values['T_est'] * values['P'] \
+                * (1 + I_WEIGHT * (values['I'] - LEVEL_BASE)) \
+                * (1 + D_WEIGHT * (values['D'] - LEVEL_BASE)) \
+                * (values['c'] ** values['mu'])
+            if isinstance(value, complex):
+                continue
+            incentive[i] = value
+            total[i] = value + penalty[i]
+        except (OverflowError, TypeError, ZeroDivisionError):
+            pass   # 這些任務已由 _power_errors 記錄為錯誤
+
+def score_batch(batch, defaults=SCORE_DEFAULTS):
+    """
+    計算整批分數，與 calculate_plan_d_score 判定失敗的條件相同：c ** mu 在 Python 中
+    會失敗的任務 (見 _power_errors) 記錄為錯誤；其餘運算溢位時和 Python 一樣回傳 inf / nan。
+
+    唯一的差異是超出 float 範圍的整數參數 (例如 r = 10**400)：這裡一律記錄為錯誤，
+    Python 的整數運算在少數情況下 (例如 P = 0 使乘積為整數 0) 仍可算出結果。
+
+    Returns:
+        dict: 'total'、'incentive'、'penalty' 陣列與每個任務的 'errors' 列表。
+    """
+    batch.build_columns(defaults)
+    total, incentive, penalty = score_columns(batch.columns)
+    _rescore_large(batch, total, incentive, penalty)
+    errors = list(batch.errors)
+    for i, message in _power_errors(batch.columns['c'], batch.columns['mu']).items():
+        if errors[i] is None:
+            errors[i] = message
+    for i, record in enumerate(batch.raw):
+        if record is None and errors[i] is None:
+            errors[i] = "Calculation failed: missing input"
+    return {'total': total, 'incentive': incentive, 'penalty': penalty, 'errors': errors}
+
+# --- 3. 輸出 ---
+
+def round2(values):
+    """
+    與 Python round(x, 2) 完全相同的向量化四捨五入。
+    np.round 先乘以 100 再取整，只有在 x * 100 非常接近 .5、或 x 大到 x * 100 失去精度 (甚至溢位) 時
+    才可能與 round 不同，這些值 (以及非有限值) 改用 Python 的 round 重新計算。
+    """
+    with np.errstate(invalid='ignore', over='ignore'):
+        rounded = np.round(values, 2)
+        scaled = values * 100
+        suspect = ~(np.abs(scaled - np.floor(scaled) - 0.5) > 1e-6 * np.maximum(1.0, np.abs(scaled)))
+        suspect |= np.abs(values) > 1e13
+    for i in np.flatnonzero(suspect & np.isfinite(values)):
+        rounded[i] = round(float(values[i]), 2)
+    return rounded.tolist()
+
+def iter_results(batch, scores):
+    """
+    依序產生 (任務 ID, 結果 dict)，格式與 calculate_plan_d_score 相同；失敗時為 {"error": ...}。
+    """
+    totals = round2(scores['total'])
+    incentives = round2(scores['incentive'])
+    penalties = round2(scores['penalty'])
+    errors = scores['errors']
+    for i, task in enumerate(batch.tasks):
+        if errors[i] is not None:
+            yield task, {"error": errors[i]}
+            continue
+        yield task, {
+            "total_score": totals[i],
+            "incentive_score": incentives[i],
+            "penalty_score": penalties[i],
+            "input_parameters": dict(zip(SCORE_PARAMS, batch.rows[i])),
+            "description": RESULT_DESCRIPTION,
+        }
+
+def _atomic_open(path):
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    return tmp_path, open(tmp_path, 'w', encoding='utf-8', newline='')
+
+def write_jsonl(path, results):
+    """每行一個 {"task": ..., 結果欄位...} 物件。"""
+    tmp_path, f = _atomic_open(path)
+    with f:
+        for task, result in results:
+            f.write(json.dumps(dict(task=task, **result), ensure_ascii=False))
+            f.write('\n')
+    os.replace(tmp_path, path)
+
+def write_csv(path, results):
+    """每個任務一列，欄位為分數、所有輸入參數與錯誤訊息。"""
+    tmp_path, f = _atomic_open(path)
+    with f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_FIELDS)
+        for task, result in results:
+            params = result.get('input_parameters', {})
+            writer.writerow([task, result.get('total_score'), result.get('incentive_score'),
+                             result.get('penalty_score')] + [params.get(name) for name in SCORE_PARAMS]
+                            + [result.get('error', '')])
+    os.replace(tmp_path, path)
+
+def write_task_outputs(batch, results):
+    """將每個任務的結果寫入各自的 output.json (失敗的任務不寫入)，回傳成功寫入的數量。"""
+    written = 0
+    for (task, result), output_path in zip(results, batch.output_paths):
+        if "error" in result or output_path is None:
+            continue
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        written += bool(write_json(output_path, result))
+    return written
+
+def store_results(batch, results, store=None):
+    """以一個交易將成功的任務輸入與分數寫入任務資料庫，回傳寫入的數量。"""
+    import task_store
+    store = store or task_store.default_store() or task_store.TaskStore()
+    records = [{'task': task, 'input': batch.raw[i], 'score': result}
+               for i, (task, result) in enumerate(results) if "error" not in result]
+    store.put_many(records)
+    return len(records)
+
+def run_batch(source=TASK_GLOB, jsonl_path=None, csv_path=None, write_outputs=False, defaults=SCORE_DEFAULTS,
+              store=False):
+    """
+    讀取、計算並寫出一整批任務的分數。
+
+    Args:
+        source (str): glob 樣式、資料夾、.jsonl 或 .csv 檔案。
+        jsonl_path / csv_path (str, optional): 彙總輸出檔案。
+        write_outputs (bool): 是否同時寫入每個任務的 output.json。
+        defaults (dict): 參數預設值 (可覆寫部分常數重新計分)。
+        store (bool): 是否將結果寫入任務資料庫 (task_store.py)。
+
+    Returns:
+        dict: 任務數、失敗數與各階段耗時。
+    """
+    t0 = time.perf_counter()
+    batch = load_inputs(source)
+    t1 = time.perf_counter()
+    scores = score_batch(batch, defaults)
+    t2 = time.perf_counter()
+    results = list(iter_results(batch, scores))
+    if jsonl_path:
+        write_jsonl(jsonl_path, results)
+    if csv_path:
+        write_csv(csv_path, results)
+    written = write_task_outputs(batch, results) if write_outputs else 0
+    stored = store_results(batch, results) if store else 0
+    t3 = time.perf_counter()
+    return {
+        'tasks': len(batch),
+        'failed': sum(1 for error in scores['errors'] if error is not None),
+        'written': written,
+        'stored': stored,
+        'load_s': t1 - t0, 'score_s': t2 - t1, 'write_s': t3 - t2,
+    }
+
+# --- 4. 命令列 ---
+
+def parse_overrides(items):
+    """將 ['r=35', 'mu=1.3'] 轉為覆寫後的預設值 dict。"""
+    defaults = dict(SCORE_DEFAULTS)
+    for item in items:
+        name, _, value = item.partition('=')
+        if name not in defaults:
+            raise ValueError(f"未知的參數: {name} (可用: {', '.join(SCORE_PARAMS)})")
+        defaults[name] = float(value)
+    return defaults
+
+if __name__ == "__main__":
+    # 用法:
+    #   python batch_score.py --write-outputs
+    #   python batch_score.py history.jsonl --jsonl scores.jsonl --csv scores.csv --default r=35
+    #   python batch_score.py store --store     (從任務資料庫讀取並寫回)
+    parser = argparse.ArgumentParser(description="以 NumPy 向量化批次計算 PLAN D 分數。")
+    parser.add_argument('source', nargs='?', default=TASK_GLOB,
+                        help="'store' (任務資料庫)、glob 樣式、資料夾、.jsonl 或 .csv (預設為所有任務)")
+    parser.add_argument('--jsonl', help="彙總輸出 JSONL 路徑")
+    parser.add_argument('--csv', help="彙總輸出 CSV 路徑")
+    parser.add_argument('--write-outputs', action='store_true', help="寫入每個任務的 output.json")
+    parser.add_argument('--store', action='store_true', help="將結果寫入任務資料庫 (task_store.py)")
+    parser.add_argument('--default', action='append', default=[], metavar='NAME=VALUE',
+                        help="覆寫缺少欄位時使用的預設值 (可重複)")
+    args = parser.parse_args()
+
+    try:
+        defaults = parse_overrides(args.default)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    if not (args.jsonl or args.csv or args.write_outputs or args.store):
+        print("❗ 未指定輸出 (--jsonl / --csv / --write-outputs / --store)，只計算不寫出。")
+
+    summary = run_batch(args.source, args.jsonl, args.csv, args.write_outputs, defaults, args.store)
+    print(f"✅ 計分完成: {summary['tasks']} 個任務，失敗 {summary['failed']}，"
+          f"寫入 output.json {summary['written']} 個，寫入資料庫 {summary['stored']} 個")
+    print(f"   讀取 {summary['load_s'] * 1000:.1f} ms / 計算 {summary['score_s'] * 1000:.1f} ms / "
+          f"寫出 {summary['write_s'] * 1000:.1f} ms")
+    sys.exit(0 if summary['failed'] == 0 else 1)
@@ -0,0 +1,72 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import numpy as np
+from PIL import Image
+
+from generate_donut_ratio import cut_filled_sector, cut_missing_sector, assemble_donut_parts, FULL_SCORE
+from donut_animation import FillAnimator, save_animation, EXTENSIONS
+
+# --- 基準測試設定 ---
+TASK = "task_20251213_045454"
+FRAMES = 60
+SCORE = 200.0
+
+def render_frame(color_path, gray_path, score):
+    """原本的做法：每一幀都重新解碼、產生遮罩、合成一次。"""
+    with redirect_stdout(io.StringIO()):
+        filled = cut_filled_sector(Image.open(color_path), score, FULL_SCORE)
+        missing = cut_missing_sector(Image.open(gray_path), score, FULL_SCORE)
+        return assemble_donut_parts(filled, missing)
+
+def run(task=TASK, frames=FRAMES, score=SCORE):
+    color_path = os.path.join('images', 'donut', f'donut_{task}.png')
+    gray_path = os.path.join('images', 'donut_gray', f'donut_gray_{task}.png')
+    steps = [score * i / (frames - 1) for i in range(frames - 1)] + [score]
+
+    t0 = time.perf_counter()
+    render_frame(color_path, gray_path, score)
+    t_single = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    reference = [render_frame(color_path, gray_path, s) for s in steps]
+    t_naive = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    animator = FillAnimator(Image.open(color_path), Image.open(gray_path))
+    rendered = list(animator.rgba_frames(score, frames))
+    t_frames = time.perf_counter() - t0
+
+    same = all(np.array_equal(np.asarray(a), np.asarray(b)) for a, b in zip(reference, rendered))
+    print(f"{frames} 幀 {rendered[0].size[0]}px，分數 {score} (本機 CPU 核心數: {os.cpu_count()})")
+    print(f"  單張渲染:                {t_single * 1000:>9.1f} ms")
+    print(f"  逐幀重新渲染:            {t_naive * 1000:>9.1f} ms")
+    print(f"  FillAnimator 產生全部幀: {t_frames * 1000:>9.1f} ms  ({t_naive / t_frames:.1f}x)，"
+          f"逐幀相同: {'✅' if same else '❌'}")
+
+    work_dir = tempfile.mkdtemp(prefix='bench_animation_')
+    try:
+        for fmt in EXTENSIONS:
+            for delta in (True, False):
+                t0 = time.perf_counter()
+                if fmt == 'gif':
+                    frames_for_fmt = list(animator.palette_frames(score, frames))
+                else:
+                    frames_for_fmt = rendered
+                output_path = os.path.join(work_dir, f"{fmt}_{delta}{EXTENSIONS[fmt]}")
+                save_animation(frames_for_fmt, output_path, fmt, delta=delta)
+                elapsed = time.perf_counter() - t0
+                size_kb = os.path.getsize(output_path) / 1024
+                print(f"  編碼 {fmt.upper():<4} {'差異幀' if delta else '完整幀'}:      {elapsed * 1000:>9.1f} ms  {size_kb:>8.0f} KB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return same
+
+if __name__ == "__main__":
+    # 用法: python bench_animation.py [任務 ID]
+    sys.exit(0 if run(sys.argv[1] if len(sys.argv) > 1 else TASK) else 1)
@@ -0,0 +1,69 @@
+from PIL import Image, ImageOps, ImageEnhance
+import numpy as np
+import contextlib
+import glob
+import io
+import os
+import sys
+
+from bench_util import random_image, best_time
+from generate_to_gray_lowcontrast import to_gray_low_contrast, to_gray_low_contrast_batch
+
+# --- 基準測試設定 ---
+SIZE = 1024
+CONTRAST_FACTORS = (0.0, 0.25, 0.5, 1.0, 1.5)
+DONUT_GLOB = os.path.join('images', 'donut', '*.png')
+REPEAT = 5
+BATCH_IMAGES = 8
+
+def legacy_gray_low_contrast(img, contrast_factor=0.5):
+    """原本 split → convert('L') → ImageEnhance.Contrast → colorize → merge 的作法 (作為對照組)。"""
+    R, G, B, A = img.convert("RGBA").split()
+    gray = Image.merge("RGB", (R, G, B)).convert('L')
+    gray = ImageEnhance.Contrast(gray).enhance(contrast_factor)
+    rgb = ImageOps.colorize(gray, black="black", white="white").convert("RGB")
+    return Image.merge('RGBA', rgb.split()[:3] + (A,))
+
+def sample_images():
+    """專案中已有的甜甜圈圖片 + 隨機 RGBA 圖片。"""
+    images = [Image.open(path).convert("RGBA") for path in sorted(glob.glob(DONUT_GLOB))]
+    return images + [random_image(SIZE, seed=i) for i in range(2)]
+
+def check_parity(images):
+    """逐像素比對融合核心 (單張與批次) 與原本作法的輸出，回傳是否全部相同。"""
+    ok = True
+    for factor in CONTRAST_FACTORS:
+        expected = [np.asarray(legacy_gray_low_contrast(img, factor)) for img in images]
+        single = [np.asarray(to_gray_low_contrast(img, factor)) for img in images]
+        batch = [np.asarray(out) for out in to_gray_low_contrast_batch(images, factor)]
+        mismatched = sum(not np.array_equal(e, s) for e, s in zip(expected, single))
+        mismatched += sum(not np.array_equal(e, b) for e, b in zip(expected, batch))
+        print(f"  係數 {factor:<4}: {'✅ 相同' if not mismatched else f'❌ {mismatched} 張不同'}")
+        ok = ok and not mismatched
+    return ok
+
+def run(repeat=REPEAT):
+    images = sample_images()
+    print(f"--- 一致性檢查 ({len(images)} 張圖片) ---")
+    with contextlib.redirect_stdout(io.StringIO()):
+        parity = check_parity(images)
+    print(f"  {'✅ 全部一致' if parity else '❌ 結果不一致'}")
+
+    img = random_image(SIZE)
+    batch = [random_image(SIZE, seed=i) for i in range(BATCH_IMAGES)]
+    with contextlib.redirect_stdout(io.StringIO()):
+        t_legacy = best_time(lambda: legacy_gray_low_contrast(img), repeat)
+        t_fused = best_time(lambda: to_gray_low_contrast(img), repeat)
+        t_legacy_batch = best_time(lambda: [legacy_gray_low_contrast(i) for i in batch], repeat)
+        t_batch = best_time(lambda: to_gray_low_contrast_batch(batch), repeat)
+
+    print(f"--- 效能 ({SIZE}x{SIZE}) ---")
+    print(f"  原本作法 (單張):       {t_legacy * 1000:>8.2f} ms")
+    print(f"  融合核心 (單張):       {t_fused * 1000:>8.2f} ms  ({t_legacy / t_fused:.1f}x)")
+    print(f"  原本作法 ({BATCH_IMAGES} 張):       {t_legacy_batch * 1000:>8.2f} ms")
+    print(f"  融合核心批次 ({BATCH_IMAGES} 張):   {t_batch * 1000:>8.2f} ms  ({t_legacy_batch / t_batch:.1f}x)")
+    return parity
+
+if __name__ == "__main__":
+    # 用法: python bench_gray.py [重複次數]；結果不一致時以非零狀態碼結束
+    sys.exit(0 if run(repeat=int(sys.argv[1]) if len(sys.argv) > 1 else REPEAT) else 1)
@@ -0,0 +1,70 @@
+from PIL import Image
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+
+from bench_util import random_image, best_time
+from image_intensity import adjust_intensity, adjust_batch
+
+# --- 基準測試設定 ---
+SIZE = 1024
+INTENSITY_FACTOR = 1.5
+REPEAT = 3
+BATCH_IMAGES = 8
+BATCH_WORKERS = 4
+
+def legacy_adjust_intensity(img, intensity_factor):
+    """原本 tempCodeRunnerFile.py 逐像素處理 V 通道的作法 (作為對照組)。"""
+    h, s, v = img.convert("RGB").convert("HSV").split()
+    new_v_data = []
+    for value in v.tobytes():
+        new_value = int(value * intensity_factor)
+        if new_value > 255:
+            new_value = 255
+        elif new_value < 0:
+            new_value = 0
+        new_v_data.append(new_value)
+    v.putdata(new_v_data)
+    return Image.merge("HSV", (h, s, v)).convert("RGB")
+
+def run(repeat=REPEAT):
+    img = random_image(SIZE, mode='RGB')
+
+    legacy = legacy_adjust_intensity(img, INTENSITY_FACTOR)
+    lut = adjust_intensity(img, INTENSITY_FACTOR)
+    same = np.array_equal(np.asarray(legacy), np.asarray(lut))
+    print(f"單張 {SIZE}x{SIZE}，因子 {INTENSITY_FACTOR}，結果相同: {'✅' if same else '❌'}")
+
+    t_legacy = best_time(lambda: legacy_adjust_intensity(img, INTENSITY_FACTOR), repeat)
+    t_lut = best_time(lambda: adjust_intensity(img, INTENSITY_FACTOR), repeat)
+    print(f"  逐像素迴圈: {t_legacy * 1000:>9.2f} ms")
+    print(f"  查找表:     {t_lut * 1000:>9.2f} ms  ({t_legacy / t_lut:.0f}x)")
+
+    # 批次：包含 PNG 解碼 / 編碼的完整檔案流程
+    work_dir = tempfile.mkdtemp(prefix='bench_intensity_')
+    try:
+        input_dir = os.path.join(work_dir, 'in')
+        os.makedirs(input_dir)
+        for i in range(BATCH_IMAGES):
+            random_image(SIZE, seed=i, mode='RGB').save(os.path.join(input_dir, f'img_{i}.png'))
+        output_dir = os.path.join(work_dir, 'out')
+
+        quiet = open(os.devnull, 'w')
+        stdout, sys.stdout = sys.stdout, quiet
+        try:
+            t_single = best_time(lambda: adjust_batch(input_dir, output_dir, INTENSITY_FACTOR, workers=1), repeat)
+            t_pool = best_time(lambda: adjust_batch(input_dir, output_dir, INTENSITY_FACTOR, workers=BATCH_WORKERS), repeat)
+        finally:
+            sys.stdout = stdout
+            quiet.close()
+        print(f"批次 {BATCH_IMAGES} 張 PNG (讀取 + 調整 + 儲存)，本機 CPU 核心數: {os.cpu_count()}")
+        print(f"  1 個執行緒:  {t_single * 1000:>9.2f} ms")
+        print(f"  {BATCH_WORKERS} 個執行緒:  {t_pool * 1000:>9.2f} ms  ({t_single / t_pool:.1f}x)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    # 用法: python bench_intensity.py [重複次數]
+    run(repeat=int(sys.argv[1]) if len(sys.argv) > 1 else REPEAT)
@@ -0,0 +1,43 @@
+from PIL import Image, ImageDraw
+import sys
+
+from bench_util import best_time
+from mask_engine import annular_sector_mask
+
+# --- 基準測試設定 ---
+SIZES = (512, 1024, 4096)
+INNER_RADIUS_RATIO = 0.5
+START_ANGLE = 133.03    # 約為 114 / 300 分的扇形
+END_ANGLE = 270.0
+REPEAT = 5
+SUPERSAMPLE = 4         # Pillow 若要抗鋸齒只能放大繪製後再縮小
+
+def imagedraw_sector_mask(size, R, r, start_angle, end_angle):
+    """原本 generate_donut_ratio.py / merge_segment.py 使用的 ImageDraw 繪製方式。"""
+    cx = cy = size // 2
+    mask = Image.new('L', (size, size), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.pieslice((cx - R, cy - R, cx + R, cy + R), start_angle, end_angle, fill=255)
+    draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=0)
+    return mask
+
+def imagedraw_supersampled_mask(size, R, r, start_angle, end_angle, factor=SUPERSAMPLE):
+    """以 ImageDraw 放大 factor 倍繪製後 BOX 縮小，作為抗鋸齒遮罩的對照組。"""
+    big = imagedraw_sector_mask(size * factor, R * factor, r * factor, start_angle, end_angle)
+    return big.resize((size, size), Image.Resampling.BOX)
+
+def run(sizes=SIZES, repeat=REPEAT):
+    print(f"{'size':>6} | {'ImageDraw':>11} | {'NumPy':>11} | {f'ImageDraw {SUPERSAMPLE}xSS':>14} | {'NumPy AA':>11}")
+    print("-" * 67)
+    for size in sizes:
+        R = size // 2
+        r = int(R * INNER_RADIUS_RATIO)
+        t_draw = best_time(lambda: imagedraw_sector_mask(size, R, r, START_ANGLE, END_ANGLE), repeat)
+        t_np = best_time(lambda: annular_sector_mask(size, size, R, r, START_ANGLE, END_ANGLE), repeat)
+        t_ss = best_time(lambda: imagedraw_supersampled_mask(size, R, r, START_ANGLE, END_ANGLE), repeat)
+        t_aa = best_time(lambda: annular_sector_mask(size, size, R, r, START_ANGLE, END_ANGLE, antialias=True), repeat)
+        print(f"{size:>6} | {t_draw * 1000:>8.2f} ms | {t_np * 1000:>8.2f} ms | {t_ss * 1000:>11.2f} ms | {t_aa * 1000:>8.2f} ms")
+
+if __name__ == "__main__":
+    # 用法: python bench_masks.py [重複次數]
+    run(repeat=int(sys.argv[1]) if len(sys.argv) > 1 else REPEAT)
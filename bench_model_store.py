@@ -0,0 +1,139 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import model_store
+
+# --- 基準測試設定 ---
+TENSOR_MB = 4          # 每個 safetensors 檔案的大小 (MB)
+
+def write_safetensors(path, tensors):
+    """寫出最小的 safetensors 檔案：8 位元組標頭長度 + JSON 標頭 + 依序排列的張量資料。"""
+    header, offset = {'__metadata__': {'format': 'pt'}}, 0
+    for name, array in tensors.items():
+        header[name] = {'dtype': 'F32', 'shape': list(array.shape),
+                        'data_offsets': [offset, offset + array.nbytes]}
+        offset += array.nbytes
+    header_bytes = json.dumps(header).encode('utf-8')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for array in tensors.values():
+            f.write(array.astype(np.float32).tobytes())
+
+def make_model(root, mb=TENSOR_MB, seed=0):
+    """建立 diffusers 目錄結構的迷你模型 (model_index.json、各元件的 config 與 safetensors 權重)。"""
+    rng = np.random.default_rng(seed)
+    count = mb * 1024 * 1024 // 4
+    with open(os.path.join(root, 'model_index.json'), 'w', encoding='utf-8') as f:
+        json.dump({'_class_name': 'StableDiffusionXLPipeline'}, f)
+    for component, weights in (('unet', 'diffusion_pytorch_model.safetensors'),
+                               ('text_encoder', 'model.safetensors')):
+        os.makedirs(os.path.join(root, component), exist_ok=True)
+        with open(os.path.join(root, component, 'config.json'), 'w', encoding='utf-8') as f:
+            json.dump({'component': component}, f)
+        write_safetensors(os.path.join(root, component, weights),
+                          {'weight': rng.standard_normal(count // 2, dtype=np.float32),
+                           'bias': rng.standard_normal(count - count // 2, dtype=np.float32)})
+
+def same_files(source, mirror):
+    """來源與鏡像的每個檔案內容都相同。"""
+    for rel in model_store.scan_source(source):
+        with open(os.path.join(source, rel), 'rb') as a, open(os.path.join(mirror, rel), 'rb') as b:
+            if a.read() != b.read():
+                return False
+    return True
+
+def quiet(func, *args):
+    """執行 func 並攔截輸出，回傳 (結果, 輸出文字, 秒數)。"""
+    buffer = io.StringIO()
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(buffer):
+        result = func(*args)
+    return result, buffer.getvalue(), time.perf_counter() - t0
+
+def run(mb=TENSOR_MB):
+    root = tempfile.mkdtemp(prefix='bench_model_store_')
+    try:
+        source, mirror = os.path.join(root, 'sdxl_base'), os.path.join(root, 'mirror')
+        os.makedirs(source)
+        make_model(source, mb)
+        weights = 'unet/diffusion_pytorch_model.safetensors'
+        checks = {}
+
+        # 1. 第一次同步：全部複製
+        result, _, t_first = quiet(model_store.sync_mirror, source, mirror)
+        checks['第一次同步內容相同'] = result == mirror and same_files(source, mirror)
+        checks['第一次同步驗證通過'] = quiet(model_store.verify_mirror, mirror)[0]
+
+        # 2. 來源沒有變動：不複製任何檔案
+        inode = os.stat(os.path.join(mirror, weights)).st_ino
+        _, out, t_noop = quiet(model_store.sync_mirror, source, mirror)
+        checks['未變動時不重新複製'] = '複製 0 個檔案' in out and os.stat(os.path.join(mirror, weights)).st_ino == inode
+
+        # 3. 中斷後續傳：鏡像只剩一半的 .part 檔案
+        src_path, dest_path = os.path.join(source, weights), os.path.join(mirror, weights)
+        st = os.stat(src_path)
+        os.remove(dest_path)
+        with open(src_path, 'rb') as f, open(dest_path + model_store.PART_SUFFIX, 'wb') as part:
+            part.write(f.read(st.st_size // 2))
+        with open(dest_path + model_store.PART_SUFFIX + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'size': st.st_size, 'mtime_ns': st.st_mtime_ns}, f)
+        _, out, t_resume = quiet(model_store.sync_mirror, source, mirror)
+        manifest = model_store.read_manifest(mirror)
+        checks['從 .part 繼續複製'] = ('繼續複製' in out and same_files(source, mirror)
+                                       and not os.path.exists(dest_path + model_store.PART_SUFFIX)
+                                       and manifest['files'][weights]['sha256'] == model_store.file_sha256(src_path))
+
+        # 4. 來源已變動的 .part 不可續傳，必須從頭複製
+        with open(dest_path + model_store.PART_SUFFIX, 'wb') as part:
+            part.write(b'\0' * 1024)
+        with open(dest_path + model_store.PART_SUFFIX + '.json', 'w', encoding='utf-8') as f:
+            json.dump({'size': st.st_size, 'mtime_ns': st.st_mtime_ns - 1}, f)
+        os.remove(dest_path)
+        _, out, _ = quiet(model_store.sync_mirror, source, mirror)
+        checks['來源變動時從頭複製'] = '繼續複製' not in out and same_files(source, mirror)
+
+        # 5. verify_mirror 能發現截斷與標頭範圍錯誤的權重
+        with open(dest_path, 'r+b') as f:
+            f.truncate(st.st_size - 4)
+        checks['發現截斷的檔案'] = not quiet(model_store.verify_mirror, mirror)[0]
+        with open(dest_path, 'r+b') as f:
+            f.truncate(st.st_size)
+        header, data_start = model_store.read_safetensors_header(dest_path)
+        header['bias']['data_offsets'][1] += 4
+        header_bytes = json.dumps(header).encode('utf-8').ljust(data_start - 8)
+        with open(dest_path, 'r+b') as f:
+            f.write(struct.pack('<Q', len(header_bytes)) + header_bytes)
+        checks['發現超出範圍的張量'] = not quiet(model_store.verify_mirror, mirror)[0]
+
+        # 6. --verify 重新計算雜湊，修復損毀的檔案；來源刪除的檔案也從鏡像移除
+        os.remove(os.path.join(source, 'text_encoder', 'config.json'))
+        _, out, _ = quiet(model_store.sync_mirror, source, mirror, True)
+        checks['--verify 修復損毀的檔案'] = '雜湊值與清單不符' in out and same_files(source, mirror)
+        checks['移除來源已刪除的檔案'] = (not os.path.exists(os.path.join(mirror, 'text_encoder', 'config.json'))
+                                          and quiet(model_store.verify_mirror, mirror)[0])
+
+        size_mb = sum(size for size, _ in model_store.scan_source(source).values()) / 1024 / 1024
+        print(f"迷你 diffusers 模型 ({size_mb:.1f} MB)")
+        print(f"  第一次同步:         {t_first * 1000:>8.1f} ms")
+        print(f"  未變動時再次同步:   {t_noop * 1000:>8.1f} ms")
+        print(f"  從一半的 .part 續傳: {t_resume * 1000:>8.1f} ms")
+        for name, ok in checks.items():
+            print(f"  {name}: {'✅' if ok else '❌'}")
+        return all(checks.values())
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    # 用法: python bench_model_store.py [每個權重檔案的 MB 數]
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else TENSOR_MB) else 1)
@@ -0,0 +1,113 @@
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+from score_calculator import calculate_plan_d_score, score_file, SCORE_PARAMS
+from batch_score import ScoreBatch, score_batch, iter_results, run_batch
+
+# --- 基準測試設定 ---
+PARITY_RECORDS = 20000
+FILE_TASKS = 2000
+COMPUTE_RECORDS = 100000
+
+def random_record(rng):
+    """隨機產生一筆輸入：混合整數 / 浮點數、缺少的欄位、少數會溢位與會計算失敗的值。"""
+    record = {}
+    for name in SCORE_PARAMS:
+        roll = rng.random()
+        if roll < 0.1:
+            continue                                    # 缺少欄位 → 預設值
+        if roll < 0.4:
+            record[name] = rng.randint(-2, 6)           # 整數
+        else:
+            record[name] = round(rng.uniform(-1, 10), rng.randint(0, 4))
+    if rng.random() < 0.01:
+        record[rng.choice(SCORE_PARAMS)] = rng.choice([1e300, -1e300, 400, 1e-300])  # 溢位 / 0 的負數次方
+    if rng.random() < 0.01:
+        record[rng.choice(SCORE_PARAMS)] = rng.choice(["3", None])  # 非數字
+    return record
+
+def parity(n=PARITY_RECORDS, seed=0):
+    """逐筆比較 calculate_plan_d_score 與批次計算的結果 (包含錯誤的任務)。"""
+    rng = random.Random(seed)
+    records = [random_record(rng) for _ in range(n)]
+    batch = ScoreBatch([f"t{i}" for i in range(n)], records)
+    mismatches = 0
+    for record, (_, result) in zip(records, iter_results(batch, score_batch(batch))):
+        expected = calculate_plan_d_score(record)
+        if "error" in expected or "error" in result:
+            # 錯誤訊息的文字不同，只要求兩邊都判定為失敗
+            same = ("error" in expected) == ("error" in result)
+        else:
+            # inf - inf 等溢位結果為 nan，nan != nan，改比較序列化後的文字
+            same = expected == result or json.dumps(expected, sort_keys=True) == json.dumps(result, sort_keys=True)
+        mismatches += not same
+    failed = sum(1 for r in records if "error" in calculate_plan_d_score(r))
+    print(f"一致性檢查 {n} 筆 (其中 {failed} 筆計算失敗): {'✅ 全部相同' if not mismatches else f'❌ {mismatches} 筆不同'}")
+    return mismatches == 0
+
+def bench_compute(n=COMPUTE_RECORDS, seed=1):
+    """純計算：不含檔案讀寫。"""
+    rng = random.Random(seed)
+    records = [random_record(rng) for _ in range(n)]
+
+    t0 = time.perf_counter()
+    for record in records:
+        calculate_plan_d_score(record)
+    t_loop = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    batch = ScoreBatch([f"t{i}" for i in range(n)], records)
+    scores = score_batch(batch)
+    t_scores = time.perf_counter() - t0
+    list(iter_results(batch, scores))
+    t_batch = time.perf_counter() - t0
+    print(f"純計算 {n} 筆")
+    print(f"  逐筆迴圈 (含結果 dict): {t_loop * 1000:>9.1f} ms")
+    print(f"  批次，只算分數陣列:     {t_scores * 1000:>9.1f} ms  ({t_loop / t_scores:.1f}x)")
+    print(f"  批次，含結果 dict:      {t_batch * 1000:>9.1f} ms  ({t_loop / t_batch:.1f}x)")
+
+def bench_files(n=FILE_TASKS, seed=2):
+    """完整流程：讀取 n 個 input.json 並寫出 output.json。"""
+    rng = random.Random(seed)
+    work_dir = tempfile.mkdtemp(prefix='bench_score_')
+    try:
+        for i in range(n):
+            folder = os.path.join(work_dir, f"task_{i:06d}")
+            os.makedirs(folder)
+            with open(os.path.join(folder, 'input.json'), 'w', encoding='utf-8') as f:
+                json.dump(random_record(rng), f)
+
+        t0 = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            for i in range(n):
+                folder = os.path.join(work_dir, f"task_{i:06d}")
+                score_file(os.path.join(folder, 'input.json'), os.path.join(folder, 'output.json'))
+        t_loop = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        summary = run_batch(work_dir, jsonl_path=os.path.join(work_dir, 'scores.jsonl'))
+        t_summary = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        run_batch(work_dir, write_outputs=True)
+        t_outputs = time.perf_counter() - t0
+        print(f"檔案流程 {n} 個任務 (失敗 {summary['failed']})")
+        print(f"  逐檔 score_file:           {t_loop * 1000:>9.1f} ms")
+        print(f"  批次 → 單一 JSONL:         {t_summary * 1000:>9.1f} ms  ({t_loop / t_summary:.1f}x)")
+        print(f"  批次 → 每個任務 output.json: {t_outputs * 1000:>9.1f} ms  ({t_loop / t_outputs:.1f}x)")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    # 用法: python bench_score.py
+    ok = parity()
+    bench_compute()
+    bench_files()
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,115 @@
+from multiprocessing.connection import Client
+from multiprocessing import AuthenticationError
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import io
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+import sdxl_daemon
+from sdxl_daemon import SDXLDaemon, stub_pipeline_factory, make_job, request, generate, run_jobs
+
+# --- 基準測試設定 ---
+JOBS = 8               # generate_many 一次送出的工作數
+CLIENTS = 4            # 同時各送一個 generate 的用戶端數
+SHUTDOWN_TIMEOUT = 5.0
+
+def stub_jobs(output_dir, n, prefix='img'):
+    """n 個使用替身模型的工作，有指定種子與沒有指定種子的工作交錯出現。"""
+    return [make_job(os.path.join(output_dir, f'{prefix}_{i}.png'), prompt=f"donut {i}",
+                     seed=i if i % 2 else None)
+            for i in range(n)]
+
+def same_pixels(path_a, path_b):
+    with Image.open(path_a) as a, Image.open(path_b) as b:
+        return a.tobytes() == b.tobytes()
+
+def check_daemon(root, jobs, clients):
+    """啟動使用替身模型的常駐程式並檢查各個請求，回傳 (檢查結果, 統計)。"""
+    authkey = secrets.token_bytes(sdxl_daemon.KEY_BYTES)
+    daemon = SDXLDaemon(stub_pipeline_factory, address=('127.0.0.1', 0), authkey=authkey)
+    thread = daemon.start()
+    address = daemon.address
+    checks, stats = {}, {'address': address}
+
+    # 1. ping
+    reply = request({'op': 'ping'}, address, authkey, timeout=SHUTDOWN_TIMEOUT)
+    checks['ping'] = bool(reply and reply['ok'] and reply['pid'] == os.getpid())
+
+    # 2. 單一 generate：圖片與直接呼叫模型的結果相同
+    job = make_job(os.path.join(root, 'single.png'), prompt="donut", seed=7)
+    t0 = time.perf_counter()
+    reply = request({'op': 'generate', 'job': job}, address, authkey)
+    stats['single'] = time.perf_counter() - t0
+    direct = run_jobs(stub_pipeline_factory(), [make_job(os.path.join(root, 'direct.png'), prompt="donut", seed=7)])
+    checks['generate'] = bool(reply['ok'] and same_pixels(reply['output_path'], direct[0]['output_path']))
+
+    # 3. generate_many：全部成功、順序不變，並合併成少數幾次模型呼叫
+    calls = daemon.pipe.calls
+    many = stub_jobs(root, jobs)
+    t0 = time.perf_counter()
+    replies = generate(many, address, authkey, fallback=False)
+    stats['many'] = time.perf_counter() - t0
+    stats['many_calls'] = daemon.pipe.calls - calls
+    checks[f'generate_many ({jobs} 個工作)'] = (
+        len(replies) == jobs and all(r['ok'] for r in replies)
+        and [r['output_path'] for r in replies] == [j['output_path'] for j in many])
+    checks['generate_many 以批次執行'] = stats['many_calls'] < jobs
+
+    # 4. 多個用戶端同時送出工作：全部經由同一個佇列完成
+    concurrent_jobs = stub_jobs(root, clients, prefix='client')
+    with ThreadPoolExecutor(clients) as pool:
+        replies = list(pool.map(
+            lambda j: request({'op': 'generate', 'job': j}, address, authkey, timeout=SHUTDOWN_TIMEOUT),
+            concurrent_jobs))
+    checks[f'{clients} 個用戶端同時送出'] = all(r and r['ok'] and os.path.exists(r['output_path']) for r in replies)
+
+    # 5. 金鑰錯誤的連線被拒絕，常駐程式繼續服務
+    try:
+        Client(address, authkey=b'wrong key').close()
+        rejected = False
+    except AuthenticationError:
+        rejected = True
+    reply = request({'op': 'ping'}, address, authkey)
+    checks['拒絕錯誤的金鑰'] = rejected and bool(reply and reply['ok'])
+    checks['回覆未知的請求'] = request({'op': 'nope'}, address, authkey)['ok'] is False
+
+    # 6. shutdown：執行緒結束、釋放模型、不再接受連線
+    stats['served'] = request({'op': 'ping'}, address, authkey)['jobs_served']
+    reply = request({'op': 'shutdown'}, address, authkey)
+    thread.join(SHUTDOWN_TIMEOUT)
+    checks['shutdown'] = (bool(reply and reply['ok']) and not thread.is_alive()
+                          and daemon.pipe is None
+                          and request({'op': 'ping'}, address, authkey, timeout=0.2) is None)
+    return checks, stats
+
+def run(jobs=JOBS, clients=CLIENTS):
+    root = tempfile.mkdtemp(prefix='bench_sdxl_daemon_')
+    log = io.StringIO()
+    try:
+        # 常駐程式的執行緒也會印出訊息，整段攔截，失敗時才印出
+        with contextlib.redirect_stdout(log):
+            checks, stats = check_daemon(root, jobs, clients)
+
+        host, port = stats['address']
+        print(f"SDXL 常駐程式 (替身模型，{host}:{port})")
+        print(f"  單一 generate:         {stats['single'] * 1000:>8.1f} ms")
+        print(f"  generate_many x{jobs}:     {stats['many'] * 1000:>8.1f} ms  (模型呼叫 {stats['many_calls']} 次)")
+        print(f"  共處理 {stats['served']} 個工作")
+        for name, ok in checks.items():
+            print(f"  {name}: {'✅' if ok else '❌'}")
+        if not all(checks.values()):
+            print(log.getvalue())
+        return all(checks.values())
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    # 用法: python bench_sdxl_daemon.py [generate_many 的工作數]
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else JOBS) else 1)
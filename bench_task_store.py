@@ -0,0 +1,84 @@
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from task_store import TaskStore, layout_paths
+
+# --- 基準測試設定 ---
+TASKS = 5000
+LOOKUPS = 1000
+
+def make_layout(root, n, seed=0):
+    """在 root 底下建立 n 個任務的原本檔案結構 (input.json、output.json、兩個 Prompt 檔案)。"""
+    rng = random.Random(seed)
+    tasks = []
+    for i in range(n):
+        task = f"task_2025{1 + i % 12:02d}{1 + i % 28:02d}_{i % 24:02d}{i % 60:02d}{i // 60 % 60:02d}_{i}"
+        paths = layout_paths(task, root)
+        score = round(rng.uniform(0, 300), 2)
+        for name, content in (('input', {'r': 30.0, 'T_est': rng.uniform(1, 8)}),
+                              ('score', {'total_score': score})):
+            os.makedirs(os.path.dirname(paths[name]), exist_ok=True)
+            with open(paths[name], 'w', encoding='utf-8') as f:
+                json.dump(content, f)
+        for name in ('positive', 'negative'):
+            os.makedirs(os.path.dirname(paths[name]), exist_ok=True)
+            with open(paths[name], 'w', encoding='utf-8') as f:
+                f.write(f"{name} prompt for {task}")
+        tasks.append(task)
+    return tasks
+
+def read_scores_from_files(root, tasks):
+    scores = {}
+    for task in tasks:
+        with open(layout_paths(task, root)['score'], 'r', encoding='utf-8') as f:
+            scores[task] = json.load(f)['total_score']
+    return scores
+
+def run(n=TASKS, lookups=LOOKUPS):
+    root = tempfile.mkdtemp(prefix='bench_task_store_')
+    try:
+        tasks = make_layout(root, n)
+        store = TaskStore(os.path.join(root, 'tasks.sqlite3'))
+
+        t0 = time.perf_counter()
+        store.import_layout(root)
+        t_import = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        from_files = read_scores_from_files(root, tasks)
+        t_files = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        from_store = store.scores(tasks)
+        t_store = time.perf_counter() - t0
+        same = from_files == from_store
+
+        lookups = min(lookups, n)
+        sample = random.Random(1).sample(tasks, lookups)
+        t0 = time.perf_counter()
+        for task in sample:
+            store.prompts(task)
+        t_get = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        in_range = store.range('20250301', '20250401', columns=('total_score',))
+        t_range = time.perf_counter() - t0
+
+        print(f"{n} 個任務 (本機 CPU 核心數: {os.cpu_count()})")
+        print(f"  匯入原本的檔案結構:       {t_import * 1000:>9.1f} ms")
+        print(f"  讀取全部分數 (逐檔 open):  {t_files * 1000:>9.1f} ms")
+        print(f"  讀取全部分數 (一次查詢):   {t_store * 1000:>9.1f} ms  ({t_files / t_store:.1f}x)，結果相同: {'✅' if same else '❌'}")
+        print(f"  以任務 ID 查詢 Prompt x{lookups}: {t_get * 1000:>9.1f} ms")
+        print(f"  依時間範圍查詢 ({len(in_range)} 筆): {t_range * 1000:>9.1f} ms")
+        store.close()
+        return same
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    # 用法: python bench_task_store.py [任務數]
+    sys.exit(0 if run(int(sys.argv[1]) if len(sys.argv) > 1 else TASKS) else 1)
@@ -0,0 +1,19 @@
+from PIL import Image
+import numpy as np
+import time
+
+# bench_*.py 共用的小工具：隨機測試圖片與「取最短耗時」的計時
+
+def random_image(size=1024, seed=0, mode='RGBA'):
+    """size x size 的隨機雜訊圖片 (mode 為 'RGBA' 或 'RGB')，相同 seed 產生相同的圖片。"""
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size, size, len(mode)), dtype=np.uint8))
+
+def best_time(func, repeat=5):
+    """執行 repeat 次並回傳最短耗時 (秒)。"""
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
@@ -0,0 +1,564 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import redirect_stdout
+
+try:
+    import resource
+except ImportError:          # Windows 沒有 resource 模組，改用 psutil (若有安裝)
+    resource = None
+
+# 這個檔案只在頂層匯入標準函式庫：每個案例在獨立的子程序中執行 (見 run_worker)，
+# 各自匯入需要的模組，峰值記憶體 (peak RSS) 才不會互相影響。
+
+# --- 全域配置 ---
+HISTORY_PATH = os.path.join('json', 'bench_history.jsonl')   # 每次執行附加一行 JSON
+REPORT_PATH = 'bench_output.txt'                              # 最近一次的文字報表 (.gitignore 已排除)
+WORK_DIR = os.path.join('.cache', 'benchmark')                # 合成輸入與各案例的輸出
+
+SIZES = (512, 1024, 4096)
+SEGMENT_COUNTS = (3, 50, 1000)
+SEGMENT_SIZE = 1024
+SEGMENT_POOL = 12            # 合併測試中不同圖片的數量 (片段輪流使用)
+SCORE_RECORDS = 20000
+SCORE_DISTRIBUTIONS = ('typical', 'sparse', 'invalid')
+SDXL_STUB_JOBS = (1, 8)
+GEMINI_STUB_JOBS = (10, 50)
+GEMINI_STUB_LATENCY = 0.02   # 替身伺服器每個請求的平均延遲 (秒)
+GEMINI_STUB_ERROR_RATE = 0.1
+
+REPEAT = 3                   # 每個案例最多執行幾次 (取中位數)
+TIME_BUDGET = 10.0           # 單一案例累計超過這個秒數就不再重複
+WORKER_TIMEOUT = 1800        # 單一案例子程序的逾時 (秒)
+
+THRESHOLD = 0.15             # compare 模式：變慢 / 記憶體增加超過 15% 視為退步
+MIN_DELTA_SECONDS = 0.005    # 差距小於此值的時間變化視為雜訊
+MIN_DELTA_RSS_MB = 16.0      # 差距小於此值的記憶體變化視為雜訊
+
+SCORE_TARGET = 300.0         # 與 generate_donut_ratio.FULL_SCORE 相同 (這裡不匯入 PIL)
+SECTOR_SCORE = 123.4         # 裁切案例使用的分數
+
+# --- 1. 合成輸入 ---
+
+def synthetic_image(size, seed=0):
+    """平滑漸層 + 正弦紋理 + 雜訊的 RGB 圖片，壓縮難度接近 SDXL 的輸出。"""
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    channels = []
+    for k in range(3):
+        phase = rng.uniform(0, 2 * np.pi)
+        wave = np.sin((x * (3 + k) + y * (2 + k)) * np.pi * 2 + phase)
+        channels.append(96 + 64 * wave + 48 * (x if k == 0 else y) + rng.normal(0, 12, (size, size)))
+    pixels = np.clip(np.stack(channels, axis=-1), 0, 255).astype(np.uint8)
+    return Image.fromarray(pixels)
+
+def synthetic_mask(size=(545, 539)):
+    """與 images/mask.png 相同形式的偵照遮罩：中央透明，越靠近邊緣越不透明 (alpha 最高約 100)。"""
+    import numpy as np
+    from PIL import Image
+
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    distance = np.hypot((x - width / 2) / (width / 2), (y - height / 2) / (height / 2))
+    alpha = np.clip((distance - 0.75) * 400, 0, 100).astype(np.uint8)
+    pixels = np.zeros((height, width, 4), dtype=np.uint8)
+    pixels[..., :3] = 20
+    pixels[..., 3] = alpha
+    return Image.fromarray(pixels)
+
+def _write_once(path, make):
+    """檔案不存在時才產生 (合成輸入在多次執行之間共用)。"""
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp.png"
+        make().save(tmp_path, 'PNG')
+        os.replace(tmp_path, path)
+    return path
+
+def image_inputs(work_dir, size):
+    """產生 (或沿用) 指定尺寸的生成圖、遮罩、甜甜圈、灰色甜甜圈與兩個扇形。"""
+    from PIL import Image
+    from generate_donut import overlay_mask_image, cut_donut
+    from generate_to_gray_lowcontrast import to_gray_low_contrast
+    from generate_donut_ratio import cut_filled_sector, cut_missing_sector
+
+    folder = os.path.join(work_dir, 'inputs')
+    paths = {name: os.path.join(folder, f"{name}_{size}.png")
+             for name in ('generated', 'donut', 'gray', 'filled', 'missing')}
+    paths['mask'] = os.path.join(folder, 'mask.png')
+
+    _write_once(paths['mask'], synthetic_mask)
+    _write_once(paths['generated'], lambda: synthetic_image(size, seed=size))
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        _write_once(paths['donut'], lambda: cut_donut(overlay_mask_image(
+            Image.open(paths['generated']), Image.open(paths['mask']))))
+        _write_once(paths['gray'], lambda: to_gray_low_contrast(Image.open(paths['donut']).convert("RGBA")))
+        _write_once(paths['filled'], lambda: cut_filled_sector(Image.open(paths['donut']), SECTOR_SCORE, SCORE_TARGET))
+        _write_once(paths['missing'], lambda: cut_missing_sector(Image.open(paths['gray']), SECTOR_SCORE, SCORE_TARGET))
+    return paths
+
+def segment_inputs(work_dir, count, size=SEGMENT_SIZE, seed=0):
+    """
+    合併測試的片段：SEGMENT_POOL 張不同色調的甜甜圈輪流使用，
+    分數隨機但總和約為滿分的 95%，讓每個片段都會被合成。
+    """
+    import random
+    import numpy as np
+    from PIL import Image
+
+    base = image_inputs(work_dir, size)
+    folder = os.path.join(work_dir, 'segments')
+    images = []
+    for k in range(min(count, SEGMENT_POOL)):
+        path = os.path.join(folder, f"segment_{size}_{k:02d}.png")
+
+        def make(k=k):
+            pixels = np.array(Image.open(base['donut']).convert("RGBA"))
+            pixels[..., :3] = np.roll(pixels[..., :3], k % 3, axis=-1) // (1 + k // 3 % 2)
+            return Image.fromarray(pixels)
+
+        images.append(_write_once(path, make))
+
+    rng = random.Random(seed)
+    weights = [rng.uniform(0.2, 1.0) for _ in range(count)]
+    scale = SCORE_TARGET * 0.95 / sum(weights)
+    score_dir = os.path.join(folder, f"scores_{count}")
+    os.makedirs(score_dir, exist_ok=True)
+    segments = []
+    for i, weight in enumerate(weights):
+        score_path = os.path.join(score_dir, f"{i:04d}.json")
+        with open(score_path, 'w', encoding='utf-8') as f:
+            json.dump({'total_score': round(weight * scale, 4)}, f)
+        segments.append({'image_path': images[i % len(images)], 'score_json_path': score_path})
+    return segments
+
+def score_records(distribution, n=SCORE_RECORDS, seed=0):
+    """
+    calculate_plan_d_score 的輸入分布：
+    typical 為實際 input.json 附近的數值、sparse 缺少大部分欄位 (使用預設值)、
+    invalid 有 5% 的紀錄含非數字 (走例外處理路徑)。
+    """
+    import random
+    rng = random.Random(seed)
+    records = []
+    for _ in range(n):
+        record = {'r': 30.0, 'T_est': rng.uniform(0.5, 10), 'P': rng.choice((0.0, 0.5, 1.0)),
+                  'I': rng.randint(1, 5), 'D': rng.randint(1, 5), 'c': rng.uniform(0, 1),
+                  'mu': 1.2, 'T_distract': rng.uniform(0, 2), 'T_phone': rng.uniform(0, 2)}
+        if distribution == 'sparse':
+            record = {key: value for key, value in record.items() if rng.random() < 0.3}
+        elif distribution == 'invalid' and rng.random() < 0.05:
+            record[rng.choice(list(record))] = rng.choice(("n/a", None, []))
+        records.append(record)
+    return records
+
+# --- 2. 案例 ---
+# 每個案例的 setup(work_dir, param) 回傳 (要計時的函數, 每次處理的單位數, 單位名稱)
+
+def _output(work_dir, name):
+    folder = os.path.join(work_dir, 'outputs')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, name)
+
+def setup_merge_images_with_mask(work_dir, size):
+    from generate_donut import merge_images_with_mask
+    paths = image_inputs(work_dir, size)
+    out = _output(work_dir, f"merged_{size}.png")
+    return lambda: merge_images_with_mask(paths['generated'], paths['mask'], out), size * size / 1e6, 'MP'
+
+def setup_crop_to_donut(work_dir, size):
+    from generate_donut import crop_to_donut
+    paths = image_inputs(work_dir, size)
+    out = _output(work_dir, f"donut_{size}.png")
+    return lambda: crop_to_donut(paths['generated'], out), size * size / 1e6, 'MP'
+
+def setup_convert_and_reduce_contrast(work_dir, size):
+    from generate_to_gray_lowcontrast import convert_and_reduce_contrast
+    paths = image_inputs(work_dir, size)
+    out = _output(work_dir, f"gray_{size}.png")
+    return lambda: convert_and_reduce_contrast(paths['donut'], out), size * size / 1e6, 'MP'
+
+def setup_crop_filled_sector(work_dir, size):
+    from generate_donut_ratio import crop_filled_sector
+    paths = image_inputs(work_dir, size)
+    out = _output(work_dir, f"filled_{size}.png")
+    return lambda: crop_filled_sector(paths['donut'], SECTOR_SCORE, SCORE_TARGET, out), size * size / 1e6, 'MP'
+
+def setup_crop_missing_sector(work_dir, size):
+    from generate_donut_ratio import crop_missing_sector
+    paths = image_inputs(work_dir, size)
+    out = _output(work_dir, f"missing_{size}.png")
+    return lambda: crop_missing_sector(paths['gray'], SECTOR_SCORE, SCORE_TARGET, out), size * size / 1e6, 'MP'
+
+def setup_merge_donut_parts(work_dir, size):
+    from generate_donut_ratio import merge_donut_parts
+    paths = image_inputs(work_dir, size)
+    out = _output(work_dir, f"ratio_{size}.png")
+    return lambda: merge_donut_parts(paths['filled'], paths['missing'], out), size * size / 1e6, 'MP'
+
+def setup_merge_segments(work_dir, count):
+    from merge_segment import merge_segments
+    segments = segment_inputs(work_dir, count)
+    out = _output(work_dir, os.path.join(f"merge_{count}", "merge.png"))
+    # incremental=False：每次都完整合成 (增量模式第二次之後幾乎不用做事)
+    return lambda: merge_segments(segments, out, incremental=False), count, 'segments'
+
+def setup_adjust_image_intensity(work_dir, size):
+    from image_intensity import adjust_image_intensity
+    paths = image_inputs(work_dir, size)
+    out = _output(work_dir, f"intensity_{size}.png")
+    return lambda: adjust_image_intensity(paths['generated'], out, 1.3), size * size / 1e6, 'MP'
+
+def setup_calculate_plan_d_score(work_dir, distribution):
+    from score_calculator import calculate_plan_d_score
+    records = score_records(distribution)
+
+    def run():
+        for record in records:
+            calculate_plan_d_score(record)
+
+    return run, len(records), 'records'
+
+def setup_sdxl_stub(work_dir, jobs):
+    """SDXL 階段以 sdxl_daemon.StubPipeline 代替模型：計時工作分批、Prompt 讀取與 1024px 圖片的儲存。"""
+    from sdxl_daemon import StubPipeline, make_job, run_jobs
+    pipe = StubPipeline(size=SEGMENT_SIZE)
+    job_list = [make_job(_output(work_dir, os.path.join('sdxl', f"stub_{jobs}_{i}.png")),
+                         prompt=f"benchmark prompt {i}", negative="blurry", seed=i)
+                for i in range(jobs)]
+    return lambda: run_jobs(pipe, job_list, batch_size=4), jobs, 'images'
+
+def setup_gemini_stub(work_dir, jobs):
+    """
+    Gemini 階段以 prompt_batch 的本機替身伺服器代替：包含 HTTP 往返、速率限制、
+    429 / 503 重試與回覆解析，不使用 Prompt 快取也不寫檔。
+    """
+    import asyncio
+    import prompt_cache
+    from prompt_batch import run_with_stub
+
+    prompt_cache.ENABLED = False
+    job_list = [(f"bench_{i:03d}", f"benchmark task {i}: write a report") for i in range(jobs)]
+
+    def run():
+        asyncio.run(run_with_stub(job_list, latency=GEMINI_STUB_LATENCY, error_rate=GEMINI_STUB_ERROR_RATE,
+                                  seed=0, concurrency=8, rate=1000.0, burst=8, save=False, cache=None))
+
+    return run, jobs, 'prompts'
+
+# 案例名稱 → (參數種類, setup 函數)
+CASES = {
+    'merge_images_with_mask': ('size', setup_merge_images_with_mask),
+    'crop_to_donut': ('size', setup_crop_to_donut),
+    'convert_and_reduce_contrast': ('size', setup_convert_and_reduce_contrast),
+    'crop_filled_sector': ('size', setup_crop_filled_sector),
+    'crop_missing_sector': ('size', setup_crop_missing_sector),
+    'merge_donut_parts': ('size', setup_merge_donut_parts),
+    'merge_segments': ('segments', setup_merge_segments),
+    'adjust_image_intensity': ('size', setup_adjust_image_intensity),
+    'calculate_plan_d_score': ('distribution', setup_calculate_plan_d_score),
+    'sdxl_stub': ('sdxl_jobs', setup_sdxl_stub),
+    'gemini_stub': ('gemini_jobs', setup_gemini_stub),
+}
+
+def case_params(kind, sizes=SIZES, segments=SEGMENT_COUNTS):
+    return {'size': sizes, 'segments': segments, 'distribution': SCORE_DISTRIBUTIONS,
+            'sdxl_jobs': SDXL_STUB_JOBS, 'gemini_jobs': GEMINI_STUB_JOBS}[kind]
+
+def parse_param(kind, text):
+    return text if kind == 'distribution' else int(text)
+
+def prepare_inputs(kind, param, work_dir=WORK_DIR):
+    """在主程序先產生合成圖片，子程序只讀取現成的檔案 (產生圖片的記憶體不會算進案例的峰值)。"""
+    if kind == 'size':
+        image_inputs(work_dir, param)
+    elif kind == 'segments':
+        segment_inputs(work_dir, param)
+
+# --- 3. 單一案例 (在子程序中執行) ---
+
+def _proc_status_mb(field):
+    """讀取 /proc/self/status 的記憶體欄位 (MB)，非 Linux 時回傳 None。"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def peak_rss_mb():
+    """
+    目前程序的峰值常駐記憶體 (MB)，無法取得時回傳 None。
+    Linux 優先使用 /proc 的 VmHWM：ru_maxrss 會在 fork 時繼承父程序的峰值，子程序量不準。
+    """
+    peak = _proc_status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / (1024 * 1024)
+    except ImportError:
+        return None
+
+def reset_peak_rss():
+    """把峰值歸零為目前的用量 (Linux 4.0+ 的 /proc/self/clear_refs)，成功時回傳 True。"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+def run_worker(name, param, work_dir=WORK_DIR, repeat=REPEAT, budget=TIME_BUDGET):
+    """
+    執行單一案例：setup 後重複計時 (累計超過 budget 秒即停止)，回傳結果 dict。
+    peak_rss_mb 是整個子程序的峰值；rss_growth_mb 是計時期間峰值比開始計時時多出的量
+    (不含匯入模組與 setup)。
+    """
+    kind, setup = CASES[name]
+    func, units, unit = setup(work_dir, param)
+    peak_before = peak_rss_mb()
+    if reset_peak_rss():
+        baseline = _proc_status_mb('VmRSS')
+    else:
+        baseline = peak_before
+    times = []
+    with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+        while len(times) < repeat:
+            t0 = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - t0)
+            if sum(times) >= budget:
+                break
+    peak_during = peak_rss_mb()
+    median = statistics.median(times)
+    return {
+        'case': name, 'param': param, 'repeats': len(times),
+        'median_s': median, 'min_s': min(times),
+        'peak_rss_mb': None if peak_during is None else max(peak_during, peak_before),
+        'rss_growth_mb': None if peak_during is None or baseline is None else peak_during - baseline,
+        'throughput': units / median if median > 0 else None, 'unit': f"{unit}/s",
+    }
+
+def spawn_worker(name, param, work_dir, repeat, budget, profile=None):
+    """在獨立的子程序中執行案例 (各自的峰值記憶體)，失敗時回傳含 error 的 dict。"""
+    command = [sys.executable, os.path.abspath(__file__), 'worker', name, str(param),
+               '--work-dir', work_dir, '--repeat', str(repeat), '--budget', str(budget)]
+    env = dict(os.environ)
+    if profile:
+        env['DONUT_IMAGE_PROFILE'] = profile
+    try:
+        completed = subprocess.run(command, capture_output=True, text=True, encoding='utf-8',
+                                   timeout=WORKER_TIMEOUT, env=env)
+    except subprocess.TimeoutExpired:
+        return {'case': name, 'param': param, 'error': f"逾時 ({WORKER_TIMEOUT} 秒)"}
+    lines = completed.stdout.strip().splitlines()
+    if completed.returncode != 0 or not lines:
+        error = (completed.stderr.strip().splitlines() or ["沒有輸出"])[-1]
+        return {'case': name, 'param': param, 'error': error}
+    return json.loads(lines[-1])
+
+# --- 4. 執行整組測試並記錄歷史 ---
+
+def git_commit():
+    try:
+        completed = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=10)
+        return completed.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def format_result(result):
+    if 'error' in result:
+        return f"{result['case']:<28} {str(result['param']):>8}  ❌ {result['error']}"
+    rss = '-' if result['peak_rss_mb'] is None else f"{result['peak_rss_mb']:.0f} MB (+{result['rss_growth_mb']:.0f})"
+    throughput = '-' if result['throughput'] is None else f"{result['throughput']:.2f} {result['unit']}"
+    return (f"{result['case']:<28} {str(result['param']):>8}  {result['median_s'] * 1000:>10.1f} ms"
+            f"  (x{result['repeats']})  {rss:>16}  {throughput}")
+
+def run_suite(cases=None, sizes=SIZES, segments=SEGMENT_COUNTS, work_dir=WORK_DIR, repeat=REPEAT,
+              budget=TIME_BUDGET, label=None, profile=None, history_path=HISTORY_PATH, report_path=REPORT_PATH):
+    """
+    依序執行各案例 (每個參數一個子程序)，結果附加到 history_path 並寫出文字報表。
+
+    Returns:
+        dict: 本次執行的紀錄。
+    """
+    names = cases or list(CASES)
+    run = {
+        'run_id': datetime.datetime.now().strftime('%Y%m%d_%H%M%S'),
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'label': label, 'commit': git_commit(), 'profile': profile or os.environ.get('DONUT_IMAGE_PROFILE', 'default'),
+        'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+        'results': [],
+    }
+    lines = [f"--- 基準測試 {run['run_id']} (commit {run['commit']}，編碼設定檔 {run['profile']}，"
+             f"CPU 核心數 {run['cpus']}) ---"]
+    print(lines[0])
+    for name in names:
+        kind, _ = CASES[name]
+        for param in case_params(kind, sizes, segments):
+            prepare_inputs(kind, param, work_dir)
+            result = spawn_worker(name, param, work_dir, repeat, budget, profile)
+            run['results'].append(result)
+            lines.append(format_result(result))
+            print(lines[-1], flush=True)
+
+    os.makedirs(os.path.dirname(history_path) or '.', exist_ok=True)
+    with open(history_path, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(run, ensure_ascii=False) + '\n')
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    print(f"✅ 結果已附加到 {history_path}，報表寫入 {report_path}")
+    return run
+
+# --- 5. 比較 ---
+
+def load_history(history_path=HISTORY_PATH):
+    runs = []
+    try:
+        with open(history_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    runs.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        print(f"❌ 歷史紀錄格式錯誤 ({history_path}): {e}")
+    return runs
+
+def find_run(runs, ref):
+    """ref 可以是 run_id、label，或負數索引字串 (例如 '-1' 為最近一次)。"""
+    for run in reversed(runs):
+        if ref in (run['run_id'], run.get('label')):
+            return run
+    try:
+        return runs[int(ref)]
+    except (ValueError, IndexError):
+        return None
+
+def compare_runs(base, head, threshold=THRESHOLD):
+    """
+    逐案例比較兩次執行：最短時間 (比中位數不受其他程序干擾) 或計時期間的記憶體增加量
+    超過 threshold (且超過雜訊下限) 視為退步。
+
+    Returns:
+        list: 退步的 (案例, 參數, 說明)。
+    """
+    if base.get('profile') != head.get('profile') or base.get('cpus') != head.get('cpus'):
+        print(f"❗ 兩次執行的環境不同 (編碼設定檔 {base.get('profile')} → {head.get('profile')}，"
+              f"CPU 核心數 {base.get('cpus')} → {head.get('cpus')})，比較結果僅供參考。")
+    baseline = {(r['case'], str(r['param'])): r for r in base['results'] if 'error' not in r}
+    regressions = []
+    print(f"--- 比較 {base['run_id']} → {head['run_id']} (門檻 {threshold * 100:.0f}%) ---")
+    for result in head['results']:
+        key = (result['case'], str(result['param']))
+        before = baseline.get(key)
+        if before is None or 'error' in result:
+            status = '❌ 執行失敗' if 'error' in result else '(沒有基準)'
+            print(f"{key[0]:<28} {key[1]:>8}  {status}")
+            continue
+
+        ratio = result['min_s'] / before['min_s'] if before['min_s'] else 1.0
+        notes = []
+        if ratio > 1 + threshold and result['min_s'] - before['min_s'] > MIN_DELTA_SECONDS:
+            notes.append(f"時間 +{(ratio - 1) * 100:.0f}%")
+        grow_before, grow_after = before.get('rss_growth_mb'), result.get('rss_growth_mb')
+        if (grow_before is not None and grow_after is not None
+                and grow_after - grow_before > max(MIN_DELTA_RSS_MB, grow_before * threshold)):
+            notes.append(f"記憶體 +{grow_after - grow_before:.0f} MB")
+
+        mark = '❗ 退步' if notes else ('✅ 變快' if ratio < 1 - threshold else '  持平')
+        print(f"{key[0]:<28} {key[1]:>8}  {before['min_s'] * 1000:>9.1f} → {result['min_s'] * 1000:>9.1f} ms"
+              f"  ({ratio:.2f}x)  {mark} {', '.join(notes)}")
+        if notes:
+            regressions.append((key[0], key[1], ', '.join(notes)))
+    print(f"--- {len(regressions)} 個案例退步 ---")
+    return regressions
+
+# --- 6. 命令列 ---
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="各階段的基準測試 (合成輸入)，結果記錄在 JSONL 歷史檔並可比較退步。")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="執行基準測試並附加到歷史紀錄")
+    run.add_argument('--cases', nargs='+', choices=list(CASES), help="只執行指定的案例 (預設全部)")
+    run.add_argument('--sizes', nargs='+', type=int, default=list(SIZES), help="圖片尺寸 (預設 512 1024 4096)")
+    run.add_argument('--segments', nargs='+', type=int, default=list(SEGMENT_COUNTS), help="合併片段數 (預設 3 50 1000)")
+    run.add_argument('--quick', action='store_true', help="只用 512 px 與 3 / 50 個片段 (快速檢查)")
+    run.add_argument('--repeat', type=int, default=REPEAT, help="每個案例最多重複幾次")
+    run.add_argument('--budget', type=float, default=TIME_BUDGET, help="單一案例的計時預算 (秒)")
+    run.add_argument('--label', help="這次執行的標籤 (可在 compare 中引用)")
+    run.add_argument('--profile', help="圖片編碼設定檔 (見 image_encoding.py)")
+    run.add_argument('--work-dir', default=WORK_DIR, help="合成輸入與輸出的資料夾")
+    run.add_argument('--history', default=HISTORY_PATH, help="歷史紀錄路徑")
+    run.add_argument('--compare', action='store_true', help="執行後與上一次的紀錄比較")
+    run.add_argument('--threshold', type=float, default=THRESHOLD, help="退步門檻 (預設 0.15 = 15%%)")
+
+    compare = sub.add_parser('compare', help="比較兩次紀錄 (預設為最近兩次)，有退步時結束碼為 1")
+    compare.add_argument('base', nargs='?', default='-2', help="基準的 run_id / 標籤 / 索引 (預設 -2)")
+    compare.add_argument('head', nargs='?', default='-1', help="比較對象 (預設 -1，最近一次)")
+    compare.add_argument('--threshold', type=float, default=THRESHOLD, help="退步門檻 (預設 0.15 = 15%%)")
+    compare.add_argument('--history', default=HISTORY_PATH, help="歷史紀錄路徑")
+
+    history = sub.add_parser('list', help="列出歷史紀錄")
+    history.add_argument('--history', default=HISTORY_PATH, help="歷史紀錄路徑")
+
+    worker = sub.add_parser('worker', help=argparse.SUPPRESS)
+    worker.add_argument('case', choices=list(CASES))
+    worker.add_argument('param')
+    worker.add_argument('--work-dir', default=WORK_DIR)
+    worker.add_argument('--repeat', type=int, default=REPEAT)
+    worker.add_argument('--budget', type=float, default=TIME_BUDGET)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    if args.command == 'worker':
+        kind, _ = CASES[args.case]
+        result = run_worker(args.case, parse_param(kind, args.param), args.work_dir, args.repeat, args.budget)
+        print(json.dumps(result))
+
+    elif args.command == 'run':
+        sizes, segments = args.sizes, args.segments
+        if args.quick:
+            sizes, segments = [512], [3, 50]
+        previous = load_history(args.history)
+        run = run_suite(args.cases, sizes, segments, args.work_dir, args.repeat, args.budget,
+                        args.label, args.profile, args.history)
+        if args.compare:
+            if not previous:
+                print("❗ 沒有先前的紀錄可以比較。")
+            elif compare_runs(previous[-1], run, args.threshold):
+                sys.exit(1)
+        sys.exit(1 if any('error' in r for r in run['results']) else 0)
+
+    elif args.command == 'compare':
+        runs = load_history(args.history)
+        base, head = find_run(runs, args.base), find_run(runs, args.head)
+        if base is None or head is None:
+            print(f"❌ 找不到要比較的紀錄 (共有 {len(runs)} 筆)。")
+            sys.exit(2)
+        sys.exit(1 if compare_runs(base, head, args.threshold) else 0)
+
+    else:
+        for run in load_history(args.history):
+            failed = sum(1 for r in run['results'] if 'error' in r)
+            print(f"{run['run_id']}  {run.get('label') or '-':<12} commit {run.get('commit')}  "
+                  f"{len(run['results'])} 個案例{f'，{failed} 個失敗' if failed else ''}")
@@ -0,0 +1,376 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import tracing
+
+# --- 全域配置 ---
+MANIFEST_PATH = os.path.join('json', 'build_manifest.json')
+TASK_JSON_DIR = os.path.join('json', 'task')
+MASK_PATH = os.path.join('images', 'mask.png')
+MERGE_CONFIG_PATH = os.path.join('json', 'merge_input.json')
+
+# 單一任務的階段，依相依順序排列：
+# prompt → image → donut → gray，score 獨立，ratio 依賴 donut / gray / score
+STAGE_ORDER = ('prompt', 'image', 'donut', 'gray', 'score', 'ratio')
+
+# --- 1. 內容雜湊 ---
+
+def file_input(path):
+    """以整個檔案內容作為輸入。"""
+    return ('file', path, None)
+
+def json_input(path, exclude=(), only=None):
+    """以 JSON 檔案中的部分欄位作為輸入 (排序後序列化再雜湊)，其他欄位變動不影響此階段。"""
+    return ('json', path, (tuple(exclude), tuple(only) if only is not None else None))
+
+def _digest_input(spec):
+    """回傳輸入的雜湊值，檔案不存在或沒有需要的欄位時回傳 None。"""
+    kind, path, selector = spec
+    if not os.path.exists(path):
+        return None
+
+    if kind == 'file':
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                h.update(chunk)
+        return h.hexdigest()
+
+    exclude, only = selector
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if only is not None:
+        data = {k: data[k] for k in only if k in data}
+        if not data:
+            return None
+    else:
+        data = {k: v for k, v in data.items() if k not in exclude}
+    canonical = json.dumps(data, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def file_hash(path):
+    return _digest_input(file_input(path))
+
+# --- 2. 階段定義 ---
+
+def _task_paths(task):
+    from donut_pipeline import task_paths
+    paths = task_paths(task)
+    paths['input'] = os.path.join(TASK_JSON_DIR, task, 'input.json')
+    paths['positive'] = os.path.join('prompt', 'positive', f'positive_{task}.txt')
+    paths['negative'] = os.path.join('prompt', 'negative', f'negative_{task}.txt')
+    return paths
+
+def _prompt_params():
+    import generate_prompt
+    return {'model': generate_prompt.MODEL_NAME, 'temperature': generate_prompt.TEMPERATURE,
+            'max_words': generate_prompt.MAX_WORDS_PER_PROMPT}
+
+def _image_params():
+    import generate_image
+    return {'model_path': generate_image.SDXL_MODEL_PATH, 'steps': generate_image.NUM_INFERENCE_STEPS,
+            'guidance': generate_image.GUIDANCE_SCALE}
+
+def _donut_params():
+    import generate_donut_ratio
+    return {'inner_radius_ratio': generate_donut_ratio.INNER_RADIUS_RATIO}
+
+def _gray_params():
+    import generate_to_gray_lowcontrast
+    return {'contrast_reduction': generate_to_gray_lowcontrast.CONTRAST_REDUCTION}
+
+def _score_params():
+    # 公式常數直接取自 score_calculator；只有改寫 calculate_plan_d_score 的計算方式時才需要調整版本號
+    import score_calculator
+    return {'formula': 'plan_d_v1', 'defaults': score_calculator.SCORE_DEFAULTS,
+            'i_weight': score_calculator.I_WEIGHT, 'd_weight': score_calculator.D_WEIGHT,
+            'level_base': score_calculator.LEVEL_BASE,
+            'distract_penalty': score_calculator.DISTRACT_PENALTY,
+            'phone_penalty': score_calculator.PHONE_PENALTY}
+
+def _ratio_params():
+    import generate_donut_ratio
+    return {'full_score': generate_donut_ratio.FULL_SCORE,
+            'inner_radius_ratio': generate_donut_ratio.INNER_RADIUS_RATIO,
+            'start_angle': generate_donut_ratio.START_ANGLE_PIL}
+
+class Stage:
+    """
+    建置圖中的一個階段。
+
+    inputs(paths) 回傳輸入規格列表 (file_input / json_input)，params() 回傳影響輸出的設定值，
+    outputs(paths) 回傳輸出檔案路徑，run(builder, task, paths) 執行階段並回傳是否成功。
+    """
+
+    def __init__(self, name, inputs, params, outputs, run):
+        self.name = name
+        self.inputs = inputs
+        self.params = params
+        self.outputs = outputs
+        self.run = run
+
+def _run_prompt(builder, task, paths):
+    from generate_prompt import generate_sdxl_prompts, save_prompts_to_files
+    with open(paths['input'], 'r', encoding='utf-8') as f:
+        description = json.load(f)['description']
+    prompts = generate_sdxl_prompts(description)
+    if "Error" in prompts:
+        print(f"❌ Prompt 生成失敗: {prompts['Error']}")
+        return False
+    return save_prompts_to_files(prompts, task)
+
+def _run_image(builder, task, paths):
+    from generate_image import generate_image_from_files
+    pipe = builder.sdxl_pipeline()
+    if pipe is None:
+        return False
+    return generate_image_from_files(pipe, paths['positive'], paths['negative'], paths['generated']) is not None
+
+def _run_donut(builder, task, paths):
+    from generate_donut import main_process
+    from generate_donut_ratio import INNER_RADIUS_RATIO
+    os.makedirs(os.path.dirname(paths['donut']), exist_ok=True)
+    return main_process(paths['generated'], builder.mask_path, paths['donut'],
+                        inner_radius_ratio=INNER_RADIUS_RATIO) is not None
+
+def _run_gray(builder, task, paths):
+    from generate_to_gray_lowcontrast import convert_and_reduce_contrast, CONTRAST_REDUCTION
+    convert_and_reduce_contrast(paths['donut'], paths['gray'], CONTRAST_REDUCTION)
+    return os.path.exists(paths['gray'])
+
+def _run_score(builder, task, paths):
+    from score_calculator import score_file
+    return score_file(paths['input'], paths['score'], task)
+
+def _run_ratio(builder, task, paths):
+    from donut_pipeline import render_task_ratio
+    return render_task_ratio(task) is not None
+
+STAGES = {
+    'prompt': Stage(
+        'prompt',
+        inputs=lambda p: [json_input(p['input'], only=('description',))],
+        params=_prompt_params,
+        outputs=lambda p: [p['positive'], p['negative']],
+        run=_run_prompt),
+    'image': Stage(
+        'image',
+        inputs=lambda p: [file_input(p['positive']), file_input(p['negative'])],
+        params=_image_params,
+        outputs=lambda p: [p['generated']],
+        run=_run_image),
+    'donut': Stage(
+        'donut',
+        inputs=lambda p: [file_input(p['generated']), file_input(MASK_PATH)],
+        params=_donut_params,
+        outputs=lambda p: [p['donut']],
+        run=_run_donut),
+    'gray': Stage(
+        'gray',
+        inputs=lambda p: [file_input(p['donut'])],
+        params=_gray_params,
+        outputs=lambda p: [p['gray']],
+        run=_run_gray),
+    'score': Stage(
+        'score',
+        inputs=lambda p: [json_input(p['input'], exclude=('description',))],
+        params=_score_params,
+        outputs=lambda p: [p['score']],
+        run=_run_score),
+    'ratio': Stage(
+        'ratio',
+        inputs=lambda p: [file_input(p['donut']), file_input(p['gray']), file_input(p['score'])],
+        params=_ratio_params,
+        outputs=lambda p: [p['filled'], p['ratio']],
+        run=_run_ratio),
+}
+
+# --- 3. 建置器 ---
+
+class Builder:
+    """
+    依內容雜湊決定哪些階段需要重跑，並把結果記錄在 manifest。
+
+    每個階段的鍵 = SHA-256(階段名稱 + 各輸入內容雜湊 + 參數)。鍵與 manifest 相同、
+    且輸出檔案仍與上次記錄的雜湊一致時，該階段會被略過。因為下游階段以上游輸出的
+    *內容* 作為輸入，上游重跑但輸出不變時，下游也不會重跑。
+    """
+
+    def __init__(self, manifest_path=MANIFEST_PATH, mask_path=MASK_PATH, dry_run=False, force=(), adopt=False):
+        self.manifest_path = manifest_path
+        self.mask_path = mask_path
+        self.dry_run = dry_run
+        self.adopt = adopt
+        self.force = set(force)
+        self.manifest = self._load_manifest()
+        self._pipe = None
+        self.summary = {'ran': 0, 'skipped': 0, 'failed': 0, 'blocked': 0}
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'tasks': {}, 'merge': {}}
+
+    def save_manifest(self):
+        os.makedirs(os.path.dirname(self.manifest_path) or '.', exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.manifest_path)
+
+    def sdxl_pipeline(self):
+        """同一次建置中只載入一次 SDXL 模型。"""
+        if self._pipe is None:
+            from generate_image import load_pipeline
+            self._pipe = load_pipeline()
+        return self._pipe
+
+    def stage_key(self, stage, paths):
+        """計算階段鍵，任一輸入不存在時回傳 None。"""
+        h = hashlib.sha256(stage.name.encode('utf-8'))
+        for spec in stage.inputs(paths):
+            digest = _digest_input(spec)
+            if digest is None:
+                return None
+            h.update(digest.encode('ascii'))
+        h.update(json.dumps(stage.params(), sort_keys=True).encode('utf-8'))
+        return h.hexdigest()
+
+    def _outputs_intact(self, record, outputs):
+        recorded = record.get('outputs', {})
+        return all(path in recorded and file_hash(path) == recorded[path] for path in outputs)
+
+    def build_stage(self, task, stage, paths):
+        records = self.manifest['tasks'].setdefault(task, {})
+        outputs = stage.outputs(paths)
+        key = self.stage_key(stage, paths)
+
+        if key is None:
+            if all(os.path.exists(p) for p in outputs):
+                # 沒有上游輸入 (例如手動撰寫的 Prompt)，直接沿用現有輸出
+                self.summary['skipped'] += 1
+            else:
+                print(f"   ⏸️  {task}/{stage.name}: 缺少輸入，無法建置")
+                self.summary['blocked'] += 1
+            return
+
+        record = records.get(stage.name, {})
+        if (stage.name not in self.force and record.get('key') == key
+                and self._outputs_intact(record, outputs)):
+            self.summary['skipped'] += 1
+            return
+
+        if self.adopt and not record and all(os.path.exists(p) for p in outputs):
+            # 第一次建立 manifest：把現有輸出視為最新結果，不重跑 (避免重新呼叫 SDXL / Gemini)
+            records[stage.name] = {'key': key, 'outputs': {p: file_hash(p) for p in outputs}}
+            self.save_manifest()
+            self.summary['skipped'] += 1
+            return
+
+        print(f"   ▶️  {task}/{stage.name}: 輸入已變動，重新執行")
+        if self.dry_run:
+            self.summary['ran'] += 1
+            return
+
+        try:
+            with tracing.span(f'build_{stage.name}', task=task):
+                ok = stage.run(self, task, paths)
+        except Exception as e:
+            print(f"   ❌ {task}/{stage.name}: {e}")
+            ok = False
+        if not ok or not all(os.path.exists(p) for p in outputs):
+            print(f"   ❌ {task}/{stage.name}: 執行失敗")
+            self.summary['failed'] += 1
+            return
+
+        records[stage.name] = {'key': key, 'outputs': {p: file_hash(p) for p in outputs}}
+        self.save_manifest()
+        self.summary['ran'] += 1
+
+    def build_task(self, task, stages=STAGE_ORDER):
+        print(f"\n--- 建置 {task} ---")
+        paths = _task_paths(task)
+        for name in stages:
+            self.build_stage(task, STAGES[name], paths)
+
+    def build_merge(self, config_path=MERGE_CONFIG_PATH):
+        """合併階段：輸入為配置檔與所有片段的圖片與分數。"""
+        from merge_segment import load_config_and_prepare_segments, merge_segments
+        import generate_donut_ratio
+
+        print("\n--- 建置 merge ---")
+        segments, final_output = load_config_and_prepare_segments(config_path)
+        if not segments:
+            self.summary['blocked'] += 1
+            return
+
+        h = hashlib.sha256(b'merge')
+        for path in [config_path] + [p for s in segments for p in (s['image_path'], s['score_json_path'])]:
+            digest = file_hash(path)
+            h.update((digest or 'missing').encode('ascii'))
+        h.update(json.dumps(_ratio_params(), sort_keys=True).encode('utf-8'))
+        key = h.hexdigest()
+
+        record = self.manifest.setdefault('merge', {}).get(config_path, {})
+        previous = record.get('output')
+        if ('merge' not in self.force and record.get('key') == key and previous
+                and file_hash(previous) == record.get('output_hash')):
+            print(f"   ✔️  合併結果未變動，沿用 {previous}")
+            self.summary['skipped'] += 1
+            return
+
+        if self.dry_run:
+            self.summary['ran'] += 1
+            return
+
+        merge_segments(segments, final_output, incremental='merge' not in self.force)
+        if not os.path.exists(final_output):
+            self.summary['failed'] += 1
+            return
+        self.manifest['merge'][config_path] = {'key': key, 'output': final_output,
+                                               'output_hash': file_hash(final_output)}
+        self.save_manifest()
+        self.summary['ran'] += 1
+
+def discover_tasks():
+    """列出 json/task 底下所有任務 ID。"""
+    if not os.path.isdir(TASK_JSON_DIR):
+        return []
+    return sorted(e.name for e in os.scandir(TASK_JSON_DIR) if e.is_dir())
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="依內容雜湊增量建置 prompt → image → donut → ratio → merge。")
+    parser.add_argument('tasks', nargs='*', help="要建置的任務 ID (預設為 json/task 底下全部)")
+    parser.add_argument('--stages', nargs='+', choices=STAGE_ORDER, default=list(STAGE_ORDER),
+                        help="只建置指定的階段")
+    parser.add_argument('--merge', action='store_true', help="最後一併建置合併圖")
+    parser.add_argument('--force', nargs='+', choices=STAGE_ORDER + ('merge',), default=[],
+                        help="強制重跑的階段名稱 (merge 為合併圖)")
+    parser.add_argument('--dry-run', action='store_true', help="只列出會重跑的階段")
+    parser.add_argument('--adopt', action='store_true',
+                        help="尚未記錄在 manifest 的階段若已有輸出，直接登記為最新而不重跑")
+    parser.add_argument('--profile', default=None, help="輸出圖片的編碼設定檔 (見 image_encoding.py)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.profile:
+        import image_encoding
+        image_encoding.set_default_profile(args.profile)
+    builder = Builder(dry_run=args.dry_run, force=args.force, adopt=args.adopt)
+    stages = [s for s in STAGE_ORDER if s in args.stages]
+    for task in args.tasks or discover_tasks():
+        builder.build_task(task, stages)
+    if args.merge:
+        builder.build_merge()
+    print(f"\n--- 建置完成: {builder.summary} ---")
+    if 'image_encoding' in sys.modules:
+        sys.modules['image_encoding'].print_report()
@@ -0,0 +1,241 @@
+import argparse
+import os
+import sys
+
+# 這個檔案只在頂層匯入標準函式庫：各子命令需要的模組 (PIL、torch / diffusers、google.genai)
+# 都在子命令內才匯入，因此 --help、score 等輕量命令不必付出載入大型套件的成本。
+
+# --- 全域配置 ---
+MASK_PATH = os.path.join('images', 'mask.png')
+TASK_JSON_DIR = os.path.join('json', 'task')
+MERGE_CONFIG_PATH = os.path.join('json', 'merge_input.json')
+TRACE_PATH = os.path.join('json', 'trace.jsonl')
+
+# --- 1. 工具函數 ---
+
+def task_paths(task):
+    """與 donut_pipeline.task_paths 相同的路徑 (這裡重新列出，避免為了路徑而匯入 PIL)。"""
+    return {
+        'input': os.path.join(TASK_JSON_DIR, task, 'input.json'),
+        'generated': os.path.join('images', 'generated_images', f'generated_image_{task}.png'),
+        'score': os.path.join(TASK_JSON_DIR, task, 'output.json'),
+        'donut': os.path.join('images', 'donut', f'donut_{task}.png'),
+        'gray': os.path.join('images', 'donut_gray', f'donut_gray_{task}.png'),
+    }
+
+def discover_tasks():
+    """列出 json/task 底下所有任務 ID。"""
+    if not os.path.isdir(TASK_JSON_DIR):
+        return []
+    return sorted(e.name for e in os.scandir(TASK_JSON_DIR) if e.is_dir())
+
+def _report(results):
+    """印出成功數量，全部成功時回傳 0 (程式結束碼)。"""
+    done = sum(1 for ok in results if ok)
+    print(f"\n--- 完成 {done} / {len(results)} ---")
+    return 0 if done == len(results) else 1
+
+# --- 2. 子命令 ---
+
+def cmd_score(args):
+    from score_calculator import score_file, task_score_paths
+    return _report([score_file(*task_score_paths(task), task=task) for task in args.tasks])
+
+def cmd_prompt(args):
+    from prompt_batch import task_jobs, generate_prompts_batch
+
+    if args.description:
+        jobs = [(args.tasks[0], args.description)] if args.tasks else task_jobs(descriptions=[args.description])
+    else:
+        jobs = task_jobs(args.tasks)
+    if not jobs:
+        print("❌ 請指定任務 ID 或 --description")
+        return 1
+    results, _ = generate_prompts_batch(jobs, concurrency=args.concurrency, refresh=args.refresh)
+    return _report(["Error" not in prompts for prompts in results.values()])
+
+def cmd_image(args):
+    options = {k: v for k, v in (('steps', args.steps), ('guidance', args.guidance)) if v is not None}
+    if args.no_daemon:
+        from generate_image import load_pipeline, generate_tasks, flush_memory
+        pipe = load_pipeline()
+        if pipe is None:
+            return 1
+        try:
+            results = generate_tasks(pipe, args.tasks, [args.seed] * len(args.tasks), **options)
+        finally:
+            del pipe
+            flush_memory()
+        return _report(list(results.values()))
+
+    from sdxl_daemon import task_job, generate
+    jobs = [task_job(task, args.seed, **options) for task in args.tasks]
+    return _report([reply.get('ok') for reply in generate(jobs)])
+
+def cmd_donut(args):
+    from generate_donut import main_process
+    from generate_donut_ratio import INNER_RADIUS_RATIO
+
+    results = []
+    for task in args.tasks:
+        paths = task_paths(task)
+        os.makedirs(os.path.dirname(paths['donut']), exist_ok=True)
+        results.append(main_process(paths['generated'], args.mask, paths['donut'],
+                                    inner_radius_ratio=INNER_RADIUS_RATIO))
+    return _report(results)
+
+def cmd_gray(args):
+    from generate_to_gray_lowcontrast import convert_and_reduce_contrast_batch
+
+    jobs = [(task_paths(task)['donut'], task_paths(task)['gray']) for task in args.tasks]
+    return _report(convert_and_reduce_contrast_batch(jobs, args.contrast))
+
+def cmd_ratio(args):
+    from donut_pipeline import render_task_ratio
+    return _report([render_task_ratio(task) for task in args.tasks])
+
+def cmd_animate(args):
+    from donut_animation import animate_task
+    results = [animate_task(task, args.output if len(args.tasks) == 1 else None, fmt=args.format,
+                            frames=args.frames, duration=args.duration, hold=args.hold,
+                            delta=not args.no_delta)
+               for task in args.tasks]
+    return _report(results)
+
+def cmd_merge(args):
+    from merge_segment import load_config_and_prepare_segments, merge_segments
+
+    segments, output_path = load_config_and_prepare_segments(args.config)
+    if not segments:
+        return 1
+    return 0 if merge_segments(segments, args.output or output_path, incremental=not args.full) else 1
+
+def cmd_run(args):
+    from build_graph import Builder, STAGE_ORDER
+
+    builder = Builder(mask_path=args.mask, dry_run=args.dry_run, force=args.force, adopt=args.adopt)
+    stages = [stage for stage in STAGE_ORDER if args.stages is None or stage in args.stages]
+    for task in args.tasks or discover_tasks():
+        builder.build_task(task, stages)
+    if args.merge:
+        builder.build_merge(args.config)
+    print(f"\n--- 建置完成: {builder.summary} ---")
+    return 0
+
+def cmd_trace(args):
+    import tracing
+    spans = tracing.load_spans(args.path)
+    if args.run:
+        spans = tracing.select_run(spans, args.run)
+    return 0 if tracing.print_report(spans, args.stage) else 1
+
+# --- 3. 命令列 ---
+
+def build_parser():
+    from build_graph import STAGE_ORDER   # build_graph.py 只使用標準函式庫，匯入成本很低
+
+    parser = argparse.ArgumentParser(
+        prog='donut',
+        description="甜甜圈進度圖工具：score | prompt | image | donut | gray | ratio | animate | merge | run | trace")
+    parser.add_argument('--profile', default=None,
+                        help="輸出圖片的編碼設定檔：default | fast-intermediate | archival | compact | web | "
+                             "web-lossy | palette (後四個只用於最終輸出，見 image_encoding.py)")
+    parser.add_argument('--trace', action='store_true',
+                        help="把各階段的耗時與記憶體以 JSON Lines 記錄下來 (見 tracing.py)")
+    parser.add_argument('--trace-path', default=TRACE_PATH, help=f"--trace 的紀錄檔 (預設 {TRACE_PATH})")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('score', help="計算任務分數 (json/task/<task>/output.json)")
+    p.add_argument('tasks', nargs='+', help="任務 ID")
+    p.set_defaults(func=cmd_score)
+
+    p = sub.add_parser('prompt', help="以 Gemini 生成 SDXL Prompt")
+    p.add_argument('tasks', nargs='*', help="任務 ID (描述取自 input.json)")
+    p.add_argument('--description', help="直接指定任務描述 (未指定任務 ID 時自動產生時間戳記名稱)")
+    p.add_argument('--concurrency', type=int, default=4, help="同時進行中的 Gemini 請求數上限")
+    p.add_argument('--refresh', action='store_true', help="略過 Prompt 快取，重新向 Gemini 請求")
+    p.set_defaults(func=cmd_prompt)
+
+    p = sub.add_parser('image', help="以 SDXL 生成圖片 (有常駐程式時交給常駐程式)")
+    p.add_argument('tasks', nargs='+', help="任務 ID")
+    p.add_argument('--seed', type=int, default=None, help="亂數種子")
+    p.add_argument('--steps', type=int, default=None, help="推論步數 (預設見 generate_image.py)")
+    p.add_argument('--guidance', type=float, default=None, help="Guidance scale (預設見 generate_image.py)")
+    p.add_argument('--no-daemon', action='store_true', help="不使用常駐程式，直接在目前程序中載入模型")
+    p.set_defaults(func=cmd_image)
+
+    p = sub.add_parser('donut', help="套用遮罩並裁切成甜甜圈")
+    p.add_argument('tasks', nargs='+', help="任務 ID")
+    p.add_argument('--mask', default=MASK_PATH, help="遮罩圖片路徑")
+    p.set_defaults(func=cmd_donut)
+
+    p = sub.add_parser('gray', help="產生灰度低對比的甜甜圈")
+    p.add_argument('tasks', nargs='+', help="任務 ID")
+    p.add_argument('--contrast', type=float, default=0.5, help="對比度係數 (預設 0.5)")
+    p.set_defaults(func=cmd_gray)
+
+    p = sub.add_parser('ratio', help="依分數產生比例甜甜圈")
+    p.add_argument('tasks', nargs='+', help="任務 ID")
+    p.set_defaults(func=cmd_ratio)
+
+    p = sub.add_parser('animate', help="產生從 0 分填到目前分數的動畫 (APNG / GIF / WebP)")
+    p.add_argument('tasks', nargs='+', help="任務 ID")
+    p.add_argument('-o', '--output', help="輸出路徑 (只有一個任務時有效，預設 images/donut_animation/)")
+    p.add_argument('--format', choices=['apng', 'gif', 'webp'], help="動畫格式 (預設依副檔名，否則 apng)")
+    p.add_argument('--frames', type=int, default=60, help="幀數 (預設 60)")
+    p.add_argument('--duration', type=int, default=33, help="每幀毫秒數 (預設 33)")
+    p.add_argument('--hold', type=int, default=1000, help="最後一幀額外停留毫秒數 (預設 1000)")
+    p.add_argument('--no-delta', action='store_true', help="每一幀都存完整畫面，不使用差異幀")
+    p.set_defaults(func=cmd_animate)
+
+    p = sub.add_parser('merge', help="依設定檔合併多個任務的片段")
+    p.add_argument('config', nargs='?', default=MERGE_CONFIG_PATH, help="merge_input.json 路徑")
+    p.add_argument('-o', '--output', help="輸出路徑 (預設為設定檔中的路徑)")
+    p.add_argument('--full', action='store_true', help="忽略上次的合併狀態，完整重建")
+    p.set_defaults(func=cmd_merge)
+
+    p = sub.add_parser('run', help="增量執行完整流程 (只重跑輸入有變動的階段)")
+    p.add_argument('tasks', nargs='*', help="任務 ID (預設為 json/task 底下全部)")
+    p.add_argument('--stages', nargs='+', choices=STAGE_ORDER, default=None,
+                   help="只執行指定的階段 (預設全部)")
+    p.add_argument('--merge', action='store_true', help="最後一併合併片段")
+    p.add_argument('--config', default=MERGE_CONFIG_PATH, help="merge_input.json 路徑")
+    p.add_argument('--mask', default=MASK_PATH, help="遮罩圖片路徑")
+    p.add_argument('--force', nargs='+', choices=STAGE_ORDER + ('merge',), default=[],
+                   help="強制重跑的階段名稱 (merge 為合併圖)")
+    p.add_argument('--dry-run', action='store_true', help="只列出會重跑的階段")
+    p.add_argument('--adopt', action='store_true', help="將已存在的輸出檔記錄為最新 (不重跑)")
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser('trace', help="彙總 --trace 記錄的各階段 p50 / p95 耗時")
+    p.add_argument('path', nargs='?', default=TRACE_PATH, help=f"紀錄檔 (預設 {TRACE_PATH})")
+    p.add_argument('--run', default=None, help="只彙總指定的 run ID ('last' 為最後一次執行，預設全部)")
+    p.add_argument('--stage', nargs='+', default=None, help="只列出指定的階段")
+    p.set_defaults(func=cmd_trace)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.profile:
+        import image_encoding
+        try:
+            image_encoding.set_default_profile(args.profile)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 2
+    if args.trace:
+        import tracing
+        run = tracing.enable(args.trace_path)
+        with tracing.span('run', command=args.command):
+            code = args.func(args)
+        print(f"📈 區段紀錄已寫入 {args.trace_path} (run {run})，"
+              f"以 python donut.py trace {args.trace_path} --run {run} 彙總")
+    else:
+        code = args.func(args)
+    # 有子命令寫出圖片時 (image_encoding 已被匯入) 印出各編碼設定檔的時間與大小
+    if 'image_encoding' in sys.modules:
+        sys.modules['image_encoding'].print_report()
+    return code
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+from PIL import Image
+import numpy as np
+import argparse
+import os
+import sys
+import time
+
+import tracing
+from generate_donut_ratio import (
+    read_task_score, create_output_dir, FULL_SCORE, INNER_RADIUS_RATIO, START_ANGLE_PIL,
+)
+from image_encoding import load_image
+from polar_index import PolarIndex, get_polar_index, ANGLE_UNITS
+
+# --- 1. 檔案路徑與設定 ---
+TASK = "task_20251213_045454"
+
+FRAMES = 60            # 從 0 分填到 total_score 的幀數 (含第一幀的 0 分)
+DURATION = 33          # 每幀顯示時間 (ms)
+HOLD = 1000            # 最後一幀 (完整分數) 額外停留的時間 (ms)
+DELTA = True           # 只儲存與前一幀不同的矩形區域 (False 則每一幀都是完整畫面)
+DEFAULT_FORMAT = 'apng'
+
+# 副檔名 → 格式；.png 視為 APNG
+FORMATS = {'.apng': 'apng', '.png': 'apng', '.gif': 'gif', '.webp': 'webp'}
+EXTENSIONS = {'apng': '.png', 'gif': '.gif', 'webp': '.webp'}
+
+GIF_TRANSPARENT = 255  # GIF 調色盤中保留給透明的索引，其餘 255 色給彩色與灰色像素
+PALETTE_SAMPLE = 4     # 建立 GIF 調色盤時每隔幾個圓環像素取樣一個
+
+# --- 2. 工具函數 ---
+
+def task_animation_path(task, fmt=DEFAULT_FORMAT):
+    return os.path.join('images', 'donut_animation', f'donut_animation_{task}{EXTENSIONS[fmt]}')
+
+def detect_format(output_path, fmt=None):
+    """未指定格式時依副檔名判斷，無法判斷則回傳 None。"""
+    if fmt:
+        return fmt.lower() if fmt.lower() in EXTENSIONS else None
+    return FORMATS.get(os.path.splitext(output_path)[1].lower())
+
+# --- 3. 逐幀填色 ---
+
+class FillAnimator:
+    """
+    彩色與灰色甜甜圈只解碼一次，圓環內的像素依「逆時針角度偏移」排序後，
+    每一幀只需要把角度落在上一幀與這一幀門檻之間的像素從灰色換成彩色。
+    整段動畫的填色工作量等於一張圖的圓環像素數，與幀數無關。
+
+    最後一幀與 generate_donut_ratio 的 cut_filled_sector + cut_missing_sector + assemble_donut_parts
+    (非抗鋸齒模式) 逐像素相同。
+    """
+
+    def __init__(self, color_image, gray_image, inner_ratio=INNER_RADIUS_RATIO, start_angle=START_ANGLE_PIL):
+        color_image = color_image.convert("RGBA")
+        gray_image = gray_image.convert("RGBA")
+        if gray_image.size != color_image.size:
+            gray_image = gray_image.resize(color_image.size, Image.Resampling.LANCZOS)
+        self.size = width, height = color_image.size
+
+        R = min(width, height) // 2
+        index = get_polar_index(width, height, start_angle)
+        pixels = np.flatnonzero(index.ring(R, int(R * inner_ratio)))
+        angles = np.asarray(index.angle).ravel()[pixels]
+        order = np.argsort(angles, kind='stable')
+        self.pixels = pixels[order]            # 圓環像素的平面索引，依角度由小到大
+        self.angles = angles[order]
+
+        # 圓環內一律不透明 (與 putalpha 扇形遮罩的結果相同)，圓環外全透明
+        self.color = np.asarray(color_image).reshape(-1, 4)[self.pixels]
+        self.gray = np.asarray(gray_image).reshape(-1, 4)[self.pixels]
+        self.color[:, 3] = 255
+        self.gray[:, 3] = 255
+
+    def filled_count(self, total_score, full_score=FULL_SCORE):
+        """分數對應的扇形包含多少個圓環像素 (排序後的前幾個)，門檻與 PolarIndex.sector 相同。"""
+        score_for_calc = max(0, min(total_score, full_score))
+        threshold = PolarIndex.threshold(score_for_calc / full_score * 360)
+        if threshold >= ANGLE_UNITS:
+            return len(self.pixels)
+        if threshold <= 0:
+            return 0
+        return int(np.searchsorted(self.angles, threshold, side='left'))
+
+    def frame_counts(self, total_score, frames=FRAMES, full_score=FULL_SCORE):
+        """每一幀已填色的像素數：第一幀 0 分，最後一幀剛好是 total_score。"""
+        if frames < 2:
+            return [self.filled_count(total_score, full_score)]
+        steps = [total_score * i / (frames - 1) for i in range(frames - 1)] + [total_score]
+        return [self.filled_count(score, full_score) for score in steps]
+
+    def _frames(self, canvas, colored, counts):
+        """
+        在同一塊畫布上逐幀更新 (分數只增不減，只會把灰色換成彩色)，
+        每一幀輸出一份陣列複本，畫布本身繼續留給下一幀使用。
+        """
+        flat = canvas.reshape(-1, *colored.shape[1:])
+        done = 0
+        for count in counts:
+            if count > done:
+                flat[self.pixels[done:count]] = colored[done:count]
+                done = count
+            yield canvas.copy()
+
+    def rgba_frames(self, total_score, frames=FRAMES, full_score=FULL_SCORE):
+        """逐幀產生 RGBA 的 Image (APNG / WebP 使用)。"""
+        width, height = self.size
+        canvas = np.zeros((height, width, 4), dtype=np.uint8)
+        canvas.reshape(-1, 4)[self.pixels] = self.gray
+        for frame in self._frames(canvas, self.color, self.frame_counts(total_score, frames, full_score)):
+            yield Image.fromarray(frame)
+
+    def palette(self):
+        """
+        以彩色與灰色圓環像素的取樣建立共用的 255 色調色盤 (索引 GIF_TRANSPARENT 保留給透明)，
+        回傳 (調色盤, 彩色索引, 灰色索引)。整段動畫共用同一組索引，各幀之間不會閃爍。
+        """
+        sample = np.concatenate([self.color[::PALETTE_SAMPLE, :3], self.gray[::PALETTE_SAMPLE, :3]])
+        sample_image = Image.frombytes("RGB", (len(sample), 1), sample.tobytes())
+        palette_image = sample_image.quantize(GIF_TRANSPARENT, method=Image.Quantize.MEDIANCUT)
+
+        def to_indices(rgba):
+            strip = Image.frombytes("RGB", (len(rgba), 1), np.ascontiguousarray(rgba[:, :3]).tobytes())
+            return np.asarray(strip.quantize(palette=palette_image, dither=Image.Dither.NONE)).ravel()
+
+        return palette_image.getpalette(), to_indices(self.color), to_indices(self.gray)
+
+    def palette_frames(self, total_score, frames=FRAMES, full_score=FULL_SCORE):
+        """逐幀產生共用調色盤的 P 模式 Image (GIF 使用)，透明索引為 GIF_TRANSPARENT。"""
+        palette, color_indices, gray_indices = self.palette()
+        width, height = self.size
+        canvas = np.full((height, width), GIF_TRANSPARENT, dtype=np.uint8)
+        canvas.reshape(-1)[self.pixels] = gray_indices
+        for data in self._frames(canvas, color_indices, self.frame_counts(total_score, frames, full_score)):
+            frame = Image.frombytes("P", self.size, data)
+            frame.putpalette(palette)
+            frame.info['transparency'] = GIF_TRANSPARENT
+            yield frame
+
+# --- 4. 編碼 ---
+
+def encoder_options(fmt, durations, delta=DELTA):
+    """
+    各格式的 save_all 參數。delta=True 時每一幀只存與前一幀不同的矩形 (前一幀保留不清除)；
+    delta=False 時每一幀都是不依賴前一幀的完整畫面，方便逐幀跳轉或編輯。
+    """
+    options = {'save_all': True, 'duration': durations, 'loop': 0}
+    if fmt == 'apng':
+        from PIL.PngImagePlugin import Disposal, Blend
+        options.update(format='PNG', blend=Blend.OP_SOURCE,
+                       disposal=Disposal.OP_NONE if delta else Disposal.OP_BACKGROUND)
+    elif fmt == 'gif':
+        options.update(format='GIF', transparency=GIF_TRANSPARENT, optimize=False,
+                       disposal=1 if delta else 2)
+    elif fmt == 'webp':
+        # kmax=1 讓每一幀都是關鍵幀；預設則由編碼器自行決定只編碼變動區域
+        options.update(format='WEBP', lossless=True, method=0, quality=0)
+        if not delta:
+            options.update(kmin=0, kmax=1)
+    return options
+
+def save_animation(frames, output_path, fmt, duration=DURATION, hold=HOLD, delta=DELTA):
+    """把逐幀 Image 寫成動畫檔，回傳輸出路徑。"""
+    frames = list(frames)
+    durations = [duration] * len(frames)
+    durations[-1] += hold
+    create_output_dir(output_path)
+    with tracing.span('encode', format=fmt, frames=len(frames), size=list(frames[0].size)) as span:
+        frames[0].save(output_path, append_images=frames[1:], **encoder_options(fmt, durations, delta))
+        span.set(path=output_path, bytes_written=os.path.getsize(output_path))
+    return output_path
+
+# --- 5. 主流程 ---
+
+def animate_donut_ratio(color_source, gray_source, total_score, output_path, fmt=None,
+                        frames=FRAMES, duration=DURATION, hold=HOLD, delta=DELTA, full_score=FULL_SCORE):
+    """
+    產生甜甜圈從 0 分填到 total_score 的動畫。
+
+    Args:
+        color_source, gray_source: 彩色 / 灰色甜甜圈的檔案路徑或 Image 物件。
+        total_score (float): 最後一幀的分數。
+        output_path (str): 輸出路徑，格式依副檔名判斷 (.png/.apng → APNG、.gif、.webp)。
+        fmt (str, optional): 強制指定格式 'apng' / 'gif' / 'webp'。
+        frames (int): 幀數。duration / hold: 每幀與最後一幀額外停留的時間 (ms)。
+        delta (bool): 是否以差異幀儲存。
+
+    Returns:
+        str: 輸出路徑，若失敗則回傳 None。
+    """
+    fmt = detect_format(output_path, fmt)
+    if fmt is None:
+        print(f"❌ 無法判斷動畫格式 (支援 {', '.join(EXTENSIONS)}): {output_path}")
+        return None
+    for source in (color_source, gray_source):
+        if isinstance(source, str) and not os.path.exists(source):
+            print(f"❌ 找不到圖片: {source}")
+            return None
+
+    try:
+        t0 = time.perf_counter()
+        color = color_source if isinstance(color_source, Image.Image) else load_image(color_source)
+        gray = gray_source if isinstance(gray_source, Image.Image) else load_image(gray_source)
+        with tracing.span('animate_frames', format=fmt, frames=frames, size=list(color.size)):
+            animator = FillAnimator(color, gray)
+            if fmt == 'gif':
+                frame_iter = animator.palette_frames(total_score, frames, full_score)
+            else:
+                frame_iter = animator.rgba_frames(total_score, frames, full_score)
+            rendered = list(frame_iter)
+        t1 = time.perf_counter()
+        save_animation(rendered, output_path, fmt, duration, hold, delta)
+        t2 = time.perf_counter()
+    except Exception as e:
+        print(f"❌ 動畫產生失敗: {e}")
+        return None
+
+    print(f"  ✅ {len(rendered)} 幀 {fmt.upper()} 動畫儲存至: {output_path} "
+          f"(填色 {(t1 - t0) * 1000:.0f} ms，編碼 {(t2 - t1) * 1000:.0f} ms)")
+    return output_path
+
+def animate_task(task, output_path=None, fmt=None, **options):
+    """以任務現有的 donut / donut_gray 與分數產生動畫。"""
+    fmt = fmt or (detect_format(output_path) if output_path else DEFAULT_FORMAT)
+    output_path = output_path or task_animation_path(task, fmt)
+    score = read_task_score(task)
+    return animate_donut_ratio(os.path.join('images', 'donut', f'donut_{task}.png'),
+                               os.path.join('images', 'donut_gray', f'donut_gray_{task}.png'),
+                               score, output_path, fmt=fmt, **options)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="產生甜甜圈從 0 分填到目前分數的動畫 (APNG / GIF / WebP)")
+    parser.add_argument('task', nargs='?', default=TASK, help="任務 ID")
+    parser.add_argument('-o', '--output', help="輸出路徑 (預設 images/donut_animation/)")
+    parser.add_argument('--format', choices=sorted(EXTENSIONS), help="動畫格式 (預設依副檔名，否則 apng)")
+    parser.add_argument('--frames', type=int, default=FRAMES, help=f"幀數 (預設 {FRAMES})")
+    parser.add_argument('--duration', type=int, default=DURATION, help=f"每幀毫秒數 (預設 {DURATION})")
+    parser.add_argument('--hold', type=int, default=HOLD, help=f"最後一幀額外停留毫秒數 (預設 {HOLD})")
+    parser.add_argument('--no-delta', action='store_true', help="每一幀都存完整畫面，不使用差異幀")
+    args = parser.parse_args()
+
+    print(f"--- 開始製作甜甜圈動畫 ({args.task}) ---")
+    result = animate_task(args.task, args.output, fmt=args.format, frames=args.frames,
+                          duration=args.duration, hold=args.hold, delta=not args.no_delta)
+    sys.exit(0 if result else 1)
@@ -0,0 +1,182 @@
+from PIL import Image
+import os
+import sys
+
+import image_encoding
+from tracing import traced
+from generate_donut import overlay_mask_image, overlay_mask_file, cut_donut
+from generate_to_gray_lowcontrast import to_gray_low_contrast, CONTRAST_REDUCTION
+from generate_donut_ratio import (
+    cut_filled_sector, cut_missing_sector, assemble_donut_parts,
+    read_task_score, FULL_SCORE, INNER_RADIUS_RATIO,
+)
+
+# --- 1. 檔案路徑與設定 ---
+TASK = "task_20251213_045454"
+
+MASK_PATH = os.path.join('images', 'mask.png')
+
+# 可以另外寫出的中間結果名稱 (預設全部只存在記憶體中)
+INTERMEDIATE_STAGES = ('merged', 'donut', 'gray', 'filled', 'missing')
+
+# --- 2. 工具函數 ---
+
+def task_paths(task):
+    """
+    回傳單一任務在專案目錄結構中的所有標準路徑。
+
+    Args:
+        task (str): 任務 ID，例如 "task_20251213_045454"。
+
+    Returns:
+        dict: 'generated', 'score', 'donut', 'gray', 'filled', 'ratio' 對應的路徑。
+    """
+    return {
+        'generated': os.path.join('images', 'generated_images', f'generated_image_{task}.png'),
+        'score': os.path.join('json', 'task', task, 'output.json'),
+        'donut': os.path.join('images', 'donut', f'donut_{task}.png'),
+        'gray': os.path.join('images', 'donut_gray', f'donut_gray_{task}.png'),
+        'filled': os.path.join('images', 'cutted_segment', f'donut_cutted_segment_{task}.png'),
+        'ratio': os.path.join('images', 'donut_ratio', f'donut_donut_ratio_{task}.png'),
+    }
+
+def open_rgba(source):
+    """接受檔案路徑或 Image 物件，一律回傳 RGBA 模式的 Image。"""
+    if isinstance(source, Image.Image):
+        return source.convert("RGBA")
+    return image_encoding.load_image(source, "RGBA")
+
+def save_image(img, output_path, intermediate=False):
+    """以目前的編碼設定檔儲存圖片 (見 image_encoding.py)，回傳實際寫出的路徑。"""
+    return image_encoding.save_image(img, output_path, intermediate=intermediate)
+
+# --- 3. 融合管線 ---
+
+@traced('pipeline')
+def render_donut_ratio(generated_image, mask_image, total_score, full_score=FULL_SCORE,
+                       output_path=None, intermediates=None,
+                       contrast_factor=CONTRAST_REDUCTION, inner_radius_ratio=INNER_RADIUS_RATIO):
+    """
+    一次完成 套用偵照 → 甜甜圈裁切 → 灰度低對比 → 扇形裁切 → 合併，
+    各步驟之間只傳遞記憶體中的 Image 物件，不會產生任何暫存 PNG。
+
+    Args:
+        generated_image (str | PIL.Image.Image): SDXL 生成的原始圖片 (路徑或 Image)。
+        mask_image (str | PIL.Image.Image): 遮罩圖片，通常為 images/mask.png。
+        total_score (float): 任務總得分。
+        full_score (float): 滿分 (預設為 FULL_SCORE)。
+        output_path (str, optional): 若指定，將最終成品儲存到此路徑。
+        intermediates (dict, optional): 需要另外寫出的中間結果，
+            鍵為 INTERMEDIATE_STAGES 之一，值為輸出路徑，例如 {'donut': 'images/donut/x.png'}。
+        contrast_factor (float): 灰度圖的對比度調整係數。
+        inner_radius_ratio (float): 內圓半徑與外圓半徑的比例。
+
+    Returns:
+        PIL.Image.Image: 最終組合完成的甜甜圈圖片。
+    """
+    if isinstance(mask_image, Image.Image):
+        merged = overlay_mask_image(open_rgba(generated_image), mask_image)
+    else:
+        # 以路徑指定的遮罩會使用縮放快取，避免每張圖都重做 LANCZOS 縮放
+        merged = overlay_mask_file(open_rgba(generated_image), mask_image)
+    donut = cut_donut(merged, inner_radius_ratio=inner_radius_ratio)
+    gray = to_gray_low_contrast(donut, contrast_factor)
+    filled = cut_filled_sector(donut, total_score, full_score)
+    missing = cut_missing_sector(gray, total_score, full_score)
+    final = assemble_donut_parts(filled, missing)
+
+    stages = {'merged': merged, 'donut': donut, 'gray': gray, 'filled': filled, 'missing': missing}
+    for stage, path in (intermediates or {}).items():
+        if stage not in stages:
+            print(f"❗ 警告: 未知的中間結果名稱 '{stage}'，可用名稱: {', '.join(INTERMEDIATE_STAGES)}")
+            continue
+        path = save_image(stages[stage], path, intermediate=True)
+        print(f"  ✅ 中間結果 {stage} 儲存至: {path}")
+
+    if output_path:
+        output_path = save_image(final, output_path)
+        print(f"  ✅ 最終合成圖片儲存至: {output_path}")
+
+    return final
+
+def record_artifacts(task, ratio_path=None):
+    """
+    將任務目前已存在的圖片路徑記錄到任務資料庫 (task_store.py，只在資料庫已存在時記錄)。
+    ratio_path 為 save_image 實際寫出的成品路徑 (web 設定檔會是 .webp)，取代標準的 .png 路徑。
+    """
+    import task_store
+    store = task_store.default_store(create=False)
+    if store is not None:
+        paths = task_paths(task)
+        if ratio_path:
+            paths['ratio'] = ratio_path
+        store.put(task, artifacts={kind: path for kind, path in paths.items() if os.path.exists(path)})
+
+def render_task(task, mask_path=MASK_PATH, save_intermediates=True):
+    """
+    依照專案目錄結構處理單一任務：讀取生成圖與分數，輸出 donut_ratio 成品。
+
+    Args:
+        task (str): 任務 ID。
+        mask_path (str): 遮罩圖片路徑。
+        save_intermediates (bool): 是否一併寫出 donut、donut_gray 與 cutted_segment
+            (其他腳本如 merge_segment.py 會使用這些檔案)。
+
+    Returns:
+        str: 最終成品路徑，若失敗則回傳 None。
+    """
+    paths = task_paths(task)
+    if not os.path.exists(paths['generated']):
+        print(f"❌ 找不到生成圖片: {paths['generated']}")
+        return None
+
+    score = read_task_score(task, paths['score'])
+    intermediates = None
+    if save_intermediates:
+        intermediates = {'donut': paths['donut'], 'gray': paths['gray'], 'filled': paths['filled']}
+
+    try:
+        final = render_donut_ratio(paths['generated'], mask_path, score, intermediates=intermediates)
+        ratio_path = save_image(final, paths['ratio'])
+    except Exception as e:
+        print(f"❌ 甜甜圈管線執行失敗: {e}")
+        return None
+    print(f"  ✅ 最終合成圖片儲存至: {ratio_path}")
+    record_artifacts(task, ratio_path)
+    return ratio_path
+
+def render_task_ratio(task):
+    """
+    只重新產生單一任務的 cutted_segment 與 donut_ratio (分數變動時使用)，
+    直接沿用已存在的 donut 與 donut_gray，不重做遮罩疊加與灰度轉換。
+
+    Returns:
+        str: 最終成品路徑，若失敗則回傳 None。
+    """
+    paths = task_paths(task)
+    if not os.path.exists(paths['donut']) or not os.path.exists(paths['gray']):
+        print(f"❗ 找不到 {task} 的 donut / donut_gray，改為執行完整管線。")
+        return render_task(task)
+
+    score = read_task_score(task, paths['score'])
+    try:
+        filled = cut_filled_sector(image_encoding.load_image(paths['donut']), score, FULL_SCORE)
+        missing = cut_missing_sector(image_encoding.load_image(paths['gray']), score, FULL_SCORE)
+        final = assemble_donut_parts(filled, missing)
+        save_image(filled, paths['filled'], intermediate=True)
+        ratio_path = save_image(final, paths['ratio'])
+    except Exception as e:
+        print(f"❌ 比例甜甜圈重新產生失敗: {e}")
+        return None
+    print(f"  ✅ 最終合成圖片儲存至: {ratio_path}")
+    record_artifacts(task, ratio_path)
+    return ratio_path
+
+if __name__ == "__main__":
+    # 用法: python donut_pipeline.py [任務 ID] [--profile NAME]
+    argv = image_encoding.pop_profile_argument(sys.argv[1:])
+    task = argv[0] if argv else TASK
+    print(f"--- 開始執行甜甜圈融合管線 ({task}) ---")
+    render_task(task)
+    image_encoding.print_report()
+    print("--- 結束 ---")
@@ -1,5 +1,10 @@
-from PIL import Image, ImageDraw, ImageOps
-import os
+from PIL import Image, ImageOps
+import sys
+
+from image_encoding import save_image, load_image, pop_profile_argument, print_report
+from mask_cache import get_donut_mask
+from overlay_cache import get_resized_overlay
+from tracing import traced
 
 # --- 範例使用 (請務必將路徑替換成您實際的檔案路徑) ---
 TASK = "task_20251213_045454"
@@ -13,6 +18,50 @@ FINAL_OUTPUT = f"images\\donut\\donut_{TASK}.png"# 最終成品
 
 # --- 1. 圖片合併功能 (來自 merge.py) ---
 
+@traced('mask_overlay')
+def overlay_mask_image(target_img, mask_img):
+    """
+    在記憶體中將遮罩圖片調整大小後疊加到目標圖片上，不經過任何暫存檔。
+
+    Args:
+        target_img (PIL.Image.Image): 目標基礎圖片 (背景)。
+        mask_img (PIL.Image.Image): 作為前景的遮罩圖片 (偵照)。
+
+    Returns:
+        PIL.Image.Image: 合併後的 RGBA 圖片。
+    """
+    target_img = target_img.convert("RGBA")
+    mask_img = mask_img.convert("RGBA")
+
+    # 3. 調整遮罩圖片大小以符合目標尺寸
+    # 使用 Image.Resampling.LANCZOS 進行高品質重採樣
+    resized_mask = mask_img.resize(target_img.size, Image.Resampling.LANCZOS)
+    print(f"   遮罩已調整至目標尺寸: {resized_mask.size}")
+
+    # 4. 執行圖片疊加/合併 (透明度疊加)
+    # 這裡假設遮罩圖片的 Alpha 通道已經正確定義了其透明區域。
+    return Image.alpha_composite(target_img, resized_mask)
+
+
+@traced('mask_overlay')
+def overlay_mask_file(target_img, mask_path, resample=Image.Resampling.LANCZOS):
+    """
+    與 overlay_mask_image 相同，但遮罩以檔案路徑指定，縮放結果由 overlay_cache 快取
+    (依遮罩內容雜湊、目標尺寸與濾鏡)，批次處理時只剩下 alpha_composite 這一步。
+
+    Args:
+        target_img (PIL.Image.Image): 目標基礎圖片 (背景)。
+        mask_path (str): 遮罩圖片路徑 (偵照)。
+        resample (int): 縮放遮罩時使用的重採樣濾鏡。
+
+    Returns:
+        PIL.Image.Image: 合併後的 RGBA 圖片。
+    """
+    target_img = target_img.convert("RGBA")
+    resized_mask = get_resized_overlay(mask_path, target_img.size, resample)
+    return Image.alpha_composite(target_img, resized_mask)
+
+
 def merge_images_with_mask(target_image_path, mask_path, output_path):
     """
     將遮罩圖片 (mask_path) 調整大小後，疊加到目標圖片 (target_image_path) 上。
@@ -29,13 +78,12 @@ def merge_images_with_mask(target_image_path, mask_path, output_path):
     print("--- 步驟 1: 執行圖片合併 (套用偵照) ---")
     try:
         # 1. 開啟目標圖片 (背景)
-        target_img = Image.open(target_image_path).convert("RGBA")
+        target_img = load_image(target_image_path, "RGBA")
         target_size = target_img.size
         print(f"   目標圖片尺寸 (Target): {target_size}")
 
-        # 2. 開啟作為前景的遮罩圖片
-        mask_img = Image.open(mask_path).convert("RGBA")
-        print(f"   原始遮罩尺寸 (Original Mask): {mask_img.size}")
+        # 2. 套用作為前景的遮罩圖片 (縮放結果經由快取共用)
+        merged_img = overlay_mask_file(target_img, mask_path)
 
     except FileNotFoundError as e:
         print(f"   錯誤：找不到圖片文件 - {e.filename}")
@@ -44,41 +92,32 @@ def merge_images_with_mask(target_image_path, mask_path, output_path):
         print(f"   處理圖片時發生錯誤: {e}")
         return None
 
-    # 3. 調整遮罩圖片大小以符合目標尺寸
-    # 使用 Image.Resampling.LANCZOS 進行高品質重採樣
-    resized_mask = mask_img.resize(target_size, Image.Resampling.LANCZOS)
-    print(f"   遮罩已調整至目標尺寸: {resized_mask.size}")
-
-    # 4. 執行圖片疊加/合併 (透明度疊加)
-    # 這裡假設遮罩圖片的 Alpha 通道已經正確定義了其透明區域。
-    merged_img = Image.alpha_composite(target_img, resized_mask)
-
     # 5. 儲存結果
-    merged_img.save(output_path, "PNG")
+    try:
+        output_path = save_image(merged_img, output_path, intermediate=True)
+    except Exception as e:
+        print(f"   儲存圖片時發生錯誤: {e}")
+        return None
     print(f"   ✅ 合併圖片暫存於：{output_path}")
     return output_path
 
 
 # --- 2. 甜甜圈裁切功能 (來自 generate_donut.py) ---
 
-def crop_to_donut(image_path, output_path, outer_radius=None, inner_radius_ratio=0.5):
-    """ 
-    將指定路徑的圖片裁剪成甜甜圈形狀，並儲存為 PNG 格式。
-    
+@traced('donut_crop')
+def cut_donut(img, outer_radius=None, inner_radius_ratio=0.5):
+    """
+    在記憶體中將圖片裁剪成甜甜圈形狀。
+
     Args:
-        image_path (str): 輸入圖片的路徑。
-        output_path (str): 輸出甜甜圈圖片的路徑 (必須是 .png 結尾)。
+        img (PIL.Image.Image): 輸入圖片。
         outer_radius (int, optional): 甜甜圈的外圓半徑。如果為 None，則取圖片較短邊長的一半。
         inner_radius_ratio (float): 內圓半徑與外圓半徑的比例（預設為 0.5）。
-    """
-    print("--- 步驟 2: 執行甜甜圈裁切 ---")
-    try:
-        # 1. 開啟圖片並轉換為 RGBA 模式以支援透明度
-        img = Image.open(image_path).convert("RGBA")
-    except FileNotFoundError:
-        print(f"   錯誤：找不到圖片文件 - {image_path}")
-        return
 
+    Returns:
+        PIL.Image.Image: 裁切後的 RGBA 甜甜圈圖片。
+    """
+    img = img.convert("RGBA")
     width, height = img.size
 
     # 2. 決定半徑和圓心
@@ -91,34 +130,52 @@ def crop_to_donut(image_path, output_path, outer_radius=None, inner_radius_ratio
     cx = width // 2
     cy = height // 2
     
-    # 3. 創建遮罩
-    mask = Image.new('L', (width, height), 0)
-    draw = ImageDraw.Draw(mask)
-    
-    # a. 繪製白色大圓 (保留)
-    draw.ellipse((cx - R, cy - R, cx + R, cy + R), fill=255)
-    
-    # b. 繪製黑色小圓 (移除/變透明)
-    draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=0)
+    # 3. 取得遮罩 (白色大圓保留、黑色小圓移除)，相同尺寸的遮罩由快取共用
+    mask = get_donut_mask(width, height, R, inner_radius_ratio)
     
     # 4. 將遮罩應用於圖片的 Alpha 通道
     img.putalpha(mask)
     
     # 5. 裁剪圖片到最小邊界框
     crop_area = (cx - R, cy - R, cx + R, cy + R)
-    cropped_img = img.crop(crop_area)
+    return img.crop(crop_area)
+
+
+def crop_to_donut(image_path, output_path, outer_radius=None, inner_radius_ratio=0.5):
+    """ 
+    將指定路徑的圖片裁剪成甜甜圈形狀，並儲存為 PNG 格式。
     
+    Args:
+        image_path (str): 輸入圖片的路徑。
+        output_path (str): 輸出甜甜圈圖片的路徑 (必須是 .png 結尾)。
+        outer_radius (int, optional): 甜甜圈的外圓半徑。如果為 None，則取圖片較短邊長的一半。
+        inner_radius_ratio (float): 內圓半徑與外圓半徑的比例（預設為 0.5）。
+    """
+    print("--- 步驟 2: 執行甜甜圈裁切 ---")
+    try:
+        # 1. 開啟圖片並轉換為 RGBA 模式以支援透明度
+        img = load_image(image_path, "RGBA")
+    except FileNotFoundError:
+        print(f"   錯誤：找不到圖片文件 - {image_path}")
+        return
+
+    cropped_img = cut_donut(img, outer_radius, inner_radius_ratio)
+
     # 6. 儲存結果
-    cropped_img.save(output_path, 'PNG')
+    try:
+        output_path = save_image(cropped_img, output_path, intermediate=True)
+    except Exception as e:
+        print(f"   儲存圖片時發生錯誤: {e}")
+        return
     
     print(f"   ✅ 圖片已成功裁切為甜甜圈形狀並儲存到：{output_path}")
 
 
 # --- 主執行流程 ---
 
-def main_process(target_image_path, mask_path, final_output_path, temp_output_path='temp_merged_image.png'):
+def main_process(target_image_path, mask_path, final_output_path, temp_output_path=None, inner_radius_ratio=0.5):
     """
-    依照指定的順序執行圖片處理：
+    依照指定的順序執行圖片處理 (全程在記憶體中傳遞 Image 物件)：
     1. 合併圖片 (套用偵照/遮罩)。
     2. 裁切為甜甜圈形狀。
     
@@ -126,27 +183,51 @@ def main_process(target_image_path, mask_path, final_output_path, temp_output_pa
         target_image_path (str): 作為背景的圖片路徑 (原始圖片)。
         mask_path (str): 作為前景的遮罩圖片路徑 (偵照)。
         final_output_path (str): 最終甜甜圈圖片的輸出路徑。
-        temp_output_path (str): 步驟 1 中間結果的暫存路徑。
+        temp_output_path (str, optional): 若指定，額外儲存步驟 1 的中間結果 (預設不寫出)。
+        inner_radius_ratio (float): 內圓半徑與外圓半徑的比例（預設為 0.5）。
     """
     
     # 1. 執行圖片合併
-    merged_file = merge_images_with_mask(target_image_path, mask_path, temp_output_path)
-    
-    if merged_file is None:
-        print("❌ 合併步驟失敗，終止程式。")
-        return
+    print("--- 步驟 1: 執行圖片合併 (套用偵照) ---")
+    try:
+        target_img = load_image(target_image_path)
+        merged_img = overlay_mask_file(target_img, mask_path)
+    except FileNotFoundError as e:
+        print(f"   錯誤：找不到圖片文件 - {e.filename}")
+        merged_img = None
+    except Exception as e:
+        print(f"   處理圖片時發生錯誤: {e}")
+        merged_img = None
 
-    # 2. 執行甜甜圈裁切 (對合併後的圖片進行裁切)
-    crop_to_donut(merged_file, final_output_path)
+    if merged_img is None:
+        print("❌ 合併步驟失敗，終止程式。")
+        return None
 
-    # 3. 清理暫存文件
     try:
-        if os.path.exists(temp_output_path):
-            os.remove(temp_output_path)
-            print(f"--- 清理: 已移除暫存文件 {temp_output_path}")
-    except OSError as e:
-        print(f"清理暫存文件失敗: {e}")
+        if temp_output_path:
+            temp_output_path = save_image(merged_img, temp_output_path, intermediate=True)
+            print(f"   ✅ 合併圖片 (中間結果) 儲存於：{temp_output_path}")
+
+        # 2. 執行甜甜圈裁切 (對合併後的圖片進行裁切)
+        print("--- 步驟 2: 執行甜甜圈裁切 ---")
+        donut_img = cut_donut(merged_img, inner_radius_ratio=inner_radius_ratio)
+        final_output_path = save_image(donut_img, final_output_path, intermediate=True)
+    except Exception as e:
+        print(f"   儲存圖片時發生錯誤: {e}")
+        print("❌ 甜甜圈裁切步驟失敗，終止程式。")
+        return None
+    print(f"   ✅ 圖片已成功裁切為甜甜圈形狀並儲存到：{final_output_path}")
+    return final_output_path
 
 
 # 執行主程序
-main_process(IMAGE_PATH, MASK_PATH, FINAL_OUTPUT)
\ No newline at end of file
+# 加上 --watch 參數則改為長駐模式，監看新的生成圖並增量產生甜甜圈 (見 watch_tasks.py)
+if __name__ == "__main__":
+    # --profile NAME: 輸出圖片的編碼設定檔 (見 image_encoding.py)
+    argv = pop_profile_argument(sys.argv[1:])
+    if '--watch' in argv:
+        from watch_tasks import watch
+        watch()
+    else:
+        main_process(IMAGE_PATH, MASK_PATH, FINAL_OUTPUT)
+        print_report()
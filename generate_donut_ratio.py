@@ -1,9 +1,13 @@
-from PIL import Image, ImageDraw
+from PIL import Image
 import json
 import os
 import math
 import sys
 
+from image_encoding import save_image, load_image, pop_profile_argument, print_report
+from polar_index import get_offset_sector_mask
+from tracing import traced
+
 # --- 1. 檔案路徑與設定 ---
 TASK = "task_20251213_045454"
 
@@ -20,8 +24,6 @@ LOW_CONTRAST_IMAGE_PATH = f'images\\donut_gray\\donut_gray_{TASK}.png'
 FILLED_SECTOR_PATH = f'images\\cutted_segment\\donut_cutted_segment_{TASK}.png' 
 FINAL_ASSEMBLED_DONUT = f'images\\donut_ratio\\donut_donut_ratio_{TASK}.png'              
 
-MISSING_SECTOR_TEMP = 'missing_sector_temp.png' 
-
 # --- 2. 工具函數 ---
 
 def create_output_dir(output_path):
@@ -40,14 +42,33 @@ def read_score(score_data_path):
         print(f"❌ 無法讀取分數，使用 0 分: {e}")
         return 0.0
 
+def read_task_score(task, score_data_path=None):
+    """先從任務資料庫 (task_store.py) 取得分數，沒有記錄或 output.json 比記錄新時讀取 output.json。"""
+    import task_store
+    store = task_store.default_store(create=False)
+    if store is not None:
+        score = store.scores([task]).get(task)
+        if score is not None:
+            return max(0.0, float(score))
+    return read_score(score_data_path or os.path.join('json', 'task', task, 'output.json'))
+
 # --- 3. 核心裁切邏輯 (逆時針版) ---
 
-def crop_filled_sector(image_path, total_score, full_score, output_path):
+def _sector_mask(size, start_offset, end_offset):
     """
-    裁切「已完成」的部分 (從 270 度 *逆時針* 生長)。
+    取得從 START_ANGLE_PIL *逆時針* 量起 [start_offset, end_offset) 度的扇形甜甜圈遮罩 ('L' 模式)，
+    由預先計算的極座標索引做一次門檻比較產生。
     """
-    print("\n--- 步驟 1: 生成已完成扇形 (逆時針) ---")
+    width, height = size
+    R = min(width, height) // 2 
+    return get_offset_sector_mask(width, height, R, INNER_RADIUS_RATIO,
+                                  start_offset, end_offset, START_ANGLE_PIL)
 
+@traced('sector_crop_filled')
+def cut_filled_sector(img, total_score, full_score):
+    """
+    在記憶體中裁切「已完成」的部分 (從 270 度 *逆時針* 生長)，回傳 RGBA 圖片。
+    """
     # 1. 計算角度
     score_for_calc = max(0, min(total_score, full_score))
     proportion = score_for_calc / full_score
@@ -64,51 +85,16 @@ def crop_filled_sector(image_path, total_score, full_score, output_path):
     print(f"  總得分: {total_score:.2f} ({proportion*100:.1f}%)")
     print(f"  PIL 繪圖參數: Start={start_angle_norm:.1f} -> End={end_angle_norm:.1f} (順時針繪製形成逆時針扇形)")
 
-    # (已移除 angle_results 的字典建構)
-    
     # 2. 裁切處理
-    if not os.path.exists(image_path):
-        print(f"❌ 找不到圖片: {image_path}")
-        return False
-        
-    try:
-        img = Image.open(image_path).convert("RGBA")
-        width, height = img.size
-        
-        mask = Image.new('L', (width, height), 0)
-        draw = ImageDraw.Draw(mask)
-
-        cx, cy = width // 2, height // 2
-        R = min(width, height) // 2 
-        r = int(R * INNER_RADIUS_RATIO) 
-
-        if filled_degree > 0:
-            draw.pieslice(
-                (cx - R, cy - R, cx + R, cy + R), 
-                start_angle, 
-                end_angle, 
-                fill=255
-            )
-        
-        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=0)
+    img = img.convert("RGBA")
+    img.putalpha(_sector_mask(img.size, 0.0, filled_degree))
+    return img
 
-        img.putalpha(mask)
-        
-        create_output_dir(output_path)
-        img.save(output_path, 'PNG')
-        # (已移除 write_json 呼叫)
-        print(f"  ✅ 已完成部分儲存至: {output_path}")
-        return True
-    except Exception as e:
-        print(f"❌ 裁切已完成部分失敗: {e}")
-        return False
-
-def crop_missing_sector(full_image_path, total_score, full_score, output_path):
+@traced('sector_crop_missing')
+def cut_missing_sector(img, total_score, full_score):
     """
-    裁切「缺失/剩餘」的部分 (佔據圓的其他部分)。
+    在記憶體中裁切「缺失/剩餘」的部分 (佔據圓的其他部分)，回傳 RGBA 圖片。
     """
-    print("\n--- 步驟 2: 生成缺失扇形 (逆時針剩餘部分) ---")
-    
     # 1. 計算角度
     score_for_calc = max(0, min(total_score, full_score))
     proportion = score_for_calc / full_score
@@ -124,35 +110,62 @@ def crop_missing_sector(full_image_path, total_score, full_score, output_path):
     print(f"  缺失比例: {(1-proportion)*100:.1f}%")
     print(f"  PIL 繪圖參數: Start={start_angle_norm:.1f} -> End={end_angle_norm:.1f}")
 
+    img = img.convert("RGBA")
+    img.putalpha(_sector_mask(img.size, filled_degree, 360.0))
+    return img
+
+@traced('sector_assemble')
+def assemble_donut_parts(img_top, img_bottom):
+    """
+    在記憶體中合併：img_top (已完成/彩色) 在上層，img_bottom (缺失/灰色) 在下層。
+    """
+    img_top = img_top.convert("RGBA")
+    img_bottom = img_bottom.convert("RGBA")
+
+    # 建立底圖
+    canvas = Image.new('RGBA', img_top.size, (0, 0, 0, 0))
+    
+    # 先貼灰色 (背景)
+    if img_bottom.size != canvas.size:
+        img_bottom = img_bottom.resize(canvas.size, Image.Resampling.LANCZOS)
+    canvas.paste(img_bottom, (0, 0), img_bottom)
+    
+    # 再貼彩色 (前景)
+    canvas.paste(img_top, (0, 0), img_top)
+    return canvas
+
+def crop_filled_sector(image_path, total_score, full_score, output_path):
+    """
+    裁切「已完成」的部分 (從 270 度 *逆時針* 生長)。
+    """
+    print("\n--- 步驟 1: 生成已完成扇形 (逆時針) ---")
+
+    if not os.path.exists(image_path):
+        print(f"❌ 找不到圖片: {image_path}")
+        return False
+        
+    try:
+        img = cut_filled_sector(load_image(image_path), total_score, full_score)
+        output_path = save_image(img, output_path, intermediate=True)
+        print(f"  ✅ 已完成部分儲存至: {output_path}")
+        return True
+    except Exception as e:
+        print(f"❌ 裁切已完成部分失敗: {e}")
+        return False
+
+def crop_missing_sector(full_image_path, total_score, full_score, output_path):
+    """
+    裁切「缺失/剩餘」的部分 (佔據圓的其他部分)。
+    """
+    print("\n--- 步驟 2: 生成缺失扇形 (逆時針剩餘部分) ---")
+
     if not os.path.exists(full_image_path):
         print(f"❌ 找不到圖片: {full_image_path}")
         return None
 
     try:
-        img = Image.open(full_image_path).convert("RGBA")
-        width, height = img.size
-        
-        mask = Image.new('L', (width, height), 0)
-        draw = ImageDraw.Draw(mask)
-
-        cx, cy = width // 2, height // 2
-        R = min(width, height) // 2 
-        r = int(R * INNER_RADIUS_RATIO) 
-
-        if proportion < 1.0:
-            draw.pieslice(
-                (cx - R, cy - R, cx + R, cy + R), 
-                start_angle, 
-                end_angle, 
-                fill=255
-            )
-        
-        draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=0)
-        
-        img.putalpha(mask)
-        
-        create_output_dir(output_path)
-        img.save(output_path, 'PNG')
+        img = cut_missing_sector(load_image(full_image_path), total_score, full_score)
+        output_path = save_image(img, output_path, intermediate=True)
         print(f"  ✅ 缺失部分儲存至暫存: {output_path}")
         return output_path
     except Exception as e:
@@ -169,22 +182,8 @@ def merge_donut_parts(part1_path, part2_path, output_path):
             print("❌ 錯誤: 合併來源檔案缺失。")
             return None
 
-        img_top = Image.open(part1_path).convert("RGBA")  # 彩色
-        img_bottom = Image.open(part2_path).convert("RGBA") # 灰色
-        
-        # 建立底圖
-        canvas = Image.new('RGBA', img_top.size, (0, 0, 0, 0))
-        
-        # 先貼灰色 (背景)
-        if img_bottom.size != canvas.size:
-            img_bottom = img_bottom.resize(canvas.size, Image.Resampling.LANCZOS)
-        canvas.paste(img_bottom, (0, 0), img_bottom)
-        
-        # 再貼彩色 (前景)
-        canvas.paste(img_top, (0, 0), img_top)
-
-        create_output_dir(output_path)
-        canvas.save(output_path, 'PNG')
+        canvas = assemble_donut_parts(load_image(part1_path), load_image(part2_path))
+        output_path = save_image(canvas, output_path)
         print(f"  ✅ 最終合成圖片儲存至: {output_path}")
         return output_path
     except Exception as e:
@@ -195,32 +194,42 @@ def merge_donut_parts(part1_path, part2_path, output_path):
 
 def main():
     score = read_score(SCORE_DATA_PATH)
-    
-    # 呼叫時移除 json_output_path 參數
-    filled_ok = crop_filled_sector(
-        ORIGINAL_IMAGE_PATH, score, FULL_SCORE, 
-        FILLED_SECTOR_PATH
-    )
-
-    missing_path = crop_missing_sector(
-        LOW_CONTRAST_IMAGE_PATH, score, FULL_SCORE, 
-        MISSING_SECTOR_TEMP
-    )
-
-    if filled_ok and missing_path:
-        merge_donut_parts(FILLED_SECTOR_PATH, missing_path, FINAL_ASSEMBLED_DONUT)
-    else:
-        print("❌ 無法執行合併，因為裁切步驟失敗。")
 
-    if os.path.exists(MISSING_SECTOR_TEMP):
-        try:
-            os.remove(MISSING_SECTOR_TEMP)
-            print("  🗑️  清理暫存檔完成")
-        except:
-            pass
+    # 兩張來源圖只解碼一次，之後全程在記憶體中傳遞
+    if not os.path.exists(ORIGINAL_IMAGE_PATH) or not os.path.exists(LOW_CONTRAST_IMAGE_PATH):
+        print("❌ 無法執行合併，因為找不到彩色或灰色甜甜圈圖片。")
+        return None
 
+    try:
+        print("\n--- 步驟 1: 生成已完成扇形 (逆時針) ---")
+        filled_img = cut_filled_sector(load_image(ORIGINAL_IMAGE_PATH), score, FULL_SCORE)
+
+        print("\n--- 步驟 2: 生成缺失扇形 (逆時針剩餘部分) ---")
+        missing_img = cut_missing_sector(load_image(LOW_CONTRAST_IMAGE_PATH), score, FULL_SCORE)
+
+        print("\n--- 步驟 3: 合併圖片 ---")
+        final_img = assemble_donut_parts(filled_img, missing_img)
+
+        filled_path = save_image(filled_img, FILLED_SECTOR_PATH, intermediate=True)
+        print(f"  ✅ 已完成部分儲存至: {filled_path}")
+
+        final_path = save_image(final_img, FINAL_ASSEMBLED_DONUT)
+    except Exception as e:
+        print(f"❌ 裁切或合併失敗: {e}")
+        return None
+
+    print(f"  ✅ 最終合成圖片儲存至: {final_path}")
+    return final_path
+
+# 加上 --watch 參數則改為長駐模式，分數或生成圖變動時自動重新產生 (見 watch_tasks.py)
+# --profile NAME 指定輸出圖片的編碼設定檔 (見 image_encoding.py)
 if __name__ == "__main__":
-    print(f"--- 開始製作甜甜圈圖 ({TASK}) ---")
-    print("--- 模式: 統一逆時針 ---")
-    main()
-    print("--- 結束 ---")
\ No newline at end of file
+    if '--watch' in pop_profile_argument(sys.argv[1:]):
+        from watch_tasks import watch
+        watch()
+    else:
+        print(f"--- 開始製作甜甜圈圖 ({TASK}) ---")
+        print("--- 模式: 統一逆時針 ---")
+        main()
+        print_report()
+        print("--- 結束 ---")
@@ -1,8 +1,12 @@
 import os
 import gc
-import torch
-from PIL import Image
-from diffusers import StableDiffusionXLPipeline
+import random
+import sys
+
+import tracing
+
+# torch / diffusers 只在真正需要模型時才匯入 (見 get_device / load_pipeline)，
+# 讓其他腳本可以讀取本檔的設定值而不必付出載入 torch 的成本。
 
 # --- 1. 設定參數與路徑 ---
 
@@ -10,6 +14,16 @@ TASK = "task_20251213_045454"
 
 # 🚨 模型本地資料夾路徑 (根據您的要求修改)
 SDXL_MODEL_PATH = r"\\MSI\sdxl_base"
+# 先將模型同步到本機鏡像 (model_store.py)，只複製有變動的檔案，之後從本機磁碟以記憶體映射載入
+USE_LOCAL_MIRROR = True
+
+# 生成參數
+NUM_INFERENCE_STEPS = 25
+GUIDANCE_SCALE = 7.5
+
+# 批次生成：一次送進 UNet 的圖片數量上限，以及每張 1024x1024 圖片估計需要的記憶體
+MAX_BATCH_SIZE = 4
+MEMORY_PER_IMAGE_MB = 2048
 
 # 輸入檔案路徑 (與 .py 腳本相同目錄)
 POSITIVE_PROMPT_INPUT_FILE = f"prompt\\positive\\positive_{TASK}.txt"
@@ -21,25 +35,32 @@ IMAGE_OUTPUT_FILENAME = f"images\\generated_images\\generated_image_{TASK}.png"
 
 # --- 2. 環境準備與記憶體清理 ---
 
+def task_prompt_paths(task):
+    """回傳任務的 (positive prompt, negative prompt, 生成圖片) 路徑。"""
+    return (
+        os.path.join('prompt', 'positive', f'positive_{task}.txt'),
+        os.path.join('prompt', 'negative', f'negative_{task}.txt'),
+        os.path.join('images', 'generated_images', f'generated_image_{task}.png'),
+    )
+
 # 記憶體清理工具
 def flush_memory():
     """清理 CUDA 記憶體並運行 Python 垃圾回收"""
+    import torch
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
     gc.collect()
     print("✅ 記憶體已清理。")
 
 # 檢查 CUDA (GPU) 是否可用
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-if DEVICE == "cuda":
-    print(f"--- 偵測到 GPU: {torch.cuda.get_device_name(0)}，將使用 GPU 運算。 ---")
-else:
-    print("--- 警告: 未偵測到 GPU，將使用 CPU 運算 (速度會慢很多)。 ---")
-
-
-
-print(f"\n✅ 期望的 SDXL 模型路徑: {SDXL_MODEL_PATH}")
-print(f"✅ 圖像輸出檔案: {IMAGE_OUTPUT_FILENAME}\n")
+def get_device():
+    import torch
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cuda":
+        print(f"--- 偵測到 GPU: {torch.cuda.get_device_name(0)}，將使用 GPU 運算。 ---")
+    else:
+        print("--- 警告: 未偵測到 GPU，將使用 CPU 運算 (速度會慢很多)。 ---")
+    return device
 
 
 # --- 3. 模型存在性檢查 (不自動下載) ---
@@ -53,85 +74,341 @@ def check_model_exists(local_path):
         print("請確認您已手動將 Stable Diffusion XL 模型內容放到該目錄。")
         return False
 
-if not check_model_exists(SDXL_MODEL_PATH):
-    # 終止程式
-    raise SystemExit("SDXL 模型未找到，程式終止。")
 
-flush_memory() # 清理記憶體
+# --- 4. 載入 SDXL 模型 ---
 
+@tracing.traced('model_load')
+def load_pipeline(model_path=SDXL_MODEL_PATH, device=None, use_mirror=USE_LOCAL_MIRROR):
+    """
+    從本地路徑載入 Stable Diffusion XL (T2I) 模型。
 
-# --- 4. 載入 SDXL 模型 ---
+    Args:
+        use_mirror (bool): 是否先同步並改用本機鏡像。safetensors 權重會以記憶體映射開啟，
+            從本機磁碟載入時啟動時間取決於實際讀取的頁面，而不是每次都透過網路讀完整個檔案。
 
-print("\n--- 正在載入 Stable Diffusion XL (T2I) 模型 ---")
-try:
-    # 從本地路徑載入模型
-    pipe_t2i = StableDiffusionXLPipeline.from_pretrained(
-        SDXL_MODEL_PATH,
-        torch_dtype=torch.float16,
-        use_safetensors=True,
-    ).to(DEVICE) # 使用偵測到的裝置
-
-    # 啟用 CPU Offload (如果使用 GPU 且記憶體不足，這是一個很好的優化)
-    if DEVICE == "cuda":
-        pipe_t2i.enable_model_cpu_offload()
-
-    print("✅ Stable Diffusion XL 載入完成。")
-except Exception as e:
-    print(f"❌ 載入 SDXL 失敗: {e}")
-    flush_memory()
-    raise SystemExit("SDXL 模型載入失敗，程式終止。")
+    Returns:
+        StableDiffusionXLPipeline: 載入完成的模型，若失敗則回傳 None。
+    """
+    import torch
+    from diffusers import StableDiffusionXLPipeline
 
+    if use_mirror:
+        from model_store import ensure_local_model
+        local_path = ensure_local_model(model_path)
+        if local_path is None:
+            print("❗ 無法建立本機鏡像，直接從原路徑載入。")
+        else:
+            model_path = local_path
 
-# --- 5. 圖像生成 (T2I) ---
+    if not check_model_exists(model_path):
+        return None
+
+    flush_memory() # 清理記憶體
+
+    if device is None:
+        device = get_device()
 
-print("\n=================================================")
-print("          🖼️ 圖像生成 (T2I) 開始")
-print("=================================================")
+    print("\n--- 正在載入 Stable Diffusion XL (T2I) 模型 ---")
+    try:
+        # 從本地路徑載入模型
+        pipe_t2i = StableDiffusionXLPipeline.from_pretrained(
+            model_path,
+            torch_dtype=torch.float16,
+            use_safetensors=True,
+        ).to(device) # 使用偵測到的裝置
 
-# 讀取 Prompt 檔案
-try:
-    with open(POSITIVE_PROMPT_INPUT_FILE, 'r', encoding='utf-8') as f:
+        # 啟用 CPU Offload (如果使用 GPU 且記憶體不足，這是一個很好的優化)
+        if device == "cuda":
+            pipe_t2i.enable_model_cpu_offload()
+
+        print("✅ Stable Diffusion XL 載入完成。")
+        return pipe_t2i
+    except Exception as e:
+        print(f"❌ 載入 SDXL 失敗: {e}")
+        flush_memory()
+        return None
+
+
+# --- 5. 圖像生成 (T2I) ---
+
+def read_prompt_file(path):
+    """讀取 Prompt 檔案，內容為空時拋出 ValueError。"""
+    with open(path, 'r', encoding='utf-8') as f:
         prompt_text = f.read().strip()
-    
     if not prompt_text:
-        raise ValueError("Prompt 檔案內容為空。")
+        raise ValueError(f"Prompt 檔案內容為空: {path}")
+    return prompt_text
 
-except FileNotFoundError:
-    print(f"❌ 錯誤: 找不到輸入檔案 {POSITIVE_PROMPT_INPUT_FILE}。請確保它與腳本在同一目錄下。")
-    del pipe_t2i
-    flush_memory()
-    raise SystemExit("找不到 Prompt 檔案，程式終止。")
-except Exception as e:
-    print(f"❌ 讀取 Prompt 檔案失敗: {e}")
+def make_generator(pipe, seed):
+    """
+    依種子建立亂數產生器 (seed 為 None 時回傳 None，由模型自行隨機)。
+    使用 CPU 上的 torch.Generator，同一個種子在 GPU / CPU 上都能得到相同的結果；
+    測試用的替身模型可以自行提供 make_generator(seed) 方法，不必匯入 torch。
+    """
+    if seed is None:
+        return None
+    factory = getattr(pipe, 'make_generator', None)
+    if factory is not None:
+        return factory(seed)
+    import torch
+    return torch.Generator(device="cpu").manual_seed(int(seed))
+
+def prompt_kwargs(pipe, prompts, negatives):
+    """
+    回傳交給模型的 Prompt 參數。真正的 SDXL 模型會使用 prompt_embed_cache 中預先計算的
+    文字向量 (省去兩個文字編碼器與 CPU offload 的搬移)；其他情況直接傳入文字。
+    """
+    from prompt_embed_cache import supports_embeddings, prompt_embedding_kwargs
+
+    if supports_embeddings(pipe):
+        try:
+            return prompt_embedding_kwargs(pipe, prompts, negatives)
+        except Exception as e:
+            print(f"❗ 無法使用 Prompt 向量快取，改為直接編碼: {e}")
+    return {'prompt': prompts, 'negative_prompt': negatives if any(negatives) else None}
+
+def generate_image(pipe, prompt_text, negative_text, output_path,
+                   steps=NUM_INFERENCE_STEPS, guidance=GUIDANCE_SCALE, seed=None):
+    """
+    以已載入的模型生成單張圖片並儲存。
+
+    Args:
+        seed (int, optional): 亂數種子，指定後可重現相同的圖片。
+
+    Returns:
+        str: 輸出路徑，若失敗則回傳 None。
+    """
+    print("--- 正在生成圖像... ---")
+    try:
+        # 生成圖會被下一個階段讀取，先確認編碼設定檔可用，避免白跑一次推論
+        from image_encoding import check_intermediate_profile
+        check_intermediate_profile()
+        with tracing.span('diffusion', images=1, steps=steps) as span:
+            image = pipe(
+                **prompt_kwargs(pipe, [prompt_text], [negative_text]),
+                num_inference_steps=steps,
+                guidance_scale=guidance,
+                generator=make_generator(pipe, seed),
+            ).images[0]
+            span.set(size=list(image.size))
+
+        # 儲存到輸出目錄 (依目前的編碼設定檔，見 image_encoding.py)
+        from image_encoding import save_image
+        output_path = save_image(image, output_path, intermediate=True)
+        print(f"\n✅ 圖像生成成功並儲存到: {output_path}")
+        return output_path
+
+    except Exception as e:
+        print(f"❌ 圖像生成失敗: {e}")
+        return None
+
+def generate_image_from_files(pipe, positive_path, negative_path, output_path,
+                              steps=NUM_INFERENCE_STEPS, guidance=GUIDANCE_SCALE, seed=None):
+    """讀取正負面 Prompt 檔案後生成圖片 (negative 檔案不存在時不使用 Negative Prompt)。"""
+    try:
+        prompt_text = read_prompt_file(positive_path)
+    except FileNotFoundError:
+        print(f"❌ 錯誤: 找不到輸入檔案 {positive_path}。請確保它與腳本在同一目錄下。")
+        return None
+    except Exception as e:
+        print(f"❌ 讀取 Prompt 檔案失敗: {e}")
+        return None
+
+    negative_text = None
+    if negative_path and os.path.exists(negative_path):
+        with open(negative_path, 'r', encoding='utf-8') as f:
+            negative_text = f.read().strip() or None
+
+    print(f"✅ 讀取的 Prompt: '{prompt_text[:50]}...'")
+    return generate_image(pipe, prompt_text, negative_text, output_path, steps, guidance, seed)
+
+
+
+# --- 6. 批次生成 (多個 Prompt 共用 UNet 步驟) ---
+
+def available_memory_mb(device):
+    """目前可用的記憶體 (MB)：GPU 取 CUDA 剩餘顯存，CPU 取系統可用記憶體；無法得知時回傳 None。"""
+    if device == "cuda":
+        import torch
+        free, _ = torch.cuda.mem_get_info()
+        return free / (1024 * 1024)
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def batch_size_for_memory(device, max_batch=MAX_BATCH_SIZE, per_image_mb=MEMORY_PER_IMAGE_MB):
+    """依可用記憶體決定每批的圖片數量 (至少 1 張，最多 max_batch 張)。"""
+    free_mb = available_memory_mb(device)
+    if free_mb is None:
+        return 1
+    return max(1, min(max_batch, int(free_mb // per_image_mb)))
+
+def _pipe_device(pipe):
+    device = getattr(pipe, 'device', None)
+    return getattr(device, 'type', device) or "cpu"
+
+def _save_generated(image, output_path):
+    try:
+        from image_encoding import save_image
+        output_path = save_image(image, output_path, intermediate=True)
+        print(f"✅ 圖像已儲存到: {output_path}")
+        return output_path
+    except Exception as e:
+        print(f"❌ 儲存圖像失敗 ({output_path}): {e}")
+        return None
+
+def _run_batch(pipe, batch, steps, guidance):
+    """以一次模型呼叫生成整批圖片；整批失敗時改為逐張生成，讓失敗只影響單一圖片。"""
+    negatives = [item.get('negative') for item in batch]
+    seeds = [item.get('seed') for item in batch]
+    if any(seed is not None for seed in seeds):
+        # 模型只接受「全部都有」或「全部都沒有」產生器，沒有指定種子的圖片改用新的隨機種子
+        seeds = [random.randrange(2 ** 32) if seed is None else seed for seed in seeds]
+    generators = [make_generator(pipe, seed) for seed in seeds]
+    try:
+        with tracing.span('diffusion', images=len(batch), steps=steps) as span:
+            images = pipe(
+                **prompt_kwargs(pipe, [item['prompt'] for item in batch], negatives),
+                num_inference_steps=steps,
+                guidance_scale=guidance,
+                generator=generators if generators[0] is not None else None,
+            ).images
+            span.set(size=list(images[0].size) if images else None)
+    except Exception as e:
+        if len(batch) == 1:
+            print(f"❌ 圖像生成失敗 ({batch[0]['output_path']}): {e}")
+            return [None]
+        print(f"❗ 批次生成失敗 ({e})，改為逐張生成。")
+        return [_run_batch(pipe, [dict(item, seed=seed)], steps, guidance)[0] for item, seed in zip(batch, seeds)]
+    return [_save_generated(image, item['output_path']) for image, item in zip(images, batch)]
+
+def generate_images(pipe, items, steps=NUM_INFERENCE_STEPS, guidance=GUIDANCE_SCALE, batch_size=None):
+    """
+    批次生成多張圖片：把多個 Prompt 分組後一次交給模型，每張圖片使用自己的種子。
+
+    有 / 沒有 Negative Prompt 的項目會分在不同批次 (SDXL 對「沒有 Negative Prompt」
+    使用全零向量，與空字串不同)，因此每張圖片的結果與單獨生成時使用相同的條件。
+
+    Args:
+        pipe: 已載入的 StableDiffusionXLPipeline。
+        items (list): [{'prompt': str, 'negative': str | None, 'output_path': str, 'seed': int | None}, ...]
+        batch_size (int, optional): 每批圖片數量，預設依可用記憶體決定。
+
+    Returns:
+        list: 與 items 順序相同的輸出路徑，失敗的項目為 None。
+    """
+    from image_encoding import check_intermediate_profile
+    try:
+        check_intermediate_profile()
+    except ValueError as e:
+        print(f"❌ 圖像生成失敗: {e}")
+        return [None] * len(items)
+    if batch_size is None:
+        batch_size = batch_size_for_memory(_pipe_device(pipe))
+    print(f"--- 批次生成 {len(items)} 張圖像 (每批最多 {batch_size} 張) ---")
+
+    results = [None] * len(items)
+    groups = {}
+    for index, item in enumerate(items):
+        groups.setdefault(bool(item.get('negative')), []).append(index)
+
+    for indices in groups.values():
+        for start in range(0, len(indices), batch_size):
+            chunk = indices[start:start + batch_size]
+            outputs = _run_batch(pipe, [items[i] for i in chunk], steps, guidance)
+            for i, output_path in zip(chunk, outputs):
+                results[i] = output_path
+    return results
+
+def read_task_prompts(task):
+    """
+    取得任務的 (positive, negative) Prompt：先查任務資料庫 (task_store.py)，沒有記錄或檔案較新時讀取 prompt/ 底下的檔案。
+    找不到或內容為空時拋出 FileNotFoundError / ValueError。
+    """
+    import task_store
+    store = task_store.default_store(create=False)
+    if store is not None:
+        positive, negative = store.prompts(task)
+        if positive:
+            return positive, negative or None
+
+    positive_path, negative_path, _ = task_prompt_paths(task)
+    prompt_text = read_prompt_file(positive_path)
+    negative_text = None
+    if os.path.exists(negative_path):
+        with open(negative_path, 'r', encoding='utf-8') as f:
+            negative_text = f.read().strip() or None
+    return prompt_text, negative_text
+
+def task_generation_item(task, seed=None):
+    """讀取任務的正負面 Prompt，回傳 generate_images 使用的項目 (讀取失敗時回傳 None)。"""
+    positive_path, _, output_path = task_prompt_paths(task)
+    try:
+        prompt_text, negative_text = read_task_prompts(task)
+    except FileNotFoundError:
+        print(f"❌ 錯誤: 找不到輸入檔案 {positive_path}。")
+        return None
+    except Exception as e:
+        print(f"❌ 讀取 Prompt 檔案失敗: {e}")
+        return None
+    return {'prompt': prompt_text, 'negative': negative_text, 'output_path': output_path, 'seed': seed}
+
+def generate_tasks(pipe, tasks, seeds=None, steps=NUM_INFERENCE_STEPS, guidance=GUIDANCE_SCALE, batch_size=None):
+    """
+    依任務 ID 批次生成 images/generated_images/generated_image_<task>.png。
+
+    Args:
+        tasks (list): 任務 ID 列表。
+        seeds (list, optional): 與 tasks 對應的種子列表。
+
+    Returns:
+        dict: {任務 ID: 輸出路徑或 None}
+    """
+    seeds = list(seeds) if seeds is not None else [None] * len(tasks)
+    items, item_tasks = [], []
+    results = {}
+    for task, seed in zip(tasks, seeds):
+        item = task_generation_item(task, seed)
+        if item is None:
+            results[task] = None
+            continue
+        items.append(item)
+        item_tasks.append(task)
+
+    for task, output_path in zip(item_tasks, generate_images(pipe, items, steps, guidance, batch_size)):
+        results[task] = output_path
+    return results
+
+if __name__ == "__main__":
+    # 用法: python generate_image.py [任務 ID ...] [--profile NAME]；指定多個任務時以批次方式生成
+    import image_encoding
+    tasks = image_encoding.pop_profile_argument(sys.argv[1:])
+    print(f"\n✅ 期望的 SDXL 模型路徑: {SDXL_MODEL_PATH}")
+    print(f"✅ 圖像輸出檔案: {', '.join(task_prompt_paths(t)[2] for t in tasks) if tasks else IMAGE_OUTPUT_FILENAME}\n")
+
+    pipe_t2i = load_pipeline(SDXL_MODEL_PATH)
+    if pipe_t2i is None:
+        # 終止程式
+        raise SystemExit("SDXL 模型載入失敗，程式終止。")
+
+    print("\n=================================================")
+    print("          🖼️ 圖像生成 (T2I) 開始")
+    print("=================================================")
+
+    if tasks:
+        results = generate_tasks(pipe_t2i, tasks)
+        print(f"\n✅ 批次生成完成：成功 {sum(1 for r in results.values() if r)} / {len(tasks)} 張")
+    else:
+        generate_image_from_files(pipe_t2i, POSITIVE_PROMPT_INPUT_FILE,
+                                  NEGATIVE_PROMPT_INPUT_FILE, IMAGE_OUTPUT_FILENAME)
+
+    # 清理 SDXL 模型以釋放 VRAM
+    print("\n--- 正在釋放 SDXL 模型記憶體 ---")
     del pipe_t2i
     flush_memory()
-    raise SystemExit("Prompt 檔案讀取失敗，程式終止。")
-
-print(f"✅ 讀取的 Prompt: '{prompt_text[:50]}...'")
-
-# 執行圖像生成 (SDXL)
-print("--- 正在生成圖像... ---")
-try:
-    image = pipe_t2i(
-        prompt=prompt_text,
-        negative_prompt=NEGATIVE_PROMPT_INPUT_FILE,
-        num_inference_steps=25,
-        guidance_scale=7.5
-    ).images[0]
-
-    # 儲存到輸出目錄
-    output_path = IMAGE_OUTPUT_FILENAME
-    image.save(output_path)
-    print(f"\n✅ 圖像生成成功並儲存到: {output_path}")
-
-except Exception as e:
-    print(f"❌ 圖像生成失敗: {e}")
-
-# 清理 SDXL 模型以釋放 VRAM
-print("\n--- 正在釋放 SDXL 模型記憶體 ---")
-del pipe_t2i
-flush_memory()
-
-print("\n=================================================")
-print("          🎉 圖像生成腳本執行完畢 🎉")
-print("=================================================")
\ No newline at end of file
+    image_encoding.print_report()
+
+    print("\n=================================================")
+    print("          🎉 圖像生成腳本執行完畢 🎉")
+    print("=================================================")
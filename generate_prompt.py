@@ -1,9 +1,12 @@
-import google.genai as genai
 import json 
 import os      
 import gc      
 from datetime import datetime 
-from google.genai.errors import APIError
+
+from tracing import traced
+
+# google.genai 只在真正呼叫 Gemini 時才匯入 (見 initialize_gemini_client / generate_sdxl_prompts)，
+# 讓其他腳本可以讀取本檔的設定值 (例如 MODEL_NAME) 而不必安裝或載入 SDK。
 
 # ----------------------------------------------------
 # 設定區塊：請確保這些資訊正確
@@ -15,6 +18,9 @@ MODEL_NAME = 'gemini-2.5-flash'
 # SDXL Prompt 限制
 MAX_WORDS_PER_PROMPT = 77  
 
+# 生成溫度
+TEMPERATURE = 0.8
+
 # 範例輸入：使用者完成的任務代辦事項
 TASK = "寫演算法程式作業"
 
@@ -52,6 +58,8 @@ def initialize_gemini_client():
         return False
     
     try:
+        import google.genai as genai
+
         # 使用 os.getenv 取得的金鑰字串來初始化客戶端
         client = genai.Client(api_key=api_key)
         print("✅ Gemini API 客戶端初始化成功。")
@@ -84,14 +92,11 @@ def flush_memory():
 # 函數：使用 Gemini 服務生成 SDXL 專用的正負面 Prompt
 # ----------------------------------------------------
 
-def generate_sdxl_prompts(task_description: str):
+def build_prompt_request(task_description: str):
     """
-    連線到 Gemini 服務，生成 SDXL T2I 模型的正負面 Prompt。
+    組合送給 Gemini 的完整請求文字 (系統提示 + 用戶請求)。
+    同步版本 (generate_sdxl_prompts) 與批次版本 (prompt_batch.py) 共用這段文字。
     """
-    global client
-    if not client:
-        return {"Error": "Gemini API 客戶端未初始化。", "Note": "請先設定環境變數 GEMINI_API_KEY。"}
-
     # Meta-Prompt (系統提示)：與原來的嚴格限制一致
     system_prompt = (
         f"You are a master SDXL prompt engineer, specializing in creating **highly effective 2D design and illustration prompts**. "
@@ -121,16 +126,59 @@ def generate_sdxl_prompts(task_description: str):
         f"**REMINDER: ALL OUTPUT MUST BE IN ENGLISH AND IN JSON FORMAT.**" 
     )
 
+    return system_prompt + user_request
+
+
+def prompt_cache_key(task_description: str, model=MODEL_NAME, temperature=TEMPERATURE):
+    """(模型名稱, 溫度, 範本雜湊, 正規化後的任務描述) 對應的快取鍵。"""
+    from prompt_cache import cache_key, template_hash
+    return cache_key(model, temperature, template_hash(), task_description)
+
+
+@traced('prompt')
+def generate_sdxl_prompts(task_description: str, refresh: bool = False):
+    """
+    連線到 Gemini 服務，生成 SDXL T2I 模型的正負面 Prompt。
+
+    相同 (模型, 溫度, 範本, 正規化描述) 的結果會從 prompt_cache.py 的 SQLite 快取直接取得，
+    不需要 API 客戶端；refresh=True 時略過快取重新生成，並以新結果覆寫快取。
+    """
+    import prompt_cache
+
+    key = None
+    if prompt_cache.ENABLED:
+        key = prompt_cache_key(task_description)
+        cached = None if refresh else prompt_cache.default_cache().get(key)
+        if cached is not None:
+            print("✅ 使用快取的 Prompt (略過 Gemini 請求)。")
+            return cached
+
+    prompts = _request_sdxl_prompts(task_description)
+    if key is not None and "Error" not in prompts:
+        prompt_cache.default_cache().put(key, prompts, MODEL_NAME, TEMPERATURE, task_description)
+    return prompts
+
+
+@traced('prompt_request')
+def _request_sdxl_prompts(task_description: str):
+    """實際呼叫 Gemini 的部分 (不經過快取)；客戶端在第一次需要時才初始化。"""
+    global client
+    if not client and not initialize_gemini_client():
+        return {"Error": "Gemini API 客戶端未初始化。", "Note": "請先設定環境變數 GEMINI_API_KEY。"}
+
+    import google.genai as genai
+    from google.genai.errors import APIError
+
     print(f"--- 嘗試使用 Gemini 模型 {MODEL_NAME} 生成 SDXL Prompt ---")
 
     try:
         response = client.models.generate_content(
             model=MODEL_NAME,  
             contents=[
-                {'role': 'user', 'parts': [{'text': system_prompt + user_request}]}
+                {'role': 'user', 'parts': [{'text': build_prompt_request(task_description)}]}
             ],
             config=genai.types.GenerateContentConfig(
-                temperature=0.8,
+                temperature=TEMPERATURE,
                 response_mime_type="application/json" 
             )
         )
@@ -166,24 +214,36 @@ def save_prompts_to_files(prompts: dict, short_name: str):
     pos_prompt = prompts.get('Positive_Prompt', '')
     neg_prompt = prompts.get('Negative_Prompt', '')
 
-    pos_filename = os.path.join(pos_dir, f"positive_{short_name}.txt")
-    neg_filename = os.path.join(neg_dir, f"negative_{short_name}.txt")
-
-    print(f"\n--- 儲存 Prompt 至檔案 ---")
-
-    try:
-        with open(pos_filename, 'w', encoding='utf-8') as f:
-            f.write(pos_prompt)
-        print(f"✅ Positive Prompt 已儲存至: {pos_filename}")
-
-        with open(neg_filename, 'w', encoding='utf-8') as f:
-            f.write(neg_prompt)
-        print(f"✅ Negative Prompt 已儲存至: {neg_filename}")
-
-        return True
-    except Exception as e:
-        print(f"❌ 儲存檔案失敗: {e}")
-        return False
+    # 同時寫入任務資料庫 (task_store.py)；MIRROR_FILES=False 時不再寫出 .txt 檔案。
+    # 先寫檔案再寫資料庫：資料庫記錄的更新時間不早於檔案，讀取時才不會被判定為過期 (見 TaskStore.prompts)
+    import task_store
+    store = task_store.default_store()
+    if store is None or task_store.MIRROR_FILES:
+        pos_filename = os.path.join(pos_dir, f"positive_{short_name}.txt")
+        neg_filename = os.path.join(neg_dir, f"negative_{short_name}.txt")
+
+        print(f"\n--- 儲存 Prompt 至檔案 ---")
+
+        try:
+            with open(pos_filename, 'w', encoding='utf-8') as f:
+                f.write(pos_prompt)
+            print(f"✅ Positive Prompt 已儲存至: {pos_filename}")
+
+            with open(neg_filename, 'w', encoding='utf-8') as f:
+                f.write(neg_prompt)
+            print(f"✅ Negative Prompt 已儲存至: {neg_filename}")
+        except Exception as e:
+            print(f"❌ 儲存檔案失敗: {e}")
+            return False
+
+    if store is not None:
+        try:
+            store.put(short_name, positive=pos_prompt, negative=neg_prompt)
+            print(f"✅ Prompt 已寫入任務資料庫: {short_name}")
+        except Exception as e:
+            print(f"❌ 寫入任務資料庫失敗: {e}")
+            return False
+    return True
 
 
 # ----------------------------------------------------
@@ -191,10 +251,7 @@ def save_prompts_to_files(prompts: dict, short_name: str):
 # ----------------------------------------------------
 if __name__ == "__main__":
 
-    # 1. 初始化客戶端：檢查環境變數是程式的第一步
-    if not initialize_gemini_client():
-        # 如果初始化失敗（即金鑰未設定），則程式停止執行
-        exit() 
+    # 1. 客戶端在快取未命中時才初始化 (見 _request_sdxl_prompts)，命中快取時不需要 API 金鑰
 
     # 2. 生成 TASK_SHORTNAME (純時間戳記)
     TASK_SHORTNAME = generate_timestamp_name(TASK)
@@ -1,6 +1,11 @@
-from PIL import Image, ImageOps, ImageEnhance
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import os
 
+from image_encoding import save_image, load_image, add_profile_argument, set_default_profile, print_report
+from tracing import traced
+
 # --- 範例使用 ---
 TASK = "task_20251213_045454"
 
@@ -8,6 +13,74 @@ INPUT_IMAGE = f'images\donut\donut_{TASK}.png'
 OUTPUT_IMAGE = f'images\donut_gray\donut_gray_{TASK}.png'
 CONTRAST_REDUCTION = 0.5    # 0.5 = 減少 50% 對比度
 
+MAX_WORKERS = 4             # 批次處理時同時處理的圖片數量
+
+def contrast_lut(mean, contrast_factor):
+    """
+    對比度調整的查找表：與 ImageEnhance.Contrast 相同，以 float32 計算
+    mean + factor * (value - mean)，並截斷到 [0, 255]。
+    """
+    values = np.arange(256, dtype=np.float32)
+    mean = np.float32(mean)
+    blended = mean + np.float32(contrast_factor) * (values - mean)
+    return np.clip(np.trunc(blended), 0, 255).astype(np.uint8).tolist()
+
+def mean_luma(gray, alpha=None):
+    """
+    對比度的中心值 (四捨五入為整數)。未傳入 alpha 時與 ImageEnhance.Contrast 相同，
+    為所有像素亮度的平均值；傳入 alpha 時以 Alpha 加權，透明區域不影響結果。
+    """
+    if alpha is not None:
+        luma = np.asarray(gray, dtype=np.int64).ravel()
+        weight = np.asarray(alpha, dtype=np.int64).ravel()
+        total = int(weight.sum())
+        if total:
+            return int(int(np.dot(luma, weight)) / total + 0.5)
+    histogram = gray.histogram()
+    return int(sum(value * count for value, count in enumerate(histogram)) / sum(histogram) + 0.5)
+
+@traced('gray')
+def to_gray_low_contrast(img, contrast_factor=0.5, alpha_weighted=False):
+    """
+    在記憶體中將圖片轉換為灰度圖並減少對比度，保留 Alpha (透明度) 通道。
+
+    亮度 (convert('L'))、平均值 (直方圖) 與對比度 (256 項查找表) 各只掃描一次，
+    最後直接以同一張灰度圖組成 RGBA，不再經過 RGB 合併、Contrast 的混合底圖與 colorize。
+    結果與原本的作法逐像素相同。
+
+    Args:
+        img (PIL.Image.Image): 輸入圖片。
+        contrast_factor (float): 對比度調整係數。1.0 為不變，0.5 為減少 50% 對比度。
+        alpha_weighted (bool): 對比度中心值是否以 Alpha 加權 (預設否，與原本結果相同)。
+
+    Returns:
+        PIL.Image.Image: 灰度、低對比度的 RGBA 圖片。
+    """
+    print(f"    正在減少 {((1 - contrast_factor) * 100):.0f}% 對比度...")
+    img = img.convert("RGBA")
+    alpha = img.getchannel('A')
+
+    # 1. 亮度 (與 RGB -> 'L' 相同的 ITU-R 601-2 係數)
+    gray = img.convert('L')
+
+    # 2. 以平均亮度為中心調整對比度
+    mean = mean_luma(gray, alpha if alpha_weighted else None)
+    gray = gray.point(contrast_lut(mean, contrast_factor))
+
+    # 3. R = G = B = 灰度，Alpha 沿用原圖
+    return Image.merge('RGBA', (gray, gray, gray, alpha))
+
+def to_gray_low_contrast_batch(images, contrast_factor=0.5, alpha_weighted=False, workers=MAX_WORKERS):
+    """
+    以執行緒池一次處理多張圖片 (Pillow 的像素運算會釋放 GIL)。
+
+    Returns:
+        list: 與輸入順序相同的 RGBA 圖片列表。
+    """
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return list(executor.map(
+            lambda img: to_gray_low_contrast(img, contrast_factor, alpha_weighted), images))
+
 def convert_and_reduce_contrast(input_path, output_path, contrast_factor=0.5):
     """
     讀取圖片，將其轉換為灰度圖 (飽和度 0%)，減少對比度，並保留 Alpha (透明度) 通道。
@@ -35,39 +108,59 @@ def convert_and_reduce_contrast(input_path, output_path, contrast_factor=0.5):
 
     try:
         # 1. 開啟圖片並確保它有 Alpha 通道 (轉換為 RGBA)
-        img = Image.open(input_path).convert("RGBA")
-        
-        # 2. 分離 RGBA 通道
-        R, G, B, A = img.split()
-        
-        # 3. 對 RGB 部分進行灰度轉換 ('L' 模式)
-        rgb_img = Image.merge("RGB", (R, G, B))
-        grayscale_img_L = rgb_img.convert('L') 
-        
-        # --- 新增步驟：對比度調整 ---
-        print(f"    正在減少 {((1 - contrast_factor) * 100):.0f}% 對比度...")
-        
-        # 4. 使用 ImageEnhance 調整對比度
-        enhancer = ImageEnhance.Contrast(grayscale_img_L)
-        adjusted_img_L = enhancer.enhance(contrast_factor) 
-        
-        # 5. 準備合併：將 L 模式的灰度圖轉換為 RGB (即 R=G=B)
-        final_grayscale_rgb = ImageOps.colorize(
-            adjusted_img_L, 
-            black="black", 
-            white="white"
-        ).convert("RGB")
+        img = load_image(input_path, "RGBA")
         
-        # 6. 合併對比度調整後的灰度 RGB 和原始 Alpha 通道 (A)
-        final_img = Image.merge('RGBA', final_grayscale_rgb.split()[:3] + (A,))
+        final_img = to_gray_low_contrast(img, contrast_factor)
         
         # 7. 儲存結果
-        final_img.save(output_path, 'PNG')
+        output_path = save_image(final_img, output_path, intermediate=True)
         
         print(f"✅ 圖片已成功轉換為灰度、對比度已調整並保留透明背景，儲存至: {output_path}")
 
     except Exception as e:
         print(f"❌ 處理圖片時發生錯誤: {e}")
 
-print("--- 圖片處理開始：灰度 + 對比度減少 50% ---")
-convert_and_reduce_contrast(INPUT_IMAGE, OUTPUT_IMAGE, CONTRAST_REDUCTION)
\ No newline at end of file
+def convert_and_reduce_contrast_batch(jobs, contrast_factor=0.5, alpha_weighted=False, workers=MAX_WORKERS):
+    """
+    批次版的 convert_and_reduce_contrast。
+
+    Args:
+        jobs (list): [(輸入路徑, 輸出路徑), ...]。
+        contrast_factor (float): 對比度調整係數。
+
+    Returns:
+        list: 成功寫出的輸出路徑 (失敗的項目為 None)。
+    """
+    images, loaded = [], []
+    for k, (input_path, _) in enumerate(jobs):
+        try:
+            images.append(load_image(input_path, "RGBA"))
+            loaded.append(k)
+        except Exception as e:
+            print(f"❌ 無法讀取 '{input_path}': {e}")
+
+    results = [None] * len(jobs)
+    for k, final_img in zip(loaded, to_gray_low_contrast_batch(images, contrast_factor, alpha_weighted, workers)):
+        output_path = jobs[k][1]
+        try:
+            results[k] = save_image(final_img, output_path, intermediate=True)
+        except Exception as e:
+            print(f"❌ 儲存 '{output_path}' 時發生錯誤: {e}")
+
+    print(f"✅ 批次灰度轉換完成：成功 {sum(1 for r in results if r)} / {len(jobs)} 張")
+    return results
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="灰度 + 對比度減少")
+    parser.add_argument('input', nargs='?', default=INPUT_IMAGE, help="輸入圖片路徑")
+    parser.add_argument('output', nargs='?', default=OUTPUT_IMAGE, help="輸出圖片路徑")
+    parser.add_argument('--contrast', type=float, default=CONTRAST_REDUCTION, help="對比度係數 (預設 0.5)")
+    add_profile_argument(parser)
+    args = parser.parse_args()
+    if args.profile:
+        set_default_profile(args.profile)
+
+    print(f"--- 圖片處理開始：灰度 + 對比度減少 {(1 - args.contrast) * 100:.0f}% ---")
+    convert_and_reduce_contrast(args.input, args.output, args.contrast)
+    print_report()
@@ -0,0 +1,274 @@
+from PIL import Image
+import numpy as np
+import argparse
+import io
+import os
+import sys
+import threading
+import time
+
+import tracing
+
+# --- 全域配置 ---
+# 各階段輸出圖片時使用的編碼設定檔。預設 'default' 與原本的 img.save(path, 'PNG') 完全相同；
+# 可以用環境變數 DONUT_IMAGE_PROFILE 或各腳本的 --profile 參數切換。
+DEFAULT_PROFILE = os.environ.get('DONUT_IMAGE_PROFILE', 'default')
+VERBOSE = False        # True 時每次儲存都印出編碼時間與檔案大小
+
+# format: Pillow 格式名稱；options: 傳給 Image.save 的參數
+# clear_transparent: 完全透明像素的 RGB 清為 0 (這張圖的畫面不變，PNG 可以壓得更小)。
+#   只適用於最終輸出：cut_filled_sector / cut_missing_sector (putalpha)、composite_label_map 與 FillAnimator
+#   會把圓環像素重新設為不透明，被清掉的顏色會變成黑點，因此中間檔 (donut、donut_gray 等) 不能使用
+# quantize: 轉為幾色的 P 模式 (含透明度) 再儲存
+PROFILES = {
+    'default': {
+        'format': 'PNG', 'options': {},
+        'description': "Pillow 預設 (zlib 等級 6)，與先前的輸出逐位元組相同",
+    },
+    'fast-intermediate': {
+        'format': 'PNG', 'options': {'compress_level': 1},
+        'description': "低 zlib 等級，給下一個階段馬上要讀取的中間檔 (像素完全保留)",
+    },
+    'archival': {
+        'format': 'PNG', 'options': {'optimize': True},
+        'description': "保留全部像素資料，以最慢的 zlib 設定換取最小的無損 PNG",
+    },
+    'compact': {
+        'format': 'PNG', 'options': {}, 'clear_transparent': True,
+        'description': "zlib 等級與 default 相同，但先清除完全透明像素的顏色，檔案小很多 (只用於最終輸出)",
+    },
+    'web': {
+        'format': 'WEBP', 'options': {'lossless': True, 'quality': 80, 'method': 4},
+        'description': "無損 WebP (透明像素的顏色不保留)",
+    },
+    'web-lossy': {
+        'format': 'WEBP', 'options': {'quality': 85, 'method': 4},
+        'description': "有損 WebP (quality 85)，給網頁顯示用的最小檔案",
+    },
+    'palette': {
+        'format': 'PNG', 'options': {}, 'quantize': 256, 'clear_transparent': True,
+        'description': "量化為 256 色 P 模式 (含透明度) 的 PNG，顏色會有些微誤差 (只用於最終輸出)",
+    },
+}
+
+EXTENSIONS = {'PNG': '.png', 'WEBP': '.webp'}
+
+# --- 1. 設定檔 ---
+
+def get_profile(name=None):
+    """依名稱取得設定檔 (None 為目前的預設)，名稱不存在時拋出 ValueError。"""
+    name = name or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"未知的編碼設定檔 '{name}' (可用: {', '.join(PROFILES)})")
+    return PROFILES[name]
+
+def set_default_profile(name):
+    """切換之後所有 save_image 預設使用的設定檔。"""
+    global DEFAULT_PROFILE
+    get_profile(name)
+    DEFAULT_PROFILE = name
+
+def png_compress_level(name=None, default=6):
+    """只支援 zlib 等級的串流寫入器 (tiled_render.py) 使用：回傳設定檔對應的 PNG 壓縮等級。"""
+    profile = get_profile(name)
+    if profile['format'] != 'PNG' or profile.get('quantize'):
+        raise ValueError(f"設定檔 '{name or DEFAULT_PROFILE}' 不是 RGBA PNG，無法用於串流寫入")
+    return 9 if profile['options'].get('optimize') else profile['options'].get('compress_level', default)
+
+def check_intermediate_profile(name=None):
+    """
+    中間檔 (會被下一個階段以原本的 .png 路徑讀回) 只能用無損、保留全部像素的 PNG 設定檔。
+    WebP 會改寫成 .webp 讓下一個階段讀不到；compact / palette 會改變像素。不符合時拋出 ValueError。
+    """
+    profile = get_profile(name)
+    if profile['format'] != 'PNG' or profile.get('clear_transparent') or profile.get('quantize'):
+        raise ValueError(f"設定檔 '{name or DEFAULT_PROFILE}' 只能用於最終輸出，"
+                         f"中間檔請改用 default、fast-intermediate 或 archival")
+    return profile
+
+def add_profile_argument(parser):
+    """在 argparse 解析器加上 --profile 參數。"""
+    parser.add_argument('--profile', choices=sorted(PROFILES), default=None,
+                        help=f"圖片編碼設定檔 (預設 {DEFAULT_PROFILE}，見 image_encoding.py)")
+    return parser
+
+def pop_profile_argument(argv):
+    """
+    給以 sys.argv 手動解析參數的腳本使用：取出 --profile NAME 並設為預設設定檔，回傳剩下的參數。
+    """
+    argv = list(argv)
+    if '--profile' in argv:
+        i = argv.index('--profile')
+        if i + 1 >= len(argv):
+            raise SystemExit(f"❌ --profile 需要設定檔名稱 (可用: {', '.join(PROFILES)})")
+        set_default_profile(argv[i + 1])
+        del argv[i:i + 2]
+    return argv
+
+# --- 2. 編碼 ---
+
+def _clear_transparent(img):
+    """完全透明像素的 RGB 清為 0 (只有 RGBA 需要處理)。"""
+    if img.mode != 'RGBA':
+        return img
+    pixels = np.array(img)
+    transparent = pixels[..., 3] == 0
+    if not transparent.any():
+        return img
+    pixels[transparent] = 0
+    return Image.fromarray(pixels)
+
+def prepare_image(img, profile):
+    """依設定檔先轉換像素 (清除透明像素顏色、量化)，回傳要交給編碼器的 Image。"""
+    if profile.get('clear_transparent'):
+        img = _clear_transparent(img)
+    colors = profile.get('quantize')
+    if colors:
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() or 'transparency' in img.info else 'RGB')
+        img = img.quantize(colors, method=Image.Quantize.FASTOCTREE)
+    return img
+
+def encode_image(img, profile_name=None):
+    """
+    以設定檔編碼成 bytes。
+
+    Returns:
+        tuple: (資料, 編碼秒數)。
+    """
+    profile = get_profile(profile_name)
+    t0 = time.perf_counter()
+    buffer = io.BytesIO()
+    prepare_image(img, profile).save(buffer, profile['format'], **profile['options'])
+    return buffer.getvalue(), time.perf_counter() - t0
+
+def output_path_for(path, profile_name=None):
+    """設定檔的格式與副檔名不符時 (例如 web 設定檔寫到 .png)，改用該格式的副檔名。"""
+    profile = get_profile(profile_name)
+    root, ext = os.path.splitext(path)
+    expected = EXTENSIONS[profile['format']]
+    if ext.lower() in ('.png', '.webp') and ext.lower() != expected:
+        return root + expected
+    return path
+
+# --- 3. 統計 ---
+
+_stats = {}
+_lock = threading.Lock()
+
+def _record(profile_name, seconds, size):
+    with _lock:
+        entry = _stats.setdefault(profile_name, {'files': 0, 'seconds': 0.0, 'bytes': 0})
+        entry['files'] += 1
+        entry['seconds'] += seconds
+        entry['bytes'] += size
+
+def stats():
+    """各設定檔到目前為止的儲存次數、編碼總秒數與總位元組數。"""
+    with _lock:
+        return {name: dict(entry) for name, entry in _stats.items()}
+
+def print_report():
+    """印出本次執行各設定檔的編碼時間與檔案大小 (沒有儲存過圖片則不印)。"""
+    for name, entry in stats().items():
+        print(f"🖼️ 編碼設定檔 {name}: {entry['files']} 個檔案，"
+              f"{entry['seconds'] * 1000:.0f} ms，{entry['bytes'] / 1024:.0f} KB")
+
+# --- 4. 儲存與讀取 ---
+
+def save_image(img, output_path, profile=None, intermediate=False):
+    """
+    以設定檔編碼並寫出圖片 (先寫暫存檔再 os.replace，中斷時不會留下半個檔案)。
+
+    Args:
+        img (PIL.Image.Image): 要儲存的圖片。
+        output_path (str): 輸出路徑；web 設定檔會把 .png 換成 .webp。
+        profile (str, optional): 設定檔名稱，預設為 DEFAULT_PROFILE。
+        intermediate (bool): 輸出會被下一個階段讀取時為 True；設定檔不適用時拋出 ValueError，不寫出檔案。
+
+    Returns:
+        str: 實際寫出的路徑。
+    """
+    name = profile or DEFAULT_PROFILE
+    if intermediate:
+        check_intermediate_profile(name)
+    with tracing.span('encode', profile=name, size=list(img.size)) as span:
+        data, seconds = encode_image(img, name)
+        actual_path = output_path_for(output_path, name)
+        if actual_path != output_path:
+            print(f"❗ 設定檔 {name} 輸出為 {get_profile(name)['format']}，改存為 {actual_path} "
+                  f"(最終輸出)")
+
+        output_dir = os.path.dirname(actual_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        tmp_path = f"{actual_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, actual_path)
+        span.set(path=actual_path, bytes_written=len(data))
+
+    _record(name, seconds, len(data))
+    if VERBOSE:
+        print(f"  🖼️ {name}: {seconds * 1000:.0f} ms，{len(data) / 1024:.0f} KB → {actual_path}")
+    return actual_path
+
+def load_image(path, mode=None):
+    """
+    開啟並立即解碼圖片 (Image.open 只讀標頭，解碼會延後到第一次存取像素)，
+    讓解碼時間記錄在 decode 區段而不是下一個階段。
+
+    Args:
+        path (str): 圖片路徑。
+        mode (str, optional): 要轉換的模式 (例如 'RGBA')，與原本的 Image.open(path).convert(mode) 相同。
+
+    Returns:
+        PIL.Image.Image: 已載入像素的圖片。
+    """
+    with tracing.span('decode', path=str(path)) as span:
+        img = Image.open(path)
+        img.load()
+        span.set(size=list(img.size), format=img.format, bytes_read=os.path.getsize(path))
+    return img.convert(mode) if mode else img
+
+# --- 5. 比較各設定檔 ---
+
+def compare_profiles(paths, profiles=None):
+    """以每個設定檔重新編碼既有圖片 (不寫檔)，印出並回傳編碼時間與大小。"""
+    profiles = profiles or list(PROFILES)
+    results = {}
+    for path in paths:
+        try:
+            with Image.open(path) as img:
+                img.load()
+                source = img.copy()
+        except Exception as e:
+            print(f"❌ 無法讀取 {path}: {e}")
+            continue
+        print(f"\n{path} ({source.mode} {source.size[0]}x{source.size[1]}，原始 {os.path.getsize(path) / 1024:.0f} KB)")
+        for name in profiles:
+            data, seconds = encode_image(source, name)
+            results[(path, name)] = (seconds, len(data))
+            print(f"  {name:<18} {seconds * 1000:>8.0f} ms  {len(data) / 1024:>8.0f} KB")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="比較各編碼設定檔對既有圖片的編碼時間與檔案大小")
+    parser.add_argument('paths', nargs='*', help="圖片路徑 (預設 images/ 底下每個資料夾各取一張)")
+    parser.add_argument('--profiles', nargs='+', choices=sorted(PROFILES), help="只比較指定的設定檔")
+    parser.add_argument('--list', action='store_true', help="列出所有設定檔")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, profile in PROFILES.items():
+            print(f"{name:<18} {profile['format']:<5} {profile['description']}")
+        sys.exit(0)
+
+    paths = args.paths
+    if not paths:
+        for entry in sorted(os.scandir('images'), key=lambda e: e.name) if os.path.isdir('images') else []:
+            if entry.is_dir():
+                pngs = sorted(f for f in os.listdir(entry.path) if f.lower().endswith('.png'))
+                if pngs:
+                    paths.append(os.path.join(entry.path, pngs[0]))
+    compare_profiles(paths, args.profiles)
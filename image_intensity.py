@@ -0,0 +1,166 @@
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+
+from image_encoding import save_image, load_image, add_profile_argument, set_default_profile, print_report
+from tracing import traced
+
+# --- 全域配置 ---
+MAX_WORKERS = 4                         # 批次處理時同時處理的圖片數量
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+NO_ALPHA_EXTENSIONS = ('.jpg', '.jpeg', '.bmp')   # 這些格式不能儲存 Alpha 通道
+
+# --- 1. 強度查找表 ---
+
+_lut_memo = {}
+
+def intensity_lut(intensity_factor):
+    """
+    預先計算 V 通道 0 ~ 255 每個值調整後的結果 (與原本逐像素 int(value * factor)
+    再限制在 [0, 255] 的算法完全相同)，同一個因子只計算一次。
+
+    Returns:
+        list: 長度 256 的查找表，可直接交給 Image.point 使用。
+    """
+    lut = _lut_memo.get(intensity_factor)
+    if lut is None:
+        lut = [min(255, max(0, int(value * intensity_factor))) for value in range(256)]
+        _lut_memo[intensity_factor] = lut
+    return lut
+
+@traced('intensity')
+def adjust_intensity(img, intensity_factor):
+    """
+    在記憶體中調整圖片的強度 (HSV 的 V 通道)，保留原本的 Alpha 通道。
+
+    Args:
+        img (PIL.Image.Image): 輸入圖片。
+        intensity_factor (float): 強度調整因子。
+                                  > 1.0 會增加強度/亮度 (例如 1.5 會增加 50%)。
+                                  < 1.0 會降低強度/亮度 (例如 0.5 會減少 50%)。
+
+    Returns:
+        PIL.Image.Image: 調整後的圖片 (有 Alpha 時為 RGBA，否則為 RGB)。
+    """
+    alpha = None
+    if img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info):
+        img = img.convert("RGBA")
+        alpha = img.getchannel('A')
+
+    h, s, v = img.convert("RGB").convert("HSV").split()
+    v = v.point(intensity_lut(intensity_factor))
+    adjusted = Image.merge("HSV", (h, s, v)).convert("RGB")
+
+    if alpha is not None:
+        adjusted.putalpha(alpha)
+    return adjusted
+
+# --- 2. 檔案處理 ---
+
+def adjust_image_intensity(input_path, output_path, intensity_factor):
+    """
+    將圖片轉換為 HSV 模型，調整 V 通道（強度/亮度），然後再轉回 RGB 儲存。
+    輸入有透明度且輸出格式支援時 (例如 .png) 會保留 Alpha 通道。
+
+    Args:
+        input_path (str): 輸入圖片的路徑。
+        output_path (str): 輸出圖片的路徑 (.png 或 .jpg)。
+        intensity_factor (float): 強度調整因子。
+
+    Returns:
+        str: 輸出路徑，若失敗則回傳 None。
+    """
+    try:
+        img = load_image(input_path)
+        adjusted = adjust_intensity(img, intensity_factor)
+    except FileNotFoundError:
+        print(f"錯誤：找不到圖片文件 - {input_path}")
+        return None
+    except Exception as e:
+        print(f"❌ 調整圖片強度失敗 ({input_path}): {e}")
+        return None
+
+    if adjusted.mode == 'RGBA' and output_path.lower().endswith(NO_ALPHA_EXTENSIONS):
+        adjusted = adjusted.convert("RGB")
+
+    try:
+        if output_path.lower().endswith('.png'):
+            # PNG 依目前的編碼設定檔儲存 (見 image_encoding.py)，其他格式交給 Pillow 依副檔名決定
+            output_path = save_image(adjusted, output_path)
+        else:
+            output_dir = os.path.dirname(output_path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            adjusted.save(output_path)
+    except Exception as e:
+        print(f"❌ 儲存圖片失敗 ({output_path}): {e}")
+        return None
+
+    print(f"圖片強度已調整 (因子: {intensity_factor})，並儲存到：{output_path}")
+    return output_path
+
+def collect_inputs(inputs):
+    """
+    將檔案路徑與資料夾混合的列表展開成圖片路徑列表 (資料夾只取第一層的圖片檔)。
+    """
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for name in sorted(os.listdir(item)):
+                path = os.path.join(item, name)
+                if os.path.isfile(path) and name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(path)
+        else:
+            paths.append(item)
+    return paths
+
+def adjust_batch(inputs, output_dir, intensity_factor, workers=MAX_WORKERS, suffix=None):
+    """
+    以執行緒池批次調整多張圖片的強度 (Pillow 的像素運算會釋放 GIL，可以真正平行處理)。
+
+    Args:
+        inputs (list | str): 圖片路徑或資料夾 (可混合)。
+        output_dir (str): 輸出資料夾，檔名與輸入相同 (可加上 suffix)。
+        intensity_factor (float): 強度調整因子。
+        workers (int): 同時處理的圖片數量。
+        suffix (str, optional): 加在輸出檔名 (副檔名前) 的字串，例如 "_bright"。
+
+    Returns:
+        list: 與輸入順序相同的輸出路徑列表，失敗的項目為 None。
+    """
+    paths = collect_inputs(inputs)
+    if not paths:
+        print("❗ 沒有找到任何要處理的圖片。")
+        return []
+
+    def output_path_for(path):
+        stem, ext = os.path.splitext(os.path.basename(path))
+        return os.path.join(output_dir, f"{stem}{suffix or ''}{ext}")
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        results = list(executor.map(
+            lambda path: adjust_image_intensity(path, output_path_for(path), intensity_factor), paths))
+
+    done = sum(1 for result in results if result)
+    print(f"✅ 批次處理完成：成功 {done} / {len(paths)} 張")
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="批次調整圖片強度 (HSV 的 V 通道)。")
+    parser.add_argument('inputs', nargs='+', help="圖片路徑或資料夾")
+    parser.add_argument('-f', '--factor', type=float, required=True, help="強度調整因子，例如 1.5 或 0.7")
+    parser.add_argument('-o', '--output-dir', required=True, help="輸出資料夾")
+    parser.add_argument('--suffix', default=None, help="輸出檔名後綴，例如 _bright")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help="同時處理的圖片數量")
+    add_profile_argument(parser)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.profile:
+        set_default_profile(args.profile)
+    adjust_batch(args.inputs, args.output_dir, args.factor, args.workers, args.suffix)
+    print_report()
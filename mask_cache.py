@@ -0,0 +1,143 @@
+from PIL import Image, ImageDraw
+from collections import OrderedDict
+import threading
+
+from mask_engine import annulus_mask, annular_sector_mask, to_mask_image
+
+# --- 全域配置 ---
+MAX_ENTRIES = 64      # LRU 最多保留的遮罩數量 (1024x1024 'L' 遮罩約 1 MB)
+ANGLE_STEP = 0.1      # 角度量化步長 (度)，設為 0 則不量化
+ANTIALIAS = False     # 是否使用解析式抗鋸齒遮罩 (邊緣為半透明)
+
+# --- 1. 遮罩繪製 ---
+# 二值遮罩以 ImageDraw 繪製 (比 NumPy 快)；只有抗鋸齒遮罩交給 mask_engine.py 的解析式計算。
+
+def draw_donut_mask(width, height, R, inner_ratio, antialias=False):
+    """繪製完整的圓環遮罩 ('L' 模式)：外圓內為 255，內圓與外圓外為 0。"""
+    cx, cy = width // 2, height // 2
+    r = int(R * inner_ratio)
+    if antialias:
+        return to_mask_image(annulus_mask(width, height, R, r, antialias=True))
+
+    mask = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    draw.ellipse((cx - R, cy - R, cx + R, cy + R), fill=255)
+    draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=0)
+    return mask
+
+def draw_sector_mask(width, height, R, inner_ratio, start_angle, end_angle, antialias=False):
+    """
+    繪製扇形圓環遮罩 ('L' 模式)，角度使用 PIL pieslice 的定義 (由 start 順時針畫到 end)。
+    start_angle 或 end_angle 為 None 時代表不繪製扇形 (回傳全透明遮罩)。
+    """
+    cx, cy = width // 2, height // 2
+    r = int(R * inner_ratio)
+    if antialias:
+        return to_mask_image(annular_sector_mask(width, height, R, r, start_angle, end_angle, antialias=True))
+
+    mask = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(mask)
+    if start_angle is not None and end_angle is not None:
+        draw.pieslice((cx - R, cy - R, cx + R, cy + R), start_angle, end_angle, fill=255)
+    draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=0)
+    return mask
+
+# --- 2. LRU 快取 ---
+
+class MaskCache:
+    """
+    以 (寬, 高, R, 內圓比例, 起始角, 結束角) 為鍵的遮罩 LRU 快取。
+    回傳的遮罩會被多個呼叫端共用，只能讀取 (putalpha / paste 的 mask 參數)，不可直接修改。
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, angle_step=ANGLE_STEP, antialias=ANTIALIAS):
+        self.max_entries = max_entries
+        self.angle_step = angle_step
+        self.antialias = antialias
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def quantize(self, angle):
+        """將角度量化到 angle_step，讓相近的分數共用同一個遮罩。"""
+        if angle is None or not self.angle_step:
+            return angle
+        return round(round(angle / self.angle_step) * self.angle_step, 6)
+
+    def _get(self, key, factory):
+        with self._lock:
+            mask = self._entries.get(key)
+            if mask is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return mask
+            self.misses += 1
+
+        mask = factory()
+
+        with self._lock:
+            self._entries[key] = mask
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return mask
+
+    def donut_mask(self, width, height, R, inner_ratio):
+        """取得 (或繪製並快取) 完整圓環遮罩。"""
+        aa = self.antialias
+        key = ('donut', width, height, R, inner_ratio, aa)
+        return self._get(key, lambda: draw_donut_mask(width, height, R, inner_ratio, aa))
+
+    def sector_mask(self, width, height, R, inner_ratio, start_angle, end_angle):
+        """取得 (或繪製並快取) 扇形圓環遮罩，起訖角度會先量化。"""
+        start_q = self.quantize(start_angle)
+        end_q = self.quantize(end_angle)
+        aa = self.antialias
+        key = ('sector', width, height, R, inner_ratio, start_q, end_q, aa)
+        return self._get(key, lambda: draw_sector_mask(width, height, R, inner_ratio, start_q, end_q, aa))
+
+    def stats(self):
+        """回傳命中/未命中次數與目前容量。"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits / total) if total else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
+
+    def clear(self):
+        """清空快取並重設計數器。"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+# --- 3. 全域共用實例 ---
+
+_default_cache = MaskCache()
+
+def get_donut_mask(width, height, R, inner_ratio):
+    return _default_cache.donut_mask(width, height, R, inner_ratio)
+
+def get_sector_mask(width, height, R, inner_ratio, start_angle, end_angle):
+    return _default_cache.sector_mask(width, height, R, inner_ratio, start_angle, end_angle)
+
+def antialias_enabled():
+    return _default_cache.antialias
+
+def cache_stats():
+    return _default_cache.stats()
+
+def configure(max_entries=None, angle_step=None, antialias=None):
+    """調整共用快取的容量、角度量化步長與抗鋸齒模式 (會清空現有快取)。"""
+    if max_entries is not None:
+        _default_cache.max_entries = max_entries
+    if angle_step is not None:
+        _default_cache.angle_step = angle_step
+    if antialias is not None:
+        _default_cache.antialias = antialias
+    _default_cache.clear()
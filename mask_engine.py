@@ -0,0 +1,148 @@
+import numpy as np
+from PIL import Image
+
+# --- 全域配置 ---
+# PIL 的 ellipse((cx-R, cy-R, cx+R, cy+R)) 會包含邊界框兩端的像素，
+# 實際覆蓋的半徑約為 R + 0.5，這裡用相同的偏移讓二值遮罩與 ImageDraw 結果對齊。
+EDGE_OFFSET = 0.5
+
+# --- 1. 向量化的幾何量 ---
+# 以 (1, W) 的 dx 列向量與 (H, 1) 的 dy 行向量做廣播運算，避免建立完整的座標網格，
+# 扇形判斷使用半平面 (外積) 測試，不需要對每個像素計算 arctan2。
+
+def _offsets(width, height):
+    cx, cy = width // 2, height // 2
+    dx = (np.arange(width, dtype=np.float32) - cx)[np.newaxis, :]
+    dy = (np.arange(height, dtype=np.float32) - cy)[:, np.newaxis]
+    return dx, dy
+
+def _unit(angle_deg):
+    a = np.radians(angle_deg)
+    return np.float32(np.cos(a)), np.float32(np.sin(a))
+
+def _cross(u, dx, dy):
+    """方向 u 與像素向量的外積 = |p| * sin(θ - a)，大於 0 代表像素在 u 的順時針側。"""
+    return u[0] * dy - u[1] * dx
+
+def _sector_span(start_angle, end_angle):
+    """依照 PIL pieslice 的規則計算由 start 順時針到 end 的角度範圍 (0 ~ 360)。"""
+    span = end_angle - start_angle
+    if span >= 360:
+        return 360.0
+    return span % 360.0
+
+def _sector_inside(cross_start, cross_end, span):
+    """cross_start = sin(θ - start)，cross_end = sin(θ - end) (皆乘上 |p|)。"""
+    if span <= 180:
+        return (cross_start >= 0) & (cross_end <= 0)
+    # 大於半圓時取「互補扇形」的補集
+    return ~((cross_end > 0) & (cross_start < 0))
+
+def _ring_inside(dx, dy, R, r):
+    r2 = dx * dx + dy * dy
+    return (r2 <= np.float32((R + EDGE_OFFSET) ** 2)) & (r2 > np.float32((r + EDGE_OFFSET) ** 2))
+
+# --- 2. 有號距離 (內部為正，外部為負，單位: 像素) ---
+
+def _ring_distance(radius, R, r):
+    """到外圓與內圓邊界的有號距離。"""
+    return np.minimum((R + EDGE_OFFSET) - radius, radius - (r + EDGE_OFFSET))
+
+def _ray_distance(u, dx, dy, radius, cross):
+    """像素到從圓心出發、方向為 u 的射線之距離 (射線後方的像素取到圓心的距離)。"""
+    along = u[0] * dx + u[1] * dy
+    return np.where(along > 0, np.abs(cross), radius)
+
+def _coverage(distance):
+    coverage = np.clip(distance + np.float32(0.5), 0.0, 1.0)
+    return (coverage * np.float32(255.0) + np.float32(0.5)).astype(np.uint8)
+
+def _edge_band(inside):
+    """二值遮罩中與相鄰像素 (上下左右) 結果不同的像素，即需要計算覆蓋率的邊界帶。"""
+    band = np.zeros_like(inside)
+    diff = inside[:, 1:] != inside[:, :-1]
+    band[:, 1:] |= diff
+    band[:, :-1] |= diff
+    diff = inside[1:, :] != inside[:-1, :]
+    band[1:, :] |= diff
+    band[:-1, :] |= diff
+    return np.nonzero(band)
+
+def _antialias(inside, width, height, distance_fn):
+    """
+    解析式抗鋸齒：邊界帶以外的像素覆蓋率必為 0 或 1，直接沿用二值結果；
+    只有邊界帶上的像素才以有號距離計算覆蓋率，因此成本接近二值遮罩。
+    """
+    mask = inside.view(np.uint8) * np.uint8(255)
+    ys, xs = _edge_band(inside)
+    if ys.size:
+        dx = xs.astype(np.float32) - np.float32(width // 2)
+        dy = ys.astype(np.float32) - np.float32(height // 2)
+        mask[ys, xs] = _coverage(distance_fn(dx, dy))
+    return mask
+
+def _sector_distance(dx, dy, u_start, u_end, span, R, r):
+    """到扇形圓環邊界 (外圓、內圓與兩條半徑邊) 的有號距離。"""
+    radius = np.hypot(dx, dy)
+    cross_start = _cross(u_start, dx, dy)
+    cross_end = _cross(u_end, dx, dy)
+    edge_distance = np.minimum(
+        _ray_distance(u_start, dx, dy, radius, cross_start),
+        _ray_distance(u_end, dx, dy, radius, cross_end),
+    )
+    inside_sector = _sector_inside(cross_start, cross_end, span)
+    sector_distance = np.where(inside_sector, edge_distance, -edge_distance)
+    return np.minimum(_ring_distance(radius, R, r), sector_distance)
+
+# --- 3. 遮罩產生 ---
+
+def annulus_mask(width, height, R, r, antialias=False):
+    """
+    產生圓環遮罩 (uint8 陣列，255 = 保留)。
+
+    Args:
+        width, height (int): 畫布尺寸。
+        R (float): 外圓半徑。
+        r (float): 內圓半徑。
+        antialias (bool): 是否以邊界距離計算像素覆蓋率做解析式抗鋸齒 (不需超取樣)。
+    """
+    dx, dy = _offsets(width, height)
+    inside = _ring_inside(dx, dy, R, r)
+    if antialias:
+        return _antialias(inside, width, height,
+                          lambda px, py: _ring_distance(np.hypot(px, py), R, r))
+    return inside.view(np.uint8) * np.uint8(255)
+
+def annular_sector_mask(width, height, R, r, start_angle, end_angle, antialias=False):
+    """
+    產生扇形圓環遮罩 (uint8 陣列，255 = 保留)，角度定義與 PIL pieslice 相同
+    (由 start_angle 順時針到 end_angle)。start_angle 或 end_angle 為 None 時回傳全 0 遮罩。
+
+    Args:
+        width, height (int): 畫布尺寸。
+        R (float): 外圓半徑。
+        r (float): 內圓半徑。
+        start_angle, end_angle (float | None): 扇形起訖角度 (度)。
+        antialias (bool): 是否以到圓環與扇形邊界的有號距離計算覆蓋率做抗鋸齒。
+    """
+    if start_angle is None or end_angle is None:
+        return np.zeros((height, width), dtype=np.uint8)
+
+    span = _sector_span(start_angle, end_angle)
+    if span >= 360:
+        return annulus_mask(width, height, R, r, antialias)
+
+    dx, dy = _offsets(width, height)
+    u_start = _unit(start_angle)
+    u_end = _unit(start_angle + span)
+    inside = _sector_inside(_cross(u_start, dx, dy), _cross(u_end, dx, dy), span)
+    inside &= _ring_inside(dx, dy, R, r)
+
+    if antialias:
+        return _antialias(inside, width, height,
+                          lambda px, py: _sector_distance(px, py, u_start, u_end, span, R, r))
+    return inside.view(np.uint8) * np.uint8(255)
+
+def to_mask_image(mask_array):
+    """將 uint8 遮罩陣列轉為 PIL 'L' 模式圖片。"""
+    return Image.fromarray(np.ascontiguousarray(mask_array, dtype=np.uint8))
@@ -1,10 +1,17 @@
-from PIL import Image, ImageDraw
+from PIL import Image
+import numpy as np
+from collections import OrderedDict
 import json
 import os
 import math
 import sys
 import datetime # <<< 新增：引入時間模組
 
+from image_encoding import save_image, load_image, pop_profile_argument, print_report
+from mask_cache import antialias_enabled
+from polar_index import get_offset_sector_mask, get_polar_index, ANGLE_UNITS
+from tracing import traced
+
 # --- 全域配置 ---
 INPUT_CONFIG_PATH = 'json/merge_input.json' 
 FULL_SCORE = 300  
@@ -61,74 +68,244 @@ def crop_single_segment(image_path, start_angle_pil, end_angle_pil):
         return None
         
     try:
-        img = Image.open(image_path).convert("RGBA")
+        img = load_image(image_path, "RGBA")
     except Exception as e:
         print(f"❌ 處理圖片時發生錯誤: {e}")
         return None
 
     width, height = img.size
-    cx, cy = width // 2, height // 2
     R = min(width, height) // 2 
-    r = int(R * INNER_RADIUS_RATIO) 
-    
-    mask = Image.new('L', (width, height), 0)
-    draw = ImageDraw.Draw(mask)
-
-    draw.pieslice(
-        (cx - R, cy - R, cx + R, cy + R), 
-        end_angle_pil, start_angle_pil, fill=255 
-    )
     
-    draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=0)
+    # 將 PIL 角度換算成從 START_ANGLE_PIL 逆時針量起的偏移，直接查極座標索引
+    start_offset, span = segment_offsets(start_angle_pil, end_angle_pil)
+    mask = get_offset_sector_mask(width, height, R, INNER_RADIUS_RATIO,
+                                  start_offset, start_offset + span, START_ANGLE_PIL)
 
     img.putalpha(mask)
     
     return img
 
-# --- 3. 主合併函數 (保持不變) ---
+# --- 3. 單次掃描的標籤圖合成器 ---
 
-def merge_segments(segments_list, final_output_path):
-    """依序處理並合併多個甜甜圈扇形片段，並在達到或超過總分時停止。"""
-    if not segments_list:
-        print("❌ 錯誤：片段列表為空，無法合併。")
-        return None
-        
-    print("--- 甜甜圈片段合併程式啟動 ---")
-    
-    # 1. 初始化畫布、角度和累計分數追蹤器
-    first_image_path = segments_list[0]['image_path']
-    try:
-        base_img = Image.open(first_image_path)
-    except Exception as e:
-        print(f"❌ 錯誤: 無法開啟第一個圖片檔案 '{first_image_path}' 來初始化畫布: {e}")
-        return None
-        
-    final_canvas = Image.new('RGBA', base_img.size, (0, 0, 0, 0)) # 透明畫布
-    current_start_angle_pil = START_ANGLE_PIL 
-    accumulated_score = 0.0
+def segment_offsets(start_angle_pil, end_angle_pil):
+    """將片段的 PIL 角度換算成從 START_ANGLE_PIL 逆時針量起的 (起點偏移, 角度範圍)。"""
+    start_offset = (START_ANGLE_PIL - start_angle_pil) % 360
+    span = (start_angle_pil - end_angle_pil) % 360
+    if span == 0:
+        span = 360.0
+    return start_offset, span
+
+def _sector_bbox(width, height, R, r, start_offset, end_offset):
+    """
+    扇形圓環的外接矩形 (left, top, right, bottom)，由弧線端點與落在範圍內的
+    上下左右四個極值點解析計算，不需要掃描像素。
+    """
+    cx, cy = width // 2, height // 2
+    points = []
+    for offset in (start_offset, end_offset):
+        theta = math.radians(START_ANGLE_PIL - offset)
+        for radius in (R, r):
+            points.append((math.cos(theta) * radius, math.sin(theta) * radius))
+    for axis in (0.0, 90.0, 180.0, 270.0):
+        axis_offset = (START_ANGLE_PIL - axis) % 360
+        if start_offset <= axis_offset <= end_offset or start_offset <= axis_offset + 360 <= end_offset:
+            theta = math.radians(axis)
+            points.append((math.cos(theta) * R, math.sin(theta) * R))
+
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    left = max(0, int(math.floor(cx + min(xs))) - 1)
+    top = max(0, int(math.floor(cy + min(ys))) - 1)
+    right = min(width, int(math.ceil(cx + max(xs))) + 2)
+    bottom = min(height, int(math.ceil(cy + max(ys))) + 2)
+    return left, top, right, bottom
+
+def build_label_map(size, plan):
+    """
+    建立標籤圖：每個像素記錄它屬於第幾個片段 (1 ~ N)，0 代表不屬於任何片段。
+
+    片段依序首尾相接，因此只需要把累積角度轉成門檻，再對極座標索引做一次 searchsorted。
+
+    Args:
+        size (tuple): 畫布尺寸 (寬, 高)。
+        plan (list): plan_segments 產生的片段列表。
+    """
+    width, height = size
+    R = min(width, height) // 2
+    r = int(R * INNER_RADIUS_RATIO)
+    index = get_polar_index(width, height, START_ANGLE_PIL)
 
-    # 2. 依序處理每個片段
+    # searchsorted 的結果 k 代表角度落在 [bounds[k-1], bounds[k]) 之間，也就是第 k+1 個片段；
+    # 增量合併時 plan 不從 0 度開始，前面已合成的範圍以標籤 0 佔位
+    bounds = []
+    labels_of_interval = []
+    if plan and plan[0]['start_offset'] > 0:
+        bounds.append(min(index.threshold(plan[0]['start_offset']), ANGLE_UNITS))
+        labels_of_interval.append(0)
+    for k, item in enumerate(plan, start=1):
+        bounds.append(min(index.threshold(item['end_offset']), ANGLE_UNITS))
+        labels_of_interval.append(k if item['image_path'] else 0)
+    labels_of_interval.append(0)
+
+    dtype = np.uint8 if len(plan) < 255 else (np.uint16 if len(plan) < 65535 else np.uint32)
+    lut = np.asarray(labels_of_interval, dtype=dtype)
+    interval = np.searchsorted(np.asarray(bounds, dtype=np.int64), index.angle, side='right')
+    labels = lut[interval]
+    labels[~index.ring(R, r)] = 0
+    return labels
+
+@traced('merge_composite')
+def composite_label_map(size, plan, base=None):
+    """
+    依標籤圖一次組合所有片段：每個來源圖片只在自己扇形的外接矩形內被讀取與複製，
+    不再對每個片段建立全畫布遮罩並 paste。
+
+    Args:
+        base (PIL.Image.Image, optional): 已合成前面片段的畫布 (增量合併時使用)。
+
+    Returns:
+        PIL.Image.Image: 合併後的 RGBA 畫布。
+    """
+    width, height = size
+    R = min(width, height) // 2
+    r = int(R * INNER_RADIUS_RATIO)
+    labels = build_label_map(size, plan)
+    if base is not None:
+        canvas = np.array(base.convert("RGBA"), dtype=np.uint8)
+    else:
+        canvas = np.zeros((height, width, 4), dtype=np.uint8)
+
+    # 同一張來源圖片可能對應多個片段，依路徑分組後每張圖只解碼一次
+    groups = OrderedDict()
+    for k, item in enumerate(plan, start=1):
+        if item['image_path']:
+            groups.setdefault(item['image_path'], []).append((k, item))
+
+    for image_path, items in groups.items():
+        try:
+            src = load_image(image_path)
+            if src.size != size:
+                print(f"❗ {os.path.basename(image_path)} 尺寸 {src.size} 與畫布 {size} 不同，已縮放。")
+                src = src.convert("RGBA").resize(size, Image.Resampling.LANCZOS)
+            pixels = np.asarray(src.convert("RGBA"))
+        except Exception as e:
+            print(f"❗ 跳過 {image_path}：無法讀取圖片 ({e})。")
+            continue
+
+        for k, item in items:
+            left, top, right, bottom = _sector_bbox(width, height, R, r, item['start_offset'], item['end_offset'])
+            if right <= left or bottom <= top:
+                continue
+            selected = labels[top:bottom, left:right] == k
+            target = canvas[top:bottom, left:right]
+            target[selected] = pixels[top:bottom, left:right][selected]
+            target[selected, 3] = 255
+
+    return Image.fromarray(canvas)
+
+@traced('merge_composite')
+def composite_by_paste(size, plan, base=None):
+    """逐片段裁切後 paste 的舊作法；抗鋸齒遮罩有半透明邊緣，需要以此方式混合。"""
+    if base is not None:
+        final_canvas = base.convert('RGBA')
+    else:
+        final_canvas = Image.new('RGBA', size, (0, 0, 0, 0)) # 透明畫布
+    for item in plan:
+        if not item['image_path']:
+            continue
+        segment_img = crop_single_segment(item['image_path'], item['start_angle_pil'], item['end_angle_pil'])
+        if segment_img is None:
+            print(f"❗ 跳過 {item['name']}：無法裁切圖片。")
+            continue
+        final_canvas.paste(segment_img, (0, 0), segment_img)
+    return final_canvas
+
+# --- 4. 片段得分與角度分配 ---
+
+def _stored_scores(segments_list):
+    """
+    以一次查詢從任務資料庫 (task_store.py) 取得所有片段的分數，回傳 {片段索引: total_score}。
+    只有得分路徑為任務標準 output.json 的片段會使用資料庫，其他片段仍讀取設定檔指定的 JSON；
+    output.json 比資料庫記錄新的片段也改讀檔案 (見 TaskStore.scores)。
+    """
+    import task_store
+    store = task_store.default_store(create=False)
+    if store is None:
+        return {}
+    standard = {i: seg['task'] for i, seg in enumerate(segments_list)
+                if seg.get('task') and os.path.normpath(seg['score_json_path'])
+                == os.path.normpath(task_store.layout_paths(seg['task'])['score'])}
+    scores = store.scores(standard.values())
+    return {i: scores[task] for i, task in standard.items() if task in scores}
+
+def read_segment_scores(segments_list):
+    """
+    讀取每個片段的得分 (任務資料庫中有記錄時不必開啟 JSON 檔案)，無法讀取的片段為 None。
+    """
+    stored_scores = _stored_scores(segments_list)
+    scores = []
     for i, segment in enumerate(segments_list):
+        if i in stored_scores:
+            scores.append(stored_scores[i])
+            continue
+        score_data = read_data(segment['score_json_path'])
+        scores.append(None if score_data is None else score_data.get('total_score', 0.0))
+    return scores
+
+def new_plan_state():
+    """角度分配的起始狀態：從 START_ANGLE_PIL 開始、尚未累積任何分數。"""
+    return {
+        'accumulated_score': 0.0,
+        'current_start_angle_pil': START_ANGLE_PIL,
+        'cumulative_offset': 0.0,
+        'next_index': 0,        # 下一個要處理的片段在設定檔中的索引
+        'complete': False,      # 是否已填滿整個圓環 (之後的片段不再繪製)
+    }
+
+def plan_segments(segments_list, scores=None, state=None):
+    """
+    讀取每個片段的得分並計算角度範圍 (不讀取任何圖片像素)，並在達到或超過總分時停止。
+
+    Args:
+        segments_list (list): 要處理的片段。
+        scores (list, optional): 與 segments_list 對應的得分 (預設由 read_segment_scores 讀取)。
+        state (dict, optional): new_plan_state 格式的起始狀態；增量合併時從上次的狀態接續，
+            並在處理後就地更新。
+
+    Returns:
+        list: 每個要繪製的片段一筆 dict，包含 name、image_path (找不到圖片時為 None)、
+              start_angle_pil、end_angle_pil、start_offset、end_offset。
+    """
+    if scores is None:
+        scores = read_segment_scores(segments_list)
+    if state is None:
+        state = new_plan_state()
+    plan = []
+    current_start_angle_pil = state['current_start_angle_pil']
+    accumulated_score = state['accumulated_score']
+    cumulative_offset = state['cumulative_offset']
+    first_index = state['next_index']
+
+    for i, segment in enumerate(segments_list, start=first_index):
         if accumulated_score >= FULL_SCORE:
             print(f"\n✅ 總分已達 {FULL_SCORE} 分或更高，停止處理後續片段。")
+            state['complete'] = True
             break
+        state['next_index'] = i + 1
             
         img_path = segment['image_path']
-        json_path = segment['score_json_path']
         segment_name = f"片段 {i+1} ({os.path.basename(img_path)})"
         
         print(f"\n--- 處理 {segment_name} ---")
         
-        # 2a. 讀取得分
-        score_data = read_data(json_path)
-        if score_data is None:
+        # a. 讀取得分
+        score = scores[i - first_index]
+        if score is None:
             print(f"❗ 跳過 {segment_name}：無法讀取得分 JSON。")
             continue
-            
-        score = score_data.get('total_score', 0.0)
         max_remaining_score = FULL_SCORE - accumulated_score
         
-        # 2b. 計算裁切角度
+        # b. 計算裁切角度
         end_angle_pil, filled_degree, is_full_circle = calculate_pil_angles(
             score, current_start_angle_pil, max_remaining_score
         )
@@ -137,44 +314,209 @@ def merge_segments(segments_list, final_output_path):
         print(f" 裁切度數: {filled_degree:.2f}°")
         print(f" PIL 角度範圍: [{end_angle_pil:.2f}°] (終點) 到 [{current_start_angle_pil:.2f}°] (起點)")
         
-        # 2c. 裁切圖片片段
+        # c. 記錄片段範圍 (片段首尾相接，起點即為上一片段的終點)
         if filled_degree > 0:
-            segment_img = crop_single_segment(img_path, current_start_angle_pil, end_angle_pil)
-            
-            if segment_img is None:
-                print(f"❗ 跳過 {segment_name}：無法裁切圖片。")
-                accumulated_score += min(score, max_remaining_score)
-                current_start_angle_pil = end_angle_pil
-                continue
-                
-            # 2d. 疊加到最終畫布
-            final_canvas.paste(segment_img, (0, 0), segment_img)
+            _, span = segment_offsets(current_start_angle_pil, end_angle_pil)
+            if not os.path.exists(img_path):
+                print(f"❗ 跳過 {segment_name}：找不到圖片 {img_path}。")
+                img_path = None
+
+            plan.append({
+                'name': segment_name,
+                'image_path': img_path,
+                'start_angle_pil': current_start_angle_pil,
+                'end_angle_pil': end_angle_pil,
+                'start_offset': cumulative_offset,
+                'end_offset': cumulative_offset + span,
+            })
             
-            # 2e. 更新累計分數和下一個片段的起始角度
+            # d. 更新累計分數和下一個片段的起始角度
             accumulated_score += filled_degree / 360 * FULL_SCORE
+            cumulative_offset += span
             current_start_angle_pil = end_angle_pil
             
         else:
             print(f"❗ {segment_name} 的得分 {score:.2f} 已經被前面片段填滿，無需繪製。")
         
-        # 2f. 檢查是否滿分，如果是則跳出迴圈
+        # e. 檢查是否滿分，如果是則跳出迴圈
         if is_full_circle:
              print(f"✅ {segment_name} 繪製完畢，圖形已圓滿填滿 (360°)。")
+             state['complete'] = True
              break
 
-    # 3. 儲存最終結果
+    state['accumulated_score'] = accumulated_score
+    state['current_start_angle_pil'] = current_start_angle_pil
+    state['cumulative_offset'] = cumulative_offset
+    if accumulated_score >= FULL_SCORE:
+        state['complete'] = True
+    return plan
+
+# --- 5. 增量合併狀態 ---
+
+MERGE_STATE_VERSION = 1
+
+def merge_state_paths(final_output_path):
+    """
+    合併狀態存放在輸出圖片旁：.merge_state.json (角度與片段簽章) 與 .merge_state.npy (已合成的畫布)。
+    畫布以未壓縮的 NumPy 陣列儲存，讀寫只需要數毫秒 (PNG 編碼一張 1024x1024 約需 0.4 秒)。
+    """
+    output_dir = os.path.dirname(final_output_path) or '.'
+    return os.path.join(output_dir, '.merge_state.json'), os.path.join(output_dir, '.merge_state.npy')
+
+def merge_parameters(canvas_size):
+    """影響合成結果的設定；任何一項改變都必須完整重建。"""
+    return {
+        'version': MERGE_STATE_VERSION,
+        'canvas_size': list(canvas_size),
+        'full_score': FULL_SCORE,
+        'inner_radius_ratio': INNER_RADIUS_RATIO,
+        'start_angle_pil': START_ANGLE_PIL,
+        'antialias': bool(antialias_enabled()),
+    }
+
+def segment_signature(segment, score):
+    """片段的簽章：路徑、得分與圖片檔案的 (大小, 修改時間)；圖片不存在時為 None。"""
+    try:
+        st = os.stat(segment['image_path'])
+        image = [st.st_size, st.st_mtime_ns]
+    except OSError:
+        image = None
+    return {
+        'image_path': segment['image_path'],
+        'score_json_path': segment['score_json_path'],
+        'score': score,
+        'image': image,
+    }
+
+def load_merge_state(final_output_path, parameters, signatures):
+    """
+    讀取上次的合併狀態，並確認可以接續：合成設定相同，且上次已處理的片段
+    (路徑、得分、圖片) 全部沒有變動。
+
+    Returns:
+        tuple: (狀態 dict, 畫布 Image)；無法接續時回傳 (None, None)。
+    """
+    state_path, canvas_path = merge_state_paths(final_output_path)
+    if not os.path.exists(state_path) or not os.path.exists(canvas_path):
+        return None, None
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"❗ 合併狀態無法讀取，完整重建: {e}")
+        return None, None
+
+    if state.get('parameters') != parameters:
+        print("❗ 合成設定已變更，完整重建。")
+        return None, None
+    included = state.get('segments', [])
+    if included != signatures[:len(included)]:
+        changed = next((i for i, (old, new) in enumerate(zip(included, signatures)) if old != new), len(signatures))
+        print(f"❗ 片段 {changed + 1} 的得分或圖片已變更 (或片段已移除)，完整重建。")
+        return None, None
+    try:
+        canvas = Image.fromarray(np.load(canvas_path, allow_pickle=False), 'RGBA')
+    except Exception as e:
+        print(f"❗ 合併狀態畫布無法讀取，完整重建: {e}")
+        return None, None
+    if canvas.size != tuple(parameters['canvas_size']):
+        return None, None
+    return state, canvas
+
+def save_merge_state(final_output_path, parameters, signatures, plan_state, canvas):
+    """以暫存檔 + os.replace 寫入畫布與狀態 (先寫畫布，狀態檔存在即代表畫布完整)。"""
+    state_path, canvas_path = merge_state_paths(final_output_path)
+    state = {
+        'parameters': parameters,
+        'plan_state': plan_state,
+        'segments': signatures[:plan_state['next_index']],
+    }
+    try:
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        tmp_canvas = f"{canvas_path}.{os.getpid()}.tmp"
+        with open(tmp_canvas, 'wb') as f:
+            np.save(f, np.asarray(canvas.convert('RGBA')), allow_pickle=False)
+        os.replace(tmp_canvas, canvas_path)
+        tmp_state = f"{state_path}.{os.getpid()}.tmp"
+        with open(tmp_state, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_state, state_path)
+    except Exception as e:
+        print(f"❗ 無法儲存合併狀態 (下次將完整重建): {e}")
+
+# --- 6. 主合併函數 ---
+
+@traced('merge')
+def merge_segments(segments_list, final_output_path, incremental=True):
+    """
+    依序處理並合併多個甜甜圈扇形片段，並在達到或超過總分時停止。
+
+    incremental=True 時沿用輸出資料夾中上次的合併狀態：設定檔只在尾端新增片段時，
+    只合成新增的扇形；前面任何片段的得分或圖片變動時才完整重建。
+    """
+    if not segments_list:
+        print("❌ 錯誤：片段列表為空，無法合併。")
+        return None
+        
+    print("--- 甜甜圈片段合併程式啟動 ---")
+    
+    # 1. 以第一張圖片的尺寸初始化畫布 (只讀取檔頭，不解碼像素)
+    first_image_path = segments_list[0]['image_path']
+    try:
+        with Image.open(first_image_path) as base_img:
+            canvas_size = base_img.size
+    except Exception as e:
+        print(f"❌ 錯誤: 無法開啟第一個圖片檔案 '{first_image_path}' 來初始化畫布: {e}")
+        return None
+
+    # 2. 讀取得分並比對上次的合併狀態
+    scores = read_segment_scores(segments_list)
+    parameters = merge_parameters(canvas_size)
+    signatures = [segment_signature(seg, score) for seg, score in zip(segments_list, scores)]
+    state, base_canvas = load_merge_state(final_output_path, parameters, signatures) if incremental else (None, None)
+
+    if state is not None:
+        plan_state = state['plan_state']
+        done = plan_state['next_index']
+        if plan_state['complete'] or done >= len(segments_list):
+            print(f"♻️ 沿用上次的合併結果 (前 {done} 個片段沒有變動，沒有需要新增的扇形)。")
+        else:
+            print(f"♻️ 沿用前 {done} 個片段的合併結果，只合成新增的 {len(segments_list) - done} 個片段。")
+    else:
+        plan_state = new_plan_state()
+
+    # 3. 計算新增片段的角度範圍 (完整重建時為全部片段)
+    start = plan_state['next_index']
+    plan = []
+    if not plan_state['complete'] and start < len(segments_list):
+        plan = plan_segments(segments_list[start:], scores[start:], plan_state)
+
+    # 4. 只合成新的扇形
+    if not plan and base_canvas is not None:
+        final_canvas = base_canvas
+    elif antialias_enabled():
+        final_canvas = composite_by_paste(canvas_size, plan, base_canvas)
+    else:
+        final_canvas = composite_label_map(canvas_size, plan, base_canvas)
+
+    # 5. 儲存最終結果
     print("\n--- 儲存最終結果 ---")
     if not create_output_dir(final_output_path):
         return None
 
     try:
-        final_canvas.save(final_output_path, 'PNG')
-        print(f"✅ 所有片段已成功合併，儲存至: {final_output_path}")
+        saved_path = save_image(final_canvas, final_output_path)
+        print(f"✅ 所有片段已成功合併，儲存至: {saved_path}")
     except Exception as e:
         print(f"❌ 儲存最終合併圖片時發生錯誤: {e}")
         return None
 
-# --- 4. 範例執行設定 (修改重點) ---
+    if incremental:
+        save_merge_state(final_output_path, parameters, signatures, plan_state, final_canvas)
+    return saved_path
+
+# --- 7. 範例執行設定 (修改重點) ---
 
 def load_config_and_prepare_segments(config_path):
     """
@@ -215,6 +557,7 @@ def load_config_and_prepare_segments(config_path):
             continue
             
         prepared_segments.append({
+            'task': topic_id,
             'image_path': img_tmpl.format(topic_id=topic_id),
             'score_json_path': json_tmpl.format(topic_id=topic_id)
         })
@@ -222,9 +565,14 @@ def load_config_and_prepare_segments(config_path):
     return prepared_segments, final_output
 
 if __name__ == "__main__":
+    # 用法: python merge_segment.py [配置檔案] [--full] [--profile NAME]
+    # (--full: 忽略上次的合併狀態，完整重建；--profile: 輸出圖片的編碼設定檔，見 image_encoding.py)
+    argv = pop_profile_argument(sys.argv[1:])
+    full_rebuild = '--full' in argv
+    cli_args = [arg for arg in argv if arg != '--full']
     
-    if len(sys.argv) > 1:
-        custom_config_path = sys.argv[1]
+    if cli_args:
+        custom_config_path = cli_args[0]
         print(f"🔍 使用命令行參數指定的配置檔案: {custom_config_path}")
     else:
         custom_config_path = INPUT_CONFIG_PATH
@@ -234,6 +582,7 @@ if __name__ == "__main__":
     
     if segments_to_merge and final_output:
         # 執行合併
-        merge_segments(segments_to_merge, final_output)
+        merge_segments(segments_to_merge, final_output, incremental=not full_rebuild)
+        print_report()
     
     print("\n--- 程式執行完畢 ---")
\ No newline at end of file
@@ -0,0 +1,269 @@
+import argparse
+import hashlib
+import json
+import os
+import struct
+import sys
+
+# --- 全域配置 ---
+LOCAL_MODEL_DIR = os.path.join('.cache', 'models')   # 本機鏡像的根目錄
+MANIFEST_NAME = 'mirror_manifest.json'               # 每個鏡像目錄中的檔案清單
+CHUNK_SIZE = 8 * 1024 * 1024                         # 複製時每次讀取的大小
+PART_SUFFIX = '.part'                                # 尚未複製完成的檔案
+
+# --- 1. 鏡像清單 ---
+
+def mirror_path_for(source, local_root=LOCAL_MODEL_DIR):
+    """來源模型目錄對應的本機鏡像路徑，例如 \\\\MSI\\sdxl_base -> .cache/models/sdxl_base。"""
+    name = os.path.basename(os.path.normpath(source.replace('\\', os.sep))) or 'model'
+    return os.path.join(local_root, name)
+
+def read_manifest(mirror_dir):
+    """讀取鏡像清單，不存在或損毀時回傳空清單。"""
+    path = os.path.join(mirror_dir, MANIFEST_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get('files'), dict):
+            return manifest
+    except (OSError, ValueError, AttributeError):
+        pass
+    return {'source': None, 'complete': False, 'files': {}}
+
+def write_manifest(mirror_dir, manifest):
+    """以暫存檔 + 改名的方式寫入清單，中斷時不會留下寫到一半的 JSON。"""
+    path = os.path.join(mirror_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def scan_source(source):
+    """
+    列出來源目錄中的所有檔案 (只讀取目錄資訊，不讀取內容)。
+
+    Returns:
+        dict: {相對路徑 (以 / 分隔): (大小, 修改時間 ns)}
+    """
+    files = {}
+    for root, _, names in os.walk(source):
+        for name in names:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, source).replace(os.sep, '/')
+            st = os.stat(path)
+            files[rel] = (st.st_size, st.st_mtime_ns)
+    return files
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+# --- 2. 可續傳的複製 ---
+
+def copy_resumable(src_path, dest_path, size, mtime_ns):
+    """
+    將檔案複製到 dest_path，先寫入 dest_path.part，完成後才改名。
+    .part 旁的 .json 記錄來源的大小與修改時間；來源沒有變動時，中斷後會從已複製的位置繼續。
+
+    Returns:
+        str: 複製結果的 SHA-256。
+    """
+    part_path = dest_path + PART_SUFFIX
+    info_path = part_path + '.json'
+    source_info = {'size': size, 'mtime_ns': mtime_ns}
+    os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+
+    offset = 0
+    h = hashlib.sha256()
+    if os.path.exists(part_path) and os.path.exists(info_path):
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                same_source = json.load(f) == source_info
+        except (OSError, ValueError):
+            same_source = False
+        offset = os.path.getsize(part_path) if same_source else 0
+        if offset > size:
+            offset = 0
+    if offset:
+        # 已複製的部分也要計入雜湊
+        with open(part_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                h.update(chunk)
+        print(f"   ↪ 從 {offset / 1024 / 1024:.1f} MB 處繼續複製")
+    else:
+        with open(info_path, 'w', encoding='utf-8') as f:
+            json.dump(source_info, f)
+
+    with open(src_path, 'rb') as src, open(part_path, 'ab' if offset else 'wb') as dst:
+        src.seek(offset)
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+            dst.write(chunk)
+            h.update(chunk)
+
+    os.replace(part_path, dest_path)
+    os.remove(info_path)
+    os.utime(dest_path, ns=(mtime_ns, mtime_ns))
+    return h.hexdigest()
+
+# --- 3. 同步 ---
+
+def sync_mirror(source, mirror_dir=None, verify=False):
+    """
+    將來源模型目錄同步到本機鏡像：只複製大小或修改時間有變動 (或本機遺失) 的檔案，
+    並刪除來源中已不存在的檔案。清單中記錄每個檔案的大小、修改時間與 SHA-256。
+
+    Args:
+        source (str): 來源模型目錄 (例如網路共享資料夾)。
+        mirror_dir (str, optional): 本機鏡像目錄，預設為 mirror_path_for(source)。
+        verify (bool): 是否重新計算本機檔案的 SHA-256 並與清單比對 (不一致時重新複製)。
+
+    Returns:
+        str: 鏡像目錄，若失敗則回傳 None。
+    """
+    mirror_dir = mirror_dir or mirror_path_for(source)
+    try:
+        source_files = scan_source(source)
+    except OSError as e:
+        print(f"❌ 無法讀取模型來源 {source}: {e}")
+        return None
+    if not source_files:
+        print(f"❌ 模型來源 {source} 不存在或為空。")
+        return None
+
+    os.makedirs(mirror_dir, exist_ok=True)
+    manifest = read_manifest(mirror_dir)
+    if manifest.get('source') != source:
+        manifest = {'source': source, 'complete': False, 'files': manifest['files']}
+    manifest['complete'] = False
+    write_manifest(mirror_dir, manifest)
+
+    copied = skipped = 0
+    for rel, (size, mtime_ns) in sorted(source_files.items()):
+        dest_path = os.path.join(mirror_dir, *rel.split('/'))
+        entry = manifest['files'].get(rel)
+        up_to_date = (
+            entry is not None
+            and entry['size'] == size and entry['mtime_ns'] == mtime_ns
+            and os.path.exists(dest_path) and os.path.getsize(dest_path) == size
+        )
+        if up_to_date and verify and file_sha256(dest_path) != entry['sha256']:
+            print(f"❗ {rel} 的雜湊值與清單不符，重新複製。")
+            up_to_date = False
+        if up_to_date:
+            skipped += 1
+            continue
+
+        print(f"📥 複製 {rel} ({size / 1024 / 1024:.1f} MB)")
+        try:
+            digest = copy_resumable(os.path.join(source, *rel.split('/')), dest_path, size, mtime_ns)
+        except OSError as e:
+            print(f"❌ 複製 {rel} 失敗 (下次執行會從中斷處繼續): {e}")
+            return None
+        manifest['files'][rel] = {'size': size, 'mtime_ns': mtime_ns, 'sha256': digest}
+        write_manifest(mirror_dir, manifest)
+        copied += 1
+
+    # 刪除來源中已經不存在的檔案
+    for rel in sorted(set(manifest['files']) - set(source_files)):
+        path = os.path.join(mirror_dir, *rel.split('/'))
+        if os.path.exists(path):
+            os.remove(path)
+        del manifest['files'][rel]
+        print(f"🗑️  移除 {rel}")
+
+    manifest['complete'] = True
+    write_manifest(mirror_dir, manifest)
+    print(f"✅ 模型鏡像已同步: {mirror_dir} (複製 {copied} 個檔案，略過 {skipped} 個未變動的檔案)")
+    return mirror_dir
+
+def ensure_local_model(source, local_root=LOCAL_MODEL_DIR, verify=False):
+    """
+    取得可供 from_pretrained 使用的本機模型目錄。來源可連線時先同步；
+    來源無法連線但已有完整的鏡像時，直接使用鏡像 (離線模式)。
+
+    Returns:
+        str: 本機鏡像目錄，若無法取得則回傳 None。
+    """
+    mirror_dir = mirror_path_for(source, local_root)
+    if os.path.isdir(source):
+        return sync_mirror(source, mirror_dir, verify)
+    manifest = read_manifest(mirror_dir)
+    if manifest.get('complete') and manifest.get('source') == source:
+        print(f"❗ 無法連線到 {source}，使用既有的本機鏡像: {mirror_dir}")
+        return mirror_dir
+    print(f"❌ 無法連線到 {source}，且沒有完整的本機鏡像。")
+    return None
+
+# --- 4. 驗證 ---
+
+def read_safetensors_header(path):
+    """讀取 safetensors 檔案開頭的 JSON 標頭，回傳 (標頭 dict, 資料區起點)。"""
+    with open(path, 'rb') as f:
+        prefix = f.read(8)
+        if len(prefix) != 8:
+            raise ValueError(f"不是有效的 safetensors 檔案: {path}")
+        header_size = struct.unpack('<Q', prefix)[0]
+        header = json.loads(f.read(header_size))
+    return header, 8 + header_size
+
+def verify_safetensors(path):
+    """檢查標頭可以解析，且每個張量的資料範圍都在檔案內 (不讀取張量內容)。"""
+    try:
+        header, data_start = read_safetensors_header(path)
+    except (OSError, ValueError) as e:
+        print(f"❌ {path}: {e}")
+        return False
+    data_size = os.path.getsize(path) - data_start
+    for name, info in header.items():
+        if name == '__metadata__':
+            continue
+        begin, end = info['data_offsets']
+        if not 0 <= begin <= end <= data_size:
+            print(f"❌ {path}: 張量 {name} 的資料範圍超出檔案大小，檔案可能不完整。")
+            return False
+    return True
+
+def verify_mirror(mirror_dir):
+    """檢查鏡像清單完整，且所有 .safetensors 檔案的標頭與大小正確。"""
+    manifest = read_manifest(mirror_dir)
+    if not manifest.get('complete'):
+        print(f"❌ {mirror_dir} 尚未同步完成。")
+        return False
+    ok = True
+    for rel, entry in manifest['files'].items():
+        path = os.path.join(mirror_dir, *rel.split('/'))
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            print(f"❌ {rel} 遺失或大小不符。")
+            ok = False
+        elif rel.endswith('.safetensors') and not verify_safetensors(path):
+            ok = False
+    return ok
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="將 SDXL 模型目錄鏡像到本機並驗證。")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sync = sub.add_parser('sync', help="同步 (只複製有變動的檔案，可從中斷處繼續)")
+    sync.add_argument('source', nargs='?', help="模型來源目錄 (預設為 generate_image.SDXL_MODEL_PATH)")
+    sync.add_argument('--dest', help="本機鏡像目錄")
+    sync.add_argument('--verify', action='store_true', help="重新計算本機檔案的 SHA-256")
+    check = sub.add_parser('verify', help="檢查本機鏡像的清單與 safetensors 檔案")
+    check.add_argument('mirror_dir', nargs='?', help="本機鏡像目錄")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.command == 'sync':
+        if args.source is None:
+            from generate_image import SDXL_MODEL_PATH
+            args.source = SDXL_MODEL_PATH
+        sys.exit(0 if sync_mirror(args.source, args.dest, args.verify) else 1)
+    else:
+        if args.mirror_dir is None:
+            from generate_image import SDXL_MODEL_PATH
+            args.mirror_dir = mirror_path_for(SDXL_MODEL_PATH)
+        ok = verify_mirror(args.mirror_dir)
+        print("✅ 本機鏡像檢查通過。" if ok else "❌ 本機鏡像檢查失敗。")
+        sys.exit(0 if ok else 1)
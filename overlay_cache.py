@@ -0,0 +1,122 @@
+from PIL import Image
+import numpy as np
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+from image_encoding import load_image
+
+# --- 全域配置 ---
+CACHE_DIR = os.path.join('.cache', 'overlay')   # 縮放後遮罩的磁碟快取 (未壓縮 .npy，載入不需 zlib 解碼)
+MAX_ENTRIES = 8                                 # 記憶體中最多保留的縮放結果數量
+
+# --- 1. 遮罩檔案雜湊 ---
+
+_hash_memo = {}
+_lock = threading.Lock()
+
+def file_hash(path):
+    """
+    計算檔案內容的 SHA-256。以 (路徑, 大小, 修改時間) 記住結果，
+    檔案沒有變動時不會重新讀取。
+    """
+    st = os.stat(path)
+    memo_key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    with _lock:
+        digest = _hash_memo.get(memo_key)
+    if digest is not None:
+        return digest
+
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    digest = h.hexdigest()
+
+    with _lock:
+        _hash_memo[memo_key] = digest
+    return digest
+
+# --- 2. 縮放後遮罩快取 ---
+
+_entries = OrderedDict()
+_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+
+def _disk_path(cache_dir, key):
+    digest, (width, height), resample = key
+    return os.path.join(cache_dir, f"overlay_{digest[:16]}_{width}x{height}_{resample}.npy")
+
+def _load_from_disk(path, size):
+    try:
+        arr = np.load(path)
+    except (OSError, ValueError) as e:
+        print(f"❗ 遮罩快取損毀，重新縮放: {e}")
+        return None
+    if arr.shape != (size[1], size[0], 4) or arr.dtype != np.uint8:
+        return None
+    return Image.fromarray(arr)
+
+def _save_to_disk(path, img):
+    # 先寫到暫存檔再改名，避免多個程序同時寫入同一個快取檔時讀到不完整的內容
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, 'wb') as f:
+            np.save(f, np.asarray(img))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"❗ 無法寫入遮罩快取: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def get_resized_overlay(mask_path, target_size, resample=Image.Resampling.LANCZOS, cache_dir=None):
+    """
+    取得縮放到 target_size 的 RGBA 遮罩圖片，可直接交給 Image.alpha_composite 使用。
+
+    快取鍵為 (遮罩檔案雜湊, 目標尺寸, 重採樣濾鏡)：先查記憶體，再查磁碟，
+    都沒有時才開啟遮罩並執行 LANCZOS 縮放。回傳的圖片會被共用，請勿直接修改。
+
+    Args:
+        mask_path (str): 遮罩圖片路徑。
+        target_size (tuple): 目標尺寸 (寬, 高)。
+        resample (int): 重採樣濾鏡，預設為 LANCZOS。
+        cache_dir (str, optional): 磁碟快取資料夾，預設為 CACHE_DIR；傳入空字串則只用記憶體快取。
+    """
+    target_size = tuple(target_size)
+    key = (file_hash(mask_path), target_size, int(resample))
+    if cache_dir is None:
+        cache_dir = CACHE_DIR
+
+    with _lock:
+        img = _entries.get(key)
+        if img is not None:
+            _entries.move_to_end(key)
+            _stats['memory_hits'] += 1
+            return img
+
+    img = None
+    disk_path = _disk_path(cache_dir, key) if cache_dir else None
+    if disk_path and os.path.exists(disk_path):
+        img = _load_from_disk(disk_path, target_size)
+        if img is not None:
+            with _lock:
+                _stats['disk_hits'] += 1
+
+    if img is None:
+        with _lock:
+            _stats['misses'] += 1
+        img = load_image(mask_path, "RGBA").resize(target_size, resample)
+        if disk_path:
+            _save_to_disk(disk_path, img)
+
+    with _lock:
+        _entries[key] = img
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return img
+
+def cache_stats():
+    """回傳記憶體命中、磁碟命中與未命中次數。"""
+    with _lock:
+        return dict(_stats, entries=len(_entries))
@@ -0,0 +1,166 @@
+import numpy as np
+from collections import OrderedDict
+import os
+import threading
+
+import mask_cache
+from mask_engine import EDGE_OFFSET, to_mask_image
+
+# --- 全域配置 ---
+START_ANGLE_PIL = 270.0     # 甜甜圈從 12 點鐘方向開始 *逆時針* 生長
+ANGLE_UNITS = 65536         # 一圈 360 度量化為 uint16 的刻度數
+MAX_INDICES = 4             # 記憶體中最多保留幾組尺寸的極座標索引
+CACHE_DIR = None            # 若設定為資料夾路徑，索引會另存為 .npy 供下次直接載入
+
+# --- 1. 極座標索引 ---
+
+class PolarIndex:
+    """
+    固定畫布尺寸與起始角度下，每個像素的「逆時針角度偏移」與「半徑」。
+
+    angle: uint16 陣列，像素相對於 start_angle 逆時針方向的角度 (0 ~ 65535 對應 0 ~ 360 度)。
+    radius: float32 陣列，像素中心到圓心的距離。
+    有了這兩張表，任何分數的扇形遮罩都只需要一次向量化比較，不需要重新繪製幾何圖形。
+    """
+
+    def __init__(self, width, height, start_angle, angle, radius):
+        self.width = width
+        self.height = height
+        self.start_angle = start_angle
+        self.angle = angle
+        self.radius = radius
+
+    @staticmethod
+    def threshold(offset_degree):
+        """將角度偏移 (度) 轉為 angle 陣列的門檻值。"""
+        return int(round(offset_degree / 360.0 * ANGLE_UNITS))
+
+    def ring(self, R, r):
+        """圓環範圍 (r < 半徑 <= R)，邊界與 ImageDraw.ellipse 對齊。"""
+        return (self.radius <= R + EDGE_OFFSET) & (self.radius > r + EDGE_OFFSET)
+
+    def sector(self, start_offset, end_offset):
+        """
+        逆時針角度偏移介於 [start_offset, end_offset) 的像素 (單位: 度，可跨越 360)。
+        """
+        t0 = self.threshold(start_offset)
+        span = self.threshold(end_offset) - t0
+        if span >= ANGLE_UNITS:
+            return np.ones((self.height, self.width), dtype=bool)
+        if span <= 0:
+            return np.zeros((self.height, self.width), dtype=bool)
+        t0 %= ANGLE_UNITS
+        t1 = t0 + span
+        if t1 <= ANGLE_UNITS:
+            return (self.angle >= t0) & (self.angle < t1)
+        return (self.angle >= t0) | (self.angle < t1 - ANGLE_UNITS)
+
+    def sector_mask(self, R, r, start_offset, end_offset):
+        """扇形圓環的 uint8 遮罩 (255 = 保留)。"""
+        inside = self.sector(start_offset, end_offset) & self.ring(R, r)
+        return inside.view(np.uint8) * np.uint8(255)
+
+def build_polar_window(width, height, box, start_angle=START_ANGLE_PIL):
+    """
+    只計算畫布中 box = (left, top, right, bottom) 範圍的極座標索引 (圓心仍為整張畫布的中心)，
+    分塊渲染大尺寸圖片時使用。回傳的 PolarIndex 尺寸為 box 的大小。
+    """
+    left, top, right, bottom = box
+    cx, cy = width // 2, height // 2
+    dx = (np.arange(left, right, dtype=np.float32) - cx)[np.newaxis, :]
+    dy = (np.arange(top, bottom, dtype=np.float32) - cy)[:, np.newaxis]
+
+    radius = np.hypot(dx, dy)
+    # PIL 角度 θ 為順時針，逆時針偏移 = (start - θ) mod 360
+    pil_angle = np.degrees(np.arctan2(dy, dx))
+    offset = (np.float32(start_angle) - pil_angle) % np.float32(360.0)
+    angle = np.floor(offset * np.float32(ANGLE_UNITS / 360.0)).astype(np.int64)
+    angle = np.minimum(angle, ANGLE_UNITS - 1).astype(np.uint16)
+    return PolarIndex(right - left, bottom - top, start_angle, angle, radius)
+
+def build_polar_index(width, height, start_angle=START_ANGLE_PIL):
+    """計算指定尺寸的極座標索引 (不經過快取)。"""
+    return build_polar_window(width, height, (0, 0, width, height), start_angle)
+
+# --- 2. 記憶體 / 磁碟快取 ---
+
+_indices = OrderedDict()
+_lock = threading.Lock()
+
+def _disk_paths(cache_dir, width, height, start_angle):
+    stem = f"polar_{width}x{height}_{start_angle:g}"
+    return (os.path.join(cache_dir, f"{stem}_angle.npy"),
+            os.path.join(cache_dir, f"{stem}_radius.npy"))
+
+def _load_or_build(width, height, start_angle, cache_dir):
+    if cache_dir:
+        angle_path, radius_path = _disk_paths(cache_dir, width, height, start_angle)
+        if os.path.exists(angle_path) and os.path.exists(radius_path):
+            try:
+                angle = np.load(angle_path, mmap_mode='r')
+                radius = np.load(radius_path, mmap_mode='r')
+                if angle.shape == (height, width) and radius.shape == (height, width):
+                    return PolarIndex(width, height, start_angle, angle, radius)
+            except (OSError, ValueError) as e:
+                print(f"❗ 極座標索引快取損毀，重新計算: {e}")
+
+    index = build_polar_index(width, height, start_angle)
+
+    if cache_dir:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            angle_path, radius_path = _disk_paths(cache_dir, width, height, start_angle)
+            np.save(angle_path, index.angle)
+            np.save(radius_path, index.radius)
+        except OSError as e:
+            print(f"❗ 無法寫入極座標索引快取: {e}")
+    return index
+
+def get_polar_index(width, height, start_angle=START_ANGLE_PIL, cache_dir=None):
+    """
+    取得 (或建立並快取) 指定尺寸的極座標索引。
+
+    Args:
+        width, height (int): 畫布尺寸。
+        start_angle (float): 起始角度 (PIL 角度定義)。
+        cache_dir (str, optional): 磁碟快取資料夾，預設使用模組設定 CACHE_DIR。
+    """
+    key = (width, height, float(start_angle))
+    with _lock:
+        index = _indices.get(key)
+        if index is not None:
+            _indices.move_to_end(key)
+            return index
+
+    index = _load_or_build(width, height, float(start_angle), cache_dir or CACHE_DIR)
+
+    with _lock:
+        _indices[key] = index
+        while len(_indices) > MAX_INDICES:
+            _indices.popitem(last=False)
+    return index
+
+# --- 3. 給裁切函數使用的扇形遮罩 ---
+
+def get_offset_sector_mask(width, height, R, inner_ratio, start_offset, end_offset,
+                           start_angle=START_ANGLE_PIL):
+    """
+    以「從 start_angle 逆時針量起的角度偏移」描述扇形，回傳 'L' 模式遮罩。
+
+    例如已完成部分為 (0, filled_degree)，剩餘部分為 (filled_degree, 360)。
+    一般模式直接用極座標索引做門檻比較；若 mask_cache 開啟了抗鋸齒，
+    則改用 mask_engine 的解析式抗鋸齒遮罩 (同樣經過 LRU 快取)。
+    """
+    r = int(R * inner_ratio)
+    if end_offset <= start_offset:
+        return mask_cache.get_sector_mask(width, height, R, inner_ratio, None, None)
+
+    if mask_cache.antialias_enabled():
+        if end_offset - start_offset >= 360:
+            return mask_cache.get_donut_mask(width, height, R, inner_ratio)
+        # 逆時針的 [start, end) 等同 PIL pieslice 由 (start_angle - end) 順時針畫到 (start_angle - start)
+        return mask_cache.get_sector_mask(width, height, R, inner_ratio,
+                                          start_angle - end_offset, start_angle - start_offset)
+
+    index = get_polar_index(width, height, start_angle)
+    return to_mask_image(index.sector_mask(R, r, start_offset, end_offset))
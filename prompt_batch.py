@@ -0,0 +1,411 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+import generate_prompt
+from generate_prompt import build_prompt_request, save_prompts_to_files, MODEL_NAME, TEMPERATURE
+import prompt_cache
+from prompt_cache import cache_key, template_hash
+import tracing
+
+# google.genai 只在使用 GeminiBackend 時才匯入；StubBackend / StubServer 只需要標準函式庫
+
+# --- 全域配置 ---
+MAX_CONCURRENCY = 4         # 同時進行中的請求數上限
+RATE_PER_SECOND = 2.0       # Token bucket 每秒補充的請求數
+BURST = 4                   # Token bucket 容量 (允許瞬間送出的請求數)
+MAX_RETRIES = 5             # 429 / 5xx 最多重試次數
+BASE_DELAY = 0.5            # 指數退避的起始等待時間 (秒)
+MAX_DELAY = 16.0            # 單次等待時間上限 (秒)
+
+STUB_HOST = '127.0.0.1'
+STUB_PORT = 50516
+STUB_LATENCY = 0.2          # 替身伺服器每個請求的平均延遲 (秒)
+STUB_ERROR_RATE = 0.1       # 替身伺服器回傳 429 / 503 的機率
+
+# --- 1. 錯誤分類與重試 ---
+
+class BackendError(Exception):
+    """後端回傳的錯誤；status 為 HTTP 狀態碼 (連線錯誤時為 None)。"""
+
+    def __init__(self, message, status=None, retryable=None):
+        super().__init__(message)
+        self.status = status
+        self._retryable = retryable
+
+    @property
+    def retryable(self):
+        """429 (超過配額) 與 5xx (伺服器錯誤) 可以重試；連線中斷也視為暫時性錯誤。"""
+        if self._retryable is not None:
+            return self._retryable
+        return self.status is None or self.status == 429 or self.status >= 500
+
+def backoff_delay(attempt, base_delay=BASE_DELAY, max_delay=MAX_DELAY):
+    """Full jitter：在 [0, min(max_delay, base_delay * 2^attempt)] 之間隨機等待，避免所有請求同時重試。"""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+class TokenBucket:
+    """
+    非同步 token bucket：每秒補充 rate 個 token，最多累積 capacity 個。
+    每個請求 (包含重試) 送出前取得一個 token，限制整體的請求速率。
+    """
+
+    def __init__(self, rate=RATE_PER_SECOND, capacity=BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+# --- 2. 後端 ---
+
+def parse_prompts(text):
+    """將後端回傳的 JSON 文字轉為 Prompt dict；格式錯誤時回傳與 generate_sdxl_prompts 相同的 Error dict。"""
+    try:
+        prompts = json.loads(text)
+    except json.JSONDecodeError:
+        return {"Error": "JSON 解析錯誤：模型輸出非標準 JSON。", "Note": f"模型的原始輸出為: {text[:200]}..."}
+    if not isinstance(prompts, dict) or 'Positive_Prompt' not in prompts:
+        return {"Error": "模型輸出缺少 Positive_Prompt。", "Note": f"模型的原始輸出為: {text[:200]}..."}
+    return prompts
+
+class GeminiBackend:
+    """以 google.genai 的非同步介面 (client.aio) 呼叫 Gemini。"""
+
+    def __init__(self, client=None, model=MODEL_NAME, temperature=TEMPERATURE):
+        self.client = client
+        self.model = model
+        self.temperature = temperature
+
+    async def generate(self, request_text):
+        import google.genai as genai
+        from google.genai.errors import APIError
+
+        # 客戶端在第一個未命中快取的請求才初始化，全部命中快取時不需要 API 金鑰
+        if self.client is None:
+            if not generate_prompt.client and not generate_prompt.initialize_gemini_client():
+                raise BackendError("Gemini API 客戶端未初始化。", retryable=False)
+            self.client = generate_prompt.client
+
+        try:
+            response = await self.client.aio.models.generate_content(
+                model=self.model,
+                contents=[{'role': 'user', 'parts': [{'text': request_text}]}],
+                config=genai.types.GenerateContentConfig(
+                    temperature=self.temperature,
+                    response_mime_type="application/json"
+                )
+            )
+        except APIError as e:
+            raise BackendError(f"Gemini API 錯誤：{e}", getattr(e, 'code', None)) from e
+        return response.text
+
+class StubBackend:
+    """連線到本機替身伺服器 (StubServer) 的後端，用於測試與壓力測試，不需要 API 金鑰。"""
+
+    model = 'stub'          # 快取鍵的一部分，避免替身的結果與 Gemini 的結果混用
+    temperature = 0.0
+
+    def __init__(self, host=STUB_HOST, port=STUB_PORT):
+        self.host = host
+        self.port = port
+
+    async def generate(self, request_text):
+        body = json.dumps({'text': request_text}).encode('utf-8')
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except OSError as e:
+            raise BackendError(f"無法連線到替身伺服器: {e}") from e
+        try:
+            writer.write(
+                f"POST /generate HTTP/1.1\r\nHost: {self.host}\r\nContent-Type: application/json\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('ascii') + body)
+            await writer.drain()
+            status_line = await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            payload = (await reader.readexactly(length)).decode('utf-8')
+        except (OSError, asyncio.IncompleteReadError) as e:
+            raise BackendError(f"替身伺服器連線中斷: {e}") from e
+        finally:
+            writer.close()
+
+        parts = status_line.decode('latin-1').split()
+        status = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+        if status != 200:
+            raise BackendError(f"替身伺服器回傳 {status}: {payload[:100]}", status)
+        return payload
+
+# --- 3. 本機替身伺服器 ---
+
+class StubServer:
+    """
+    模擬 Gemini 的最小 HTTP 伺服器：每個請求等待約 latency 秒 (±50% 隨機)，
+    以 error_rate 的機率回傳 429 或 503，其餘回傳固定格式的 Prompt JSON。
+    """
+
+    def __init__(self, host=STUB_HOST, port=STUB_PORT, latency=STUB_LATENCY, error_rate=STUB_ERROR_RATE, seed=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.error_rate = error_rate
+        self.stats = {'requests': 0, 'errors': 0}
+        self._random = random.Random(seed)
+        self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            await reader.readline()
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    length = int(value)
+            request = json.loads(await reader.readexactly(length))
+            self.stats['requests'] += 1
+
+            await asyncio.sleep(self.latency * self._random.uniform(0.5, 1.5))
+            if self._random.random() < self.error_rate:
+                self.stats['errors'] += 1
+                status, reason = self._random.choice(((429, 'Too Many Requests'), (503, 'Service Unavailable')))
+                body = json.dumps({'error': reason})
+            else:
+                status, reason = 200, 'OK'
+                body = json.dumps(stub_prompts(request.get('text', '')))
+
+            data = body.encode('utf-8')
+            writer.write(f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode('ascii') + data)
+            await writer.drain()
+        except (OSError, ValueError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]   # port=0 時取得實際分配的連接埠
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"✅ 替身伺服器已啟動: {self.host}:{self.port} (延遲 {self.latency}s，錯誤率 {self.error_rate:.0%})")
+        async with self._server:
+            await self._server.serve_forever()
+
+def stub_prompts(request_text):
+    """依請求中的任務描述產生固定格式的 Prompt。"""
+    marker = "Task Description: '"
+    start = request_text.find(marker)
+    description = request_text[start + len(marker):].split("'\n", 1)[0] if start >= 0 else request_text[:40]
+    return {
+        'Positive_Prompt': f"Flat Vector Illustration style, a stylized icon representing {description}, "
+                           f"deep blue and cyan palette, smooth shading, white background",
+        'Negative_Prompt': "person, people, human, animal, blurry, deformed, 3D render, photorealistic",
+    }
+
+# --- 4. 批次生成 ---
+
+async def generate_one(backend, task_description, bucket, semaphore, max_retries=MAX_RETRIES, stats=None,
+                       cache=None, system_hash=None, refresh=False):
+    """
+    生成單一任務的 Prompt：先查 SQLite 快取 (prompt_cache.py)，未命中時在並行上限內送出請求，
+    429 / 5xx 以 jittered backoff 重試，成功的結果寫回快取。
+
+    Returns:
+        dict: Prompt dict，失敗時為含 'Error' 的 dict (與 generate_sdxl_prompts 相同)。
+    """
+    key = None
+    if cache is not None:
+        key = cache_key(backend.model, backend.temperature, system_hash, task_description)
+        cached = None if refresh else cache.get(key)
+        if cached is not None:
+            if stats is not None:
+                stats['cached'] += 1
+            return cached
+
+    request_text = build_prompt_request(task_description)
+    for attempt in range(max_retries + 1):
+        await bucket.acquire()
+        try:
+            async with semaphore:
+                with tracing.span('prompt_request', attempt=attempt, model=backend.model):
+                    text = await backend.generate(request_text)
+            prompts = parse_prompts(text)
+            if key is not None and "Error" not in prompts:
+                cache.put(key, prompts, backend.model, backend.temperature, task_description)
+            return prompts
+        except BackendError as e:
+            if not e.retryable or attempt == max_retries:
+                return {"Error": str(e), "Note": f"已嘗試 {attempt + 1} 次。"}
+            if stats is not None:
+                stats['retries'] += 1
+            await asyncio.sleep(backoff_delay(attempt))
+        except Exception as e:
+            return {"Error": f"生成或連線發生未預期錯誤：{e}", "Note": "請檢查網路連線或其他設定。"}
+
+async def generate_prompts_async(jobs, backend, concurrency=MAX_CONCURRENCY, rate=RATE_PER_SECOND,
+                                 burst=BURST, max_retries=MAX_RETRIES, save=True, cache=None, refresh=False):
+    """
+    並行生成多個任務的 Prompt，成功的結果以 save_prompts_to_files 寫入 prompt/ 資料夾。
+
+    Args:
+        jobs (list): (任務名稱, 任務描述) 列表。
+        backend: 具有 async generate(request_text) -> str 的後端 (GeminiBackend / StubBackend)。
+        concurrency (int): 同時進行中的請求數上限。
+        rate (float): 每秒最多送出的請求數 (包含重試)。
+        burst (int): 允許瞬間送出的請求數。
+        cache (PromptCache, optional): 預設為 prompt_cache 的共用快取 (prompt_cache.ENABLED=False 時不使用)。
+        refresh (bool): 略過快取重新生成 (結果仍會寫回快取)。
+
+    Returns:
+        tuple: ({任務名稱: Prompt dict}, 統計 dict)
+    """
+    bucket = TokenBucket(rate, burst)
+    semaphore = asyncio.Semaphore(concurrency)
+    if cache is None and prompt_cache.ENABLED:
+        cache = prompt_cache.default_cache()
+    system_hash = template_hash() if cache is not None else None
+    stats = {'tasks': len(jobs), 'succeeded': 0, 'failed': 0, 'retries': 0, 'cached': 0}
+    t0 = time.perf_counter()
+
+    async def run(name, description):
+        with tracing.span('prompt', task=name):
+            prompts = await generate_one(backend, description, bucket, semaphore, max_retries, stats,
+                                         cache, system_hash, refresh)
+        if "Error" in prompts:
+            print(f"❌ {name}: {prompts['Error']}")
+            stats['failed'] += 1
+        else:
+            if save and not save_prompts_to_files(prompts, name):
+                prompts = {"Error": "儲存檔案失敗", "Note": name}
+                stats['failed'] += 1
+            else:
+                stats['succeeded'] += 1
+        return name, prompts
+
+    results = dict(await asyncio.gather(*(run(name, description) for name, description in jobs)))
+    stats['elapsed'] = time.perf_counter() - t0
+    return results, stats
+
+def generate_prompts_batch(jobs, backend=None, **options):
+    """generate_prompts_async 的同步版本；backend 預設為 Gemini。"""
+    return asyncio.run(generate_prompts_async(jobs, backend or GeminiBackend(), **options))
+
+async def run_with_stub(jobs, latency=STUB_LATENCY, error_rate=STUB_ERROR_RATE, seed=None, **options):
+    """在同一個事件迴圈中啟動替身伺服器 (隨機連接埠) 並執行批次，結束後關閉伺服器。"""
+    server = await StubServer(port=0, latency=latency, error_rate=error_rate, seed=seed).start()
+    try:
+        return await generate_prompts_async(jobs, StubBackend(server.host, server.port), **options)
+    finally:
+        await server.stop()
+
+# --- 5. 命令列 ---
+
+def task_jobs(tasks=(), descriptions=()):
+    """
+    組合 (任務名稱, 任務描述) 列表：任務 ID 的描述取自 json/task/<task>/input.json，
+    直接給定的描述則以時間戳記命名 (同一批多筆時加上序號避免重名)。
+    """
+    jobs = []
+    for task in tasks:
+        try:
+            with open(os.path.join('json', 'task', task, 'input.json'), 'r', encoding='utf-8') as f:
+                jobs.append((task, json.load(f)['description']))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"❌ 無法讀取 {task} 的任務描述: {e}")
+    for i, description in enumerate(descriptions):
+        name = generate_prompt.generate_timestamp_name(description)
+        jobs.append((f"{name}_{i:02d}" if len(descriptions) > 1 else name, description))
+    return jobs
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以 asyncio 並行生成多個任務的 SDXL Prompt。")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help="批次生成 Prompt")
+    run.add_argument('tasks', nargs='*', help="任務 ID (描述取自 json/task/<task>/input.json)")
+    run.add_argument('-d', '--description', action='append', default=[], help="直接給定任務描述 (可重複)")
+    run.add_argument('--concurrency', type=int, default=MAX_CONCURRENCY, help="同時進行中的請求數上限")
+    run.add_argument('--rate', type=float, default=RATE_PER_SECOND, help="每秒最多送出的請求數")
+    run.add_argument('--burst', type=int, default=BURST, help="允許瞬間送出的請求數")
+    run.add_argument('--retries', type=int, default=MAX_RETRIES, help="429 / 5xx 最多重試次數")
+    run.add_argument('--stub', action='store_true', help="使用程序內的替身伺服器 (不呼叫 Gemini)")
+    run.add_argument('--stub-address', help="使用已啟動的替身伺服器，格式 host:port")
+    run.add_argument('--latency', type=float, default=STUB_LATENCY, help="替身伺服器延遲 (秒)")
+    run.add_argument('--error-rate', type=float, default=STUB_ERROR_RATE, help="替身伺服器錯誤率")
+    run.add_argument('--no-save', action='store_true', help="不寫入 prompt/ 資料夾 (壓力測試用)")
+    run.add_argument('--refresh', action='store_true', help="略過快取，重新生成並覆寫快取")
+    run.add_argument('--no-cache', action='store_true', help="完全不使用快取 (壓力測試用)")
+
+    stub = sub.add_parser('stub-server', help="啟動本機替身伺服器")
+    stub.add_argument('--port', type=int, default=STUB_PORT)
+    stub.add_argument('--latency', type=float, default=STUB_LATENCY)
+    stub.add_argument('--error-rate', type=float, default=STUB_ERROR_RATE)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    # 用法:
+    #   python prompt_batch.py run task_A task_B -d "寫演算法程式作業" --concurrency 8
+    #   python prompt_batch.py run -d a -d b -d c --stub --latency 0.5 --error-rate 0.2 --no-save
+    #   python prompt_batch.py stub-server --port 50516
+    args = parse_args()
+
+    if args.command == 'stub-server':
+        try:
+            asyncio.run(StubServer(port=args.port, latency=args.latency, error_rate=args.error_rate).serve_forever())
+        except KeyboardInterrupt:
+            pass
+        sys.exit(0)
+
+    jobs = task_jobs(args.tasks, args.description)
+    if not jobs:
+        print("❌ 請指定任務 ID 或 --description")
+        sys.exit(1)
+
+    if args.no_cache:
+        prompt_cache.ENABLED = False
+    options = dict(concurrency=args.concurrency, rate=args.rate, burst=args.burst,
+                   max_retries=args.retries, save=not args.no_save, refresh=args.refresh)
+    if args.stub:
+        results, stats = asyncio.run(run_with_stub(jobs, args.latency, args.error_rate, **options))
+    elif args.stub_address:
+        host, _, port = args.stub_address.rpartition(':')
+        results, stats = generate_prompts_batch(jobs, StubBackend(host or STUB_HOST, int(port)), **options)
+    else:
+        results, stats = generate_prompts_batch(jobs, **options)
+
+    print(f"\n--- 完成 {stats['succeeded']} / {stats['tasks']} (快取 {stats['cached']})，失敗 {stats['failed']}，"
+          f"重試 {stats['retries']} 次，耗時 {stats['elapsed']:.2f} 秒 "
+          f"({stats['tasks'] / stats['elapsed']:.1f} 個/秒) ---")
+    sys.exit(0 if stats['failed'] == 0 else 1)
@@ -0,0 +1,176 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+# --- 全域配置 ---
+CACHE_PATH = os.path.join('.cache', 'prompt_cache.sqlite3')
+TTL_SECONDS = 30 * 24 * 3600    # 快取有效期限 (30 天)；None 表示永不過期
+MAX_ENTRIES = 2000              # 最多保留幾筆 (超過時刪除最久未使用的)
+ENABLED = True                  # generate_sdxl_prompts / prompt_batch 是否使用快取
+
+# --- 1. 快取鍵 ---
+
+def normalize_description(task_description):
+    """
+    正規化任務描述：NFKC (全形轉半形)、去除頭尾空白、連續空白合併為一個、英文字母轉小寫。
+    讓「寫演算法程式作業」與「 寫演算法程式作業 」等只差在空白或全半形的描述共用同一筆快取。
+    """
+    text = unicodedata.normalize('NFKC', task_description)
+    return ' '.join(text.split()).casefold()
+
+def template_hash():
+    """Prompt 範本 (系統提示 + 用戶請求格式) 的雜湊；修改範本後舊的快取自動失效。"""
+    from generate_prompt import build_prompt_request
+    return hashlib.sha256(build_prompt_request('\0').encode('utf-8')).hexdigest()
+
+def cache_key(model, temperature, system_hash, task_description):
+    """(模型名稱, 溫度, 範本雜湊, 正規化後的任務描述) 的 SHA-256。"""
+    h = hashlib.sha256()
+    for part in (model, repr(float(temperature)), system_hash, normalize_description(task_description)):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+# --- 2. SQLite 快取 ---
+
+class PromptCache:
+    """
+    Gemini 回應 (Positive / Negative Prompt dict) 的 SQLite 快取。
+
+    每筆記錄包含建立時間與最後使用時間：超過 ttl 秒的記錄視為過期，
+    寫入後若超過 max_entries 筆則刪除最久未使用的記錄。
+    命中 / 未命中次數同時記錄在資料庫中 (跨程序累計) 與實例中 (本次執行)。
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=TTL_SECONDS, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._session = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0}
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS prompts ("
+            " key TEXT PRIMARY KEY, model TEXT, temperature REAL, description TEXT,"
+            " response TEXT NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL,"
+            " hits INTEGER NOT NULL DEFAULT 0)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS prompts_last_used ON prompts (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def _count(self, name, n=1):
+        self._session[name] += n
+        self._conn.execute(
+            "INSERT INTO counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value", (name, n))
+
+    def get(self, key):
+        """回傳快取的 Prompt dict；不存在或已過期時回傳 None。"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM prompts WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM prompts WHERE key = ?", (key,))
+                self._count('expired')
+                row = None
+            if row is None:
+                self._count('misses')
+                return None
+            self._conn.execute("UPDATE prompts SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+            self._count('hits')
+        try:
+            return json.loads(row[0])
+        except ValueError:
+            return None
+
+    def put(self, key, prompts, model=None, temperature=None, description=None):
+        """寫入一筆成功的回應 (含 'Error' 的結果不應寫入)。"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO prompts (key, model, temperature, description, response, created, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, temperature, description, json.dumps(prompts, ensure_ascii=False), now, now))
+        self.evict()
+
+    def evict(self):
+        """刪除過期的記錄，再刪除最久未使用的記錄直到不超過 max_entries，回傳刪除的數量。"""
+        removed = 0
+        with self._lock:
+            if self.ttl is not None:
+                removed += self._conn.execute(
+                    "DELETE FROM prompts WHERE created < ?", (time.time() - self.ttl,)).rowcount
+            excess = self._conn.execute("SELECT COUNT(*) FROM prompts").fetchone()[0] - self.max_entries
+            if excess > 0:
+                removed += self._conn.execute(
+                    "DELETE FROM prompts WHERE key IN (SELECT key FROM prompts ORDER BY last_used LIMIT ?)",
+                    (excess,)).rowcount
+            if removed:
+                self._count('evicted', removed)
+        return removed
+
+    def stats(self):
+        """回傳本次執行與累計的命中 / 未命中次數，以及目前的記錄數。"""
+        with self._lock:
+            totals = dict(self._conn.execute("SELECT name, value FROM counters").fetchall())
+            entries = self._conn.execute("SELECT COUNT(*) FROM prompts").fetchone()[0]
+            session = dict(self._session)
+        lookups = totals.get('hits', 0) + totals.get('misses', 0)
+        return {
+            'entries': entries,
+            'session': session,
+            'total': {name: totals.get(name, 0) for name in ('hits', 'misses', 'expired', 'evicted')},
+            'hit_rate': totals.get('hits', 0) / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM prompts")
+            self._conn.execute("DELETE FROM counters")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+_default_cache = None
+_default_lock = threading.Lock()
+
+def default_cache():
+    """模組共用的快取實例。"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None:
+            _default_cache = PromptCache()
+        return _default_cache
+
+# --- 3. 命令列 ---
+
+if __name__ == "__main__":
+    # 用法: python prompt_cache.py stats | clear | prune
+    parser = argparse.ArgumentParser(description="Gemini Prompt 回應快取 (SQLite)。")
+    parser.add_argument('command', choices=['stats', 'clear', 'prune'])
+    parser.add_argument('--path', default=CACHE_PATH, help="快取資料庫路徑")
+    args = parser.parse_args()
+
+    cache = PromptCache(args.path)
+    if args.command == 'stats':
+        stats = cache.stats()
+        total = stats['total']
+        print(f"📦 快取記錄: {stats['entries']} 筆 ({args.path})")
+        print(f"   命中 {total['hits']} / 未命中 {total['misses']} (命中率 {stats['hit_rate']:.1%})，"
+              f"過期 {total['expired']}，刪除 {total['evicted']}")
+    elif args.command == 'clear':
+        cache.clear()
+        print("✅ 已清除所有快取記錄。")
+    else:
+        print(f"✅ 已刪除 {cache.evict()} 筆過期或超量的記錄。")
+    cache.close()
@@ -0,0 +1,283 @@
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+# torch 只在真正計算 / 讀取向量時才匯入，與 generate_image.py 相同
+
+# --- 全域配置 ---
+CACHE_DIR = os.path.join('.cache', 'prompt_embeds')
+MAX_DISK_ENTRIES = 512      # 磁碟上最多保留幾組向量 (超過時刪除最久未使用的檔案)
+MAX_MEMORY_ENTRIES = 32     # 記憶體中最多保留幾組向量
+ENABLED = True              # generate_image 是否使用快取
+
+# 模型指紋只讀取這些小型設定檔；權重檔只取 (大小, 修改時間)，不讀取內容
+_FINGERPRINT_FILES = (
+    'model_index.json',
+    os.path.join('text_encoder', 'config.json'),
+    os.path.join('text_encoder_2', 'config.json'),
+    os.path.join('tokenizer', 'vocab.json'),
+    os.path.join('tokenizer_2', 'vocab.json'),
+)
+_WEIGHT_DIRS = ('text_encoder', 'text_encoder_2')
+
+# --- 1. 快取鍵 ---
+
+_fingerprints = {}
+_lock = threading.Lock()
+
+def model_fingerprint(model_path):
+    """
+    模型的雜湊值：文字編碼器相關設定檔的內容 + 權重檔的大小與修改時間。
+    同一個程序中每個路徑只計算一次。
+    """
+    model_path = os.path.abspath(model_path)
+    with _lock:
+        digest = _fingerprints.get(model_path)
+    if digest is not None:
+        return digest
+
+    h = hashlib.sha256()
+    for name in _FINGERPRINT_FILES:
+        path = os.path.join(model_path, name)
+        if os.path.exists(path):
+            h.update(name.encode('utf-8'))
+            with open(path, 'rb') as f:
+                h.update(f.read())
+    for folder in _WEIGHT_DIRS:
+        folder_path = os.path.join(model_path, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        for name in sorted(os.listdir(folder_path)):
+            if name.endswith(('.safetensors', '.bin')):
+                st = os.stat(os.path.join(folder_path, name))
+                h.update(f"{folder}/{name}:{st.st_size}:{st.st_mtime_ns}".encode('utf-8'))
+    digest = h.hexdigest()
+
+    with _lock:
+        _fingerprints[model_path] = digest
+    return digest
+
+def pipeline_model_path(pipe):
+    """從已載入的模型取得來源路徑 (from_pretrained 的參數)。"""
+    return getattr(pipe, 'name_or_path', None) or pipe.config._name_or_path
+
+def encoder_name(pipe):
+    """描述產生向量的文字編碼器組合，例如 'CLIPTextModel+CLIPTextModelWithProjection'。"""
+    names = [type(encoder).__name__ for encoder in (pipe.text_encoder, pipe.text_encoder_2) if encoder is not None]
+    return '+'.join(names)
+
+def cache_key(model_hash, prompt_text, encoder):
+    """(模型雜湊, Prompt 文字, 編碼器) 的 SHA-256。"""
+    h = hashlib.sha256()
+    for part in (model_hash, encoder, prompt_text):
+        h.update(part.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+# --- 2. 記憶體 + 磁碟 LRU 快取 ---
+
+class PromptEmbedCache:
+    """
+    SDXL 文字編碼結果 (prompt_embeds, pooled_prompt_embeds) 的快取。
+
+    先查記憶體，再查磁碟 (.pt 檔)，都沒有時才執行兩個文字編碼器。
+    磁碟上的檔案以修改時間記錄最後使用時間：命中時更新，超過 max_disk_entries 時刪除最舊的檔案。
+    向量一律以 CPU 張量儲存，使用時才搬到模型所在的裝置。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_disk_entries=MAX_DISK_ENTRIES,
+                 max_memory_entries=MAX_MEMORY_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_disk_entries = max_disk_entries
+        self.max_memory_entries = max_memory_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evicted': 0}
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pt")
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_memory_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key):
+        import torch
+
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            data = torch.load(path, map_location='cpu', weights_only=True)
+            value = (data['prompt_embeds'], data['pooled_prompt_embeds'])
+        except Exception as e:
+            print(f"❗ Prompt 向量快取損毀，重新計算: {e}")
+            return None
+        try:
+            os.utime(path)   # 更新最後使用時間
+        except OSError:
+            pass
+        return value
+
+    def _save(self, key, value):
+        import torch
+
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            torch.save({'prompt_embeds': value[0], 'pooled_prompt_embeds': value[1]}, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"❗ 無法寫入 Prompt 向量快取: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """刪除最久未使用的檔案，直到數量不超過 max_disk_entries，回傳刪除的數量。"""
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        files = []
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if name.endswith('.pt'):
+                    path = os.path.join(root, name)
+                    try:
+                        files.append((os.stat(path).st_mtime_ns, path))
+                    except OSError:
+                        pass
+        excess = len(files) - self.max_disk_entries
+        if excess <= 0:
+            return 0
+        files.sort()
+        removed = 0
+        for _, path in files[:excess]:
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._stats['evicted'] += removed
+        return removed
+
+    def get(self, pipe, prompt_text, model_hash=None):
+        """
+        取得單一 Prompt 的 (prompt_embeds, pooled_prompt_embeds)，形狀為 (1, 77, 2048) 與 (1, 1280)。
+
+        Args:
+            pipe: 已載入的 StableDiffusionXLPipeline。
+            prompt_text (str): Prompt 文字。
+            model_hash (str, optional): 模型雜湊，預設由模型路徑計算。
+        """
+        if model_hash is None:
+            model_hash = model_fingerprint(pipeline_model_path(pipe))
+        key = cache_key(model_hash, prompt_text, encoder_name(pipe))
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return value
+
+        value = self._load(key) if self.cache_dir else None
+        if value is not None:
+            with self._lock:
+                self._stats['disk_hits'] += 1
+        else:
+            with self._lock:
+                self._stats['misses'] += 1
+            value = encode_text(pipe, prompt_text)
+            if self.cache_dir:
+                self._save(key, value)
+
+        self._remember(key, value)
+        return value
+
+    def stats(self):
+        """回傳記憶體命中、磁碟命中、未命中與刪除的次數。"""
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+# --- 3. 文字編碼 ---
+
+def encode_text(pipe, prompt_text):
+    """
+    以 SDXL 的兩個文字編碼器計算單一 Prompt 的向量 (不做 classifier-free guidance 的複製)。
+    Negative Prompt 在 SDXL 中走的是相同的編碼流程，因此同一段文字不論當作正面或負面都共用快取。
+
+    Returns:
+        tuple: (prompt_embeds, pooled_prompt_embeds)，皆為 CPU 張量。
+    """
+    import torch
+
+    with torch.no_grad():
+        prompt_embeds, _, pooled_prompt_embeds, _ = pipe.encode_prompt(
+            prompt=prompt_text,
+            device=pipe._execution_device,
+            num_images_per_prompt=1,
+            do_classifier_free_guidance=False,
+        )
+    return prompt_embeds.detach().cpu(), pooled_prompt_embeds.detach().cpu()
+
+def supports_embeddings(pipe):
+    """只有真正的 SDXL 模型 (有 encode_prompt 與兩個文字編碼器) 才使用向量快取。"""
+    return ENABLED and hasattr(pipe, 'encode_prompt') and getattr(pipe, 'text_encoder_2', None) is not None
+
+def prompt_embedding_kwargs(pipe, prompts, negatives, cache=None):
+    """
+    將一批 Prompt 轉為可直接交給 pipeline 的向量參數 (取代 prompt / negative_prompt)。
+
+    negatives 全部為 None 時不傳入 negative 向量，讓 pipeline 依 SDXL 的設定使用全零向量，
+    與直接傳入 negative_prompt=None 的結果相同。
+
+    Args:
+        prompts (list): 正面 Prompt 列表。
+        negatives (list): 對應的負面 Prompt 列表 (可為 None)。
+        cache (PromptEmbedCache, optional): 預設為模組共用的快取。
+
+    Returns:
+        dict: prompt_embeds、pooled_prompt_embeds (以及 negative_prompt_embeds、
+              negative_pooled_prompt_embeds)。
+    """
+    import torch
+
+    cache = cache or default_cache()
+    model_hash = model_fingerprint(pipeline_model_path(pipe))
+    device = pipe._execution_device
+    dtype = pipe.text_encoder_2.dtype
+
+    def stacked(texts):
+        pairs = [cache.get(pipe, text, model_hash) for text in texts]
+        embeds = torch.cat([p[0] for p in pairs]).to(device=device, dtype=dtype)
+        pooled = torch.cat([p[1] for p in pairs]).to(device=device, dtype=dtype)
+        return embeds, pooled
+
+    kwargs = {}
+    kwargs['prompt_embeds'], kwargs['pooled_prompt_embeds'] = stacked(prompts)
+    if any(negatives):
+        # 同一批中部分項目沒有 Negative Prompt 時，以空字串編碼 (與 pipeline 收到字串列表時相同)
+        kwargs['negative_prompt_embeds'], kwargs['negative_pooled_prompt_embeds'] = \
+            stacked([text or "" for text in negatives])
+    return kwargs
+
+_default_cache = None
+
+def default_cache():
+    """模組共用的快取實例。"""
+    global _default_cache
+    with _lock:
+        if _default_cache is None:
+            _default_cache = PromptEmbedCache()
+        return _default_cache
@@ -2,11 +2,28 @@ import math
 import json
 import os
 
+from tracing import traced
+
 TOPIC = "task_20251213_045454"
 
 INPUT_FILE = f'json\\task\\{TOPIC}\\input.json'
 OUTPUT_FILE = f'json\\task\\{TOPIC}\\output.json'
 
+# PLAN D 公式的參數預設值 (JSON 檔案中沒有該欄位時使用)；batch_score.py 共用同一組設定
+SCORE_DEFAULTS = {
+    'r': 30.0, 'T_est': 0.0, 'P': 0.0, 'I': 3.0, 'D': 3.0, 'c': 0.0, 'mu': 1.2,
+    'T_distract': 0.0, 'T_phone': 0.0,
+}
+SCORE_PARAMS = tuple(SCORE_DEFAULTS)
+
+# PLAN D 公式常數
+I_WEIGHT = 0.15             # 重要性 I 每高於基準 1 級的加成
+D_WEIGHT = 0.05             # 難度 D 每高於基準 1 級的加成
+LEVEL_BASE = 3              # I / D 的基準等級
+DISTRACT_PENALTY = -30.0    # 每小時分心的扣分
+PHONE_PENALTY = -6.0        # 每小時使用手機的扣分
+RESULT_DESCRIPTION = "PLAN D 甜甜圈計畫 評分模型計算結果"
+
 def calculate_plan_d_score(data):
     """
     Calculates the PLAN D score based on the Incentive and Penalty modules.
@@ -17,24 +34,24 @@ def calculate_plan_d_score(data):
     """
     try:
         # 讀取變數，若 JSON 檔案中沒有，則使用預設值
-        r = data.get('r', 30.0)
-        T_est = data.get('T_est', 0.0)
-        P = data.get('P', 0.0)
-        I = data.get('I', 3.0)
-        D = data.get('D', 3.0)
-        c = data.get('c', 0.0)
-        mu = data.get('mu', 1.2)
-        T_distract = data.get('T_distract', 0.0)
-        T_phone = data.get('T_phone', 0.0)
+        r = data.get('r', SCORE_DEFAULTS['r'])
+        T_est = data.get('T_est', SCORE_DEFAULTS['T_est'])
+        P = data.get('P', SCORE_DEFAULTS['P'])
+        I = data.get('I', SCORE_DEFAULTS['I'])
+        D = data.get('D', SCORE_DEFAULTS['D'])
+        c = data.get('c', SCORE_DEFAULTS['c'])
+        mu = data.get('mu', SCORE_DEFAULTS['mu'])
+        T_distract = data.get('T_distract', SCORE_DEFAULTS['T_distract'])
+        T_phone = data.get('T_phone', SCORE_DEFAULTS['T_phone'])
         
         # 1. 激勵加分模組 (S)
         incentive_S = r * T_est * P * \
-                      (1 + 0.15 * (I - 3)) * \
-                      (1 + 0.05 * (D - 3)) * \
+                      (1 + I_WEIGHT * (I - LEVEL_BASE)) * \
+                      (1 + D_WEIGHT * (D - LEVEL_BASE)) * \
                       (c ** mu)
         
         # 2. 扣分模組 (P_behavior)
-        penalty_P_behavior = (-30.0 * T_distract) + (-6.0 * T_phone)
+        penalty_P_behavior = (DISTRACT_PENALTY * T_distract) + (PHONE_PENALTY * T_phone)
         
         # 3. 總得分
         total_score = incentive_S + penalty_P_behavior
@@ -48,7 +65,7 @@ def calculate_plan_d_score(data):
                 "r": r, "T_est": T_est, "P": P, "I": I, "D": D, "c": c, "mu": mu, 
                 "T_distract": T_distract, "T_phone": T_phone
             },
-            "description": "PLAN D 甜甜圈計畫 評分模型計算結果"
+            "description": RESULT_DESCRIPTION
         }
         
         return output_results
@@ -77,16 +94,44 @@ def write_json(file_name, results):
         print(f"Error writing output file: {e}")
         return False
 
-# --- 主程式執行 ---
-data = read_json(INPUT_FILE)
+def task_score_paths(topic):
+    """Returns the (input.json, output.json) paths of a task."""
+    return (os.path.join('json', 'task', topic, 'input.json'),
+            os.path.join('json', 'task', topic, 'output.json'))
+
+@traced('score')
+def score_file(input_file, output_file, task=None):
+    """
+    Scores one input.json and writes the result to output_file. Returns True on success.
+    When task is given, the input and result are also stored in the task database (task_store.py).
+    """
+    data = read_json(input_file)
+
+    if "error" in data:
+        print(data["error"])
+        return False
 
-if "error" in data:
-    print(data["error"])
-else:
     results = calculate_plan_d_score(data)
     if "error" in results:
         print(results["error"])
-    else:
-        if write_json(OUTPUT_FILE, results):
-            print(f"計算完成。結果已寫入 '{OUTPUT_FILE}' (JSON 格式)。")
+        return False
 
+    store = None
+    if task is not None:
+        import task_store
+        store = task_store.default_store()
+
+    # Mirrored files are written before the database row, so the row's update time is never older than
+    # the file (TaskStore.scores treats a newer output.json as a sign that the row is stale).
+    if store is None or task_store.MIRROR_FILES:
+        if not write_json(output_file, results):
+            return False
+        print(f"計算完成。結果已寫入 '{output_file}' (JSON 格式)。")
+    if store is not None:
+        store.put(task, input=data, score=results)
+        print(f"計算完成。結果已寫入任務資料庫 ({task})。")
+    return True
+
+# --- 主程式執行 ---
+if __name__ == "__main__":
+    score_file(INPUT_FILE, OUTPUT_FILE)
@@ -0,0 +1,499 @@
+from concurrent.futures import Future
+from multiprocessing.connection import Listener, Client
+from multiprocessing import AuthenticationError
+import argparse
+import hashlib
+import os
+import queue
+import secrets
+import stat
+import threading
+import time
+
+from generate_image import (
+    load_pipeline, generate_images, read_prompt_file, task_prompt_paths,
+    SDXL_MODEL_PATH, NUM_INFERENCE_STEPS, GUIDANCE_SCALE, MAX_BATCH_SIZE,
+)
+
+# --- 全域配置 ---
+HOST = '127.0.0.1'          # 只接受本機連線
+PORT = 50515
+# 連線驗證金鑰：常駐程式第一次啟動時隨機產生，存成只有擁有者可讀的檔案，用戶端讀取同一個檔案。
+# Listener / Client 之間傳的是 pickle，金鑰外洩等於讓其他程序以常駐程式的身分執行任意程式碼。
+KEY_PATH = os.environ.get('SDXL_DAEMON_KEY_FILE', os.path.join('.cache', 'sdxl_daemon.key'))
+KEY_BYTES = 32
+CONNECT_TIMEOUT = 1.0       # 用戶端判斷常駐程式是否存在的等待時間 (秒)
+IDLE_TIMEOUT = None         # 若設定秒數，閒置超過此時間後自動結束並釋放模型
+BATCH_WINDOW = 0.05         # 取出第一個工作後，再等待多久收集同一批的工作 (秒)
+
+# --- 1. 連線金鑰 ---
+
+def _check_key_permissions(path):
+    """金鑰檔案必須只有擁有者可以讀寫 (Windows 沒有這種權限位元，略過檢查)。"""
+    if os.name != 'posix':
+        return
+    mode = os.stat(path).st_mode
+    if mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise PermissionError(f"連線金鑰 {path} 的權限為 {stat.filemode(mode)}，其他使用者可以讀取；"
+                              f"請執行 chmod 600 {path} 或刪除後重新啟動常駐程式")
+
+def load_authkey(path=KEY_PATH, create=False):
+    """
+    讀取常駐程式的連線金鑰。
+
+    Args:
+        path (str): 金鑰檔案路徑。
+        create (bool): 檔案不存在時以 secrets.token_bytes 產生新的金鑰 (權限 0600)；常駐程式啟動時使用。
+
+    Returns:
+        bytes: 金鑰；檔案不存在且 create=False 時回傳 None (表示常駐程式從未啟動過)。
+
+    Raises:
+        OSError: 無法建立或讀取金鑰、或金鑰檔案權限過寬。
+    """
+    if create and not os.path.exists(path):
+        key_dir = os.path.dirname(path)
+        if key_dir:
+            os.makedirs(key_dir, exist_ok=True)
+        try:
+            # O_EXCL：兩個常駐程式同時啟動時只有一個會寫入，另一個讀取已存在的金鑰
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            pass
+        else:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(secrets.token_bytes(KEY_BYTES))
+    try:
+        _check_key_permissions(path)
+        with open(path, 'rb') as f:
+            key = f.read()
+    except FileNotFoundError:
+        if create:
+            raise
+        return None
+    if len(key) < KEY_BYTES:
+        raise PermissionError(f"連線金鑰 {path} 內容不完整，請刪除後重新啟動常駐程式")
+    return key
+
+# --- 2. 工作定義 ---
+
+def make_job(output_path, prompt=None, prompt_file=None, negative=None, negative_file=None,
+             seed=None, steps=NUM_INFERENCE_STEPS, guidance=GUIDANCE_SCALE):
+    """
+    建立一個生成工作 (可透過 socket 傳送的 dict)。Prompt 可以直接給文字，或給檔案路徑
+    (路徑會轉為絕對路徑，由常駐程式讀取)。
+    """
+    if prompt is None and prompt_file is None:
+        raise ValueError("必須提供 prompt 或 prompt_file")
+    absolute = lambda path: os.path.abspath(path) if path else None
+    return {
+        'output_path': os.path.abspath(output_path),
+        'prompt': prompt,
+        'prompt_file': absolute(prompt_file),
+        'negative': negative,
+        'negative_file': absolute(negative_file),
+        'seed': seed,
+        'steps': steps,
+        'guidance': guidance,
+    }
+
+def task_job(task, seed=None, steps=NUM_INFERENCE_STEPS, guidance=GUIDANCE_SCALE):
+    """
+    依任務 ID 建立工作：任務資料庫中有 Prompt 時直接帶入文字，否則使用標準的 prompt 檔案路徑。
+    """
+    import task_store
+    positive_path, negative_path, output_path = task_prompt_paths(task)
+    store = task_store.default_store(create=False)
+    positive, negative = store.prompts(task) if store is not None else (None, None)
+    if positive:
+        return make_job(output_path, prompt=positive, negative=negative or None,
+                        seed=seed, steps=steps, guidance=guidance)
+    return make_job(output_path, prompt_file=positive_path, negative_file=negative_path,
+                    seed=seed, steps=steps, guidance=guidance)
+
+def _job_item(job):
+    """讀取工作的 Prompt，轉為 generate_images 使用的項目。"""
+    prompt_text = job.get('prompt') or read_prompt_file(job['prompt_file'])
+    negative_text = job.get('negative')
+    negative_file = job.get('negative_file')
+    if negative_text is None and negative_file and os.path.exists(negative_file):
+        with open(negative_file, 'r', encoding='utf-8') as f:
+            negative_text = f.read().strip() or None
+    return {'prompt': prompt_text, 'negative': negative_text,
+            'output_path': job['output_path'], 'seed': job.get('seed')}
+
+def run_jobs(pipe, jobs, batch_size=None):
+    """
+    以已載入的模型執行一組工作：推論步數與 guidance 相同的工作會合併成同一批送進模型，
+    單一工作失敗不影響其他工作。
+
+    Returns:
+        list: 每個工作的回覆 {'ok': True, 'output_path': str, 'seconds': float}
+              或 {'ok': False, 'error': str}。
+    """
+    t0 = time.perf_counter()
+    replies = [None] * len(jobs)
+    groups = {}
+    for index, job in enumerate(jobs):
+        try:
+            item = _job_item(job)
+        except Exception as e:
+            replies[index] = {'ok': False, 'error': f"讀取 Prompt 失敗: {e}"}
+            continue
+        key = (job.get('steps', NUM_INFERENCE_STEPS), job.get('guidance', GUIDANCE_SCALE))
+        groups.setdefault(key, []).append((index, item))
+
+    for (steps, guidance), entries in groups.items():
+        outputs = generate_images(pipe, [item for _, item in entries], steps, guidance, batch_size)
+        for (index, _), output_path in zip(entries, outputs):
+            if output_path is None:
+                replies[index] = {'ok': False, 'error': "圖像生成失敗"}
+            else:
+                replies[index] = {'ok': True, 'output_path': output_path,
+                                  'seconds': time.perf_counter() - t0}
+    return replies
+
+def run_job(pipe, job):
+    """以已載入的模型執行單一工作，回傳回覆 dict。"""
+    return run_jobs(pipe, [job], batch_size=1)[0]
+
+# --- 3. 測試用替身模型 ---
+
+class _StubResult:
+    def __init__(self, images):
+        self.images = images
+
+class StubPipeline:
+    """
+    不需要 GPU 與模型檔案的替身：依 prompt 與種子產生固定顏色的圖片，
+    用來在 CPU 環境測試常駐程式的通訊協定、排隊與生命週期。
+    """
+
+    def __init__(self, size=64, delay=0.0):
+        self.size = size
+        self.delay = delay
+        self.calls = 0
+
+    def make_generator(self, seed):
+        return seed
+
+    def __call__(self, prompt, negative_prompt=None, num_inference_steps=NUM_INFERENCE_STEPS,
+                 guidance_scale=GUIDANCE_SCALE, generator=None, **kwargs):
+        from PIL import Image
+
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        prompts = prompt if isinstance(prompt, list) else [prompt]
+        if isinstance(generator, list) and (len(generator) != len(prompts) or None in generator):
+            # 與 diffusers 的 randn_tensor 相同：產生器列表必須與 prompt 一一對應，且不能有 None
+            raise ValueError(f"generator 列表必須有 {len(prompts)} 個產生器: {generator}")
+        generators = generator if isinstance(generator, list) else [generator] * len(prompts)
+        images = []
+        for text, seed in zip(prompts, generators):
+            digest = hashlib.sha256(f"{text}|{seed}".encode('utf-8')).digest()
+            images.append(Image.new('RGB', (self.size, self.size), tuple(digest[:3])))
+        return _StubResult(images)
+
+def stub_pipeline_factory():
+    return StubPipeline()
+
+# --- 4. 常駐程式 ---
+
+class SDXLDaemon:
+    """
+    只載入一次 SDXL 模型，之後透過本機 socket 接收生成工作。
+
+    - 每個連線由獨立的執行緒接收，工作統一放進佇列，由單一工作執行緒依序交給模型
+      (模型不是執行緒安全的，也只有一張 GPU)；同時到達的工作會合併成一批 (最多 max_batch 個)。
+    - 支援的請求：{'op': 'generate', 'job': ...}、{'op': 'generate_many', 'jobs': [...]}、
+      {'op': 'ping'}、{'op': 'shutdown'}。
+    - pipeline_factory 可替換成回傳替身模型的函數，方便在沒有模型的環境測試。
+    - authkey 預設讀取 KEY_PATH (不存在時產生)；無法建立金鑰時拋出 OSError，不會以空金鑰啟動。
+    """
+
+    def __init__(self, pipeline_factory=None, address=(HOST, PORT), authkey=None,
+                 idle_timeout=IDLE_TIMEOUT, max_batch=MAX_BATCH_SIZE, batch_window=BATCH_WINDOW):
+        if authkey is None:
+            authkey = load_authkey(create=True)
+        self.pipeline_factory = pipeline_factory or (lambda: load_pipeline(SDXL_MODEL_PATH))
+        self.authkey = authkey
+        self.idle_timeout = idle_timeout
+        self.max_batch = max(1, max_batch)
+        self.batch_window = batch_window
+        self.pipe = None
+        self.jobs_served = 0
+        self.started_at = None
+        self._listener = Listener(address, authkey=authkey)
+        self.address = self._listener.address
+        self._queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._last_activity = time.monotonic()
+
+    # 工作執行緒：取出一個工作後，在 batch_window 內把陸續到達的工作收集成同一批
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)   # 先完成這一批，下一輪再結束
+                break
+            batch.append(item)
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            jobs = [job for job, _ in batch]
+            try:
+                replies = run_jobs(self.pipe, jobs, batch_size=self.max_batch)
+            except Exception as e:
+                replies = [{'ok': False, 'error': str(e)}] * len(batch)
+            self.jobs_served += len(batch)
+            self._last_activity = time.monotonic()
+            for (_, future), reply in zip(batch, replies):
+                future.set_result(reply)
+
+    def submit(self, job):
+        """將工作放入佇列，回傳可等待結果的 Future。"""
+        future = Future()
+        self._queue.put((job, future))
+        return future
+
+    def _reply(self, request):
+        op = request.get('op') if isinstance(request, dict) else None
+        if op == 'generate':
+            return self.submit(request['job']).result()
+        if op == 'generate_many':
+            futures = [self.submit(job) for job in request['jobs']]
+            return [future.result() for future in futures]
+        if op == 'ping':
+            return {'ok': True, 'pid': os.getpid(), 'jobs_served': self.jobs_served,
+                    'queued': self._queue.qsize(), 'uptime': time.time() - self.started_at}
+        if op == 'shutdown':
+            self.stop()
+            return {'ok': True}
+        return {'ok': False, 'error': f"未知的請求: {op}"}
+
+    def _handle(self, conn):
+        with conn:
+            while not self._stopping.is_set():
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    return
+                self._last_activity = time.monotonic()
+                try:
+                    conn.send(self._reply(request))
+                except (EOFError, OSError):
+                    return
+
+    def _idle_watch(self):
+        while not self._stopping.wait(1.0):
+            if self._queue.empty() and time.monotonic() - self._last_activity > self.idle_timeout:
+                print(f"--- 閒置超過 {self.idle_timeout} 秒，自動結束 ---")
+                self.stop()
+
+    def serve_forever(self):
+        """載入模型並開始接受連線，直到收到 shutdown 請求 (或 Ctrl+C)。"""
+        self.pipe = self.pipeline_factory()
+        if self.pipe is None:
+            self._listener.close()
+            print("❌ SDXL 模型載入失敗，常駐程式結束。")
+            return False
+
+        self.started_at = time.time()
+        worker = threading.Thread(target=self._worker, name='sdxl-worker', daemon=True)
+        worker.start()
+        if self.idle_timeout:
+            threading.Thread(target=self._idle_watch, name='sdxl-idle', daemon=True).start()
+        print(f"✅ SDXL 常駐程式已啟動，監聽 {self.address[0]}:{self.address[1]} (pid {os.getpid()})")
+
+        try:
+            while not self._stopping.is_set():
+                try:
+                    conn = self._listener.accept()
+                except AuthenticationError:
+                    print("❗ 拒絕一個金鑰錯誤的連線。")
+                    continue
+                except (OSError, EOFError):
+                    if self._stopping.is_set():
+                        break
+                    continue
+                if self._stopping.is_set():
+                    conn.close()
+                    break
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            print("\n--- 收到中斷訊號 ---")
+        finally:
+            self._stopping.set()
+            self._listener.close()
+            self._queue.put(None)   # 先做完已排隊的工作，再結束工作執行緒
+            worker.join()
+            # 結束後才送達的工作不會再被執行，直接回覆錯誤，避免用戶端一直等待
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[1].set_result({'ok': False, 'error': "常駐程式已結束"})
+            self.pipe = None
+            print(f"--- SDXL 常駐程式已結束 (共處理 {self.jobs_served} 個工作) ---")
+        return True
+
+    def start(self):
+        """在背景執行緒中啟動 (測試用)，回傳該執行緒。"""
+        thread = threading.Thread(target=self.serve_forever, name='sdxl-daemon', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        """停止接受新連線；accept() 會被一個自我連線喚醒。"""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except OSError:
+            pass
+
+# --- 5. 用戶端 ---
+
+def connect(address=(HOST, PORT), authkey=None, timeout=CONNECT_TIMEOUT):
+    """
+    連線到常駐程式，若在 timeout 秒內無法連線則回傳 None。
+    authkey 預設讀取 KEY_PATH；金鑰檔案不存在或無法讀取時視為常駐程式未啟動。
+    """
+    if authkey is None:
+        try:
+            authkey = load_authkey()
+        except OSError as e:
+            print(f"❗ 無法讀取常駐程式的連線金鑰: {e}")
+            return None
+        if authkey is None:
+            return None
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except OSError:
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(0.05)
+
+def request(message, address=(HOST, PORT), authkey=None, timeout=CONNECT_TIMEOUT):
+    """送出單一請求並等待回覆，常駐程式不存在時回傳 None。"""
+    conn = connect(address, authkey, timeout)
+    if conn is None:
+        return None
+    with conn:
+        conn.send(message)
+        return conn.recv()
+
+def generate(jobs, address=(HOST, PORT), authkey=None, fallback=True, pipeline_factory=None):
+    """
+    將工作交給常駐程式執行；若常駐程式沒有啟動且 fallback=True，改為在目前程序中
+    載入模型並依序執行 (所有工作共用同一次模型載入)。
+
+    Returns:
+        list: 每個工作的回覆 dict。
+    """
+    conn = connect(address, authkey)
+    if conn is not None:
+        with conn:
+            conn.send({'op': 'generate_many', 'jobs': list(jobs)})
+            return conn.recv()
+
+    if not fallback:
+        print("❌ SDXL 常駐程式未啟動。")
+        return [{'ok': False, 'error': "常駐程式未啟動"} for _ in jobs]
+
+    print("❗ SDXL 常駐程式未啟動，改為在目前程序中載入模型。")
+    pipe = (pipeline_factory or (lambda: load_pipeline(SDXL_MODEL_PATH)))()
+    if pipe is None:
+        return [{'ok': False, 'error': "SDXL 模型載入失敗"} for _ in jobs]
+    try:
+        return run_jobs(pipe, jobs)
+    finally:
+        del pipe
+        if pipeline_factory is None:
+            from generate_image import flush_memory
+            flush_memory()
+
+# --- 6. 命令列 ---
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="SDXL 常駐程式：模型只載入一次，透過本機 socket 接收生成工作。")
+    parser.add_argument('--port', type=int, default=PORT, help="本機連接埠")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve = sub.add_parser('serve', help="啟動常駐程式")
+    serve.add_argument('--idle-timeout', type=float, default=IDLE_TIMEOUT, help="閒置多少秒後自動結束")
+    serve.add_argument('--stub', action='store_true', help="使用替身模型 (不需要 GPU / 模型檔案)")
+    serve.add_argument('--max-batch', type=int, default=MAX_BATCH_SIZE, help="每批最多合併幾個工作")
+
+    gen = sub.add_parser('generate', help="送出生成工作 (常駐程式未啟動時在目前程序中執行)")
+    gen.add_argument('tasks', nargs='*', help="任務 ID (使用標準 prompt / 圖片路徑)")
+    gen.add_argument('--prompt', help="Prompt 文字")
+    gen.add_argument('--prompt-file', help="Positive prompt 檔案")
+    gen.add_argument('--negative', help="Negative prompt 文字")
+    gen.add_argument('--negative-file', help="Negative prompt 檔案")
+    gen.add_argument('-o', '--output', help="輸出圖片路徑 (搭配 --prompt / --prompt-file)")
+    gen.add_argument('--seed', type=int, default=None, help="亂數種子")
+    gen.add_argument('--steps', type=int, default=NUM_INFERENCE_STEPS, help="推論步數")
+    gen.add_argument('--guidance', type=float, default=GUIDANCE_SCALE, help="Guidance scale")
+    gen.add_argument('--no-fallback', action='store_true', help="常駐程式未啟動時直接失敗")
+
+    sub.add_parser('ping', help="查詢常駐程式狀態")
+    sub.add_parser('stop', help="結束常駐程式")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    address = (HOST, args.port)
+
+    if args.command == 'serve':
+        factory = stub_pipeline_factory if args.stub else None
+        try:
+            daemon = SDXLDaemon(factory, address, idle_timeout=args.idle_timeout, max_batch=args.max_batch)
+        except OSError as e:
+            raise SystemExit(f"❌ 無法啟動 SDXL 常駐程式: {e}")
+        daemon.serve_forever()
+
+    elif args.command == 'generate':
+        jobs = [task_job(task, args.seed, args.steps, args.guidance) for task in args.tasks]
+        if args.prompt or args.prompt_file:
+            if not args.output:
+                raise SystemExit("❌ 使用 --prompt / --prompt-file 時必須指定 --output")
+            jobs.append(make_job(args.output, args.prompt, args.prompt_file, args.negative,
+                                 args.negative_file, args.seed, args.steps, args.guidance))
+        if not jobs:
+            raise SystemExit("❌ 請指定任務 ID 或 --prompt / --prompt-file")
+        for job, reply in zip(jobs, generate(jobs, address, fallback=not args.no_fallback)):
+            if reply.get('ok'):
+                print(f"✅ {reply['output_path']} ({reply['seconds']:.1f} 秒)")
+            else:
+                print(f"❌ {job['output_path']}: {reply.get('error')}")
+
+    elif args.command == 'ping':
+        reply = request({'op': 'ping'}, address)
+        if reply is None:
+            print("❌ SDXL 常駐程式未啟動。")
+        else:
+            print(f"✅ pid {reply['pid']}，已處理 {reply['jobs_served']} 個工作，"
+                  f"排隊中 {reply['queued']} 個，已執行 {reply['uptime']:.0f} 秒")
+
+    elif args.command == 'stop':
+        reply = request({'op': 'shutdown'}, address)
+        print("✅ 已通知常駐程式結束。" if reply else "❗ SDXL 常駐程式未啟動。")
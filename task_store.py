@@ -0,0 +1,370 @@
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+# --- 全域配置 ---
+DB_PATH = os.path.join('json', 'task_store.sqlite3')
+TASK_JSON_DIR = os.path.join('json', 'task')
+PROMPT_DIR = 'prompt'
+ENABLED = True          # 其他腳本是否讀寫任務資料庫 (False 時只使用原本的檔案)
+MIRROR_FILES = True     # 寫入資料庫時是否同時寫出原本的 input.json / output.json / Prompt 檔案
+# MIRROR_FILES=True 時檔案仍是正式資料：只寫檔案的腳本 (例如 batch_score --write-outputs) 或手動編輯後，
+# 檔案會比資料庫記錄新，此時 scores / prompts 不回傳該筆記錄，呼叫端改讀檔案
+
+# 每筆任務記錄的欄位；input / score / artifacts 以 JSON 文字儲存
+FIELDS = ('input', 'score', 'total_score', 'positive', 'negative', 'artifacts', 'created')
+_JSON_FIELDS = ('input', 'score', 'artifacts')
+
+# --- 1. 工具函數 ---
+
+def task_created_time(task):
+    """從任務 ID 的時間戳記 (task_YYYYmmdd_HHMMSS) 取得建立時間，無法解析時回傳 None。"""
+    try:
+        stamp = task.split('_', 1)[1][:15]
+        return datetime.datetime.strptime(stamp, "%Y%m%d_%H%M%S").timestamp()
+    except (IndexError, ValueError):
+        return None
+
+def parse_time(value):
+    """接受 epoch 秒數、'YYYYmmdd' 或 'YYYYmmdd_HHMMSS' / ISO 格式的時間。"""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    for fmt in ("%Y%m%d_%H%M%S", "%Y%m%d"):
+        try:
+            return datetime.datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            pass
+    return datetime.datetime.fromisoformat(value).timestamp()
+
+def _read_text(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+
+def _write_text(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+def _newer_than(path, timestamp):
+    """檔案存在且修改時間晚於 timestamp。"""
+    try:
+        return os.stat(path).st_mtime > timestamp
+    except OSError:
+        return False
+
+def layout_paths(task, root='.'):
+    """任務在原本檔案結構中的 input.json / output.json / Prompt 檔案路徑。"""
+    return {
+        'input': os.path.join(root, TASK_JSON_DIR, task, 'input.json'),
+        'score': os.path.join(root, TASK_JSON_DIR, task, 'output.json'),
+        'positive': os.path.join(root, PROMPT_DIR, 'positive', f'positive_{task}.txt'),
+        'negative': os.path.join(root, PROMPT_DIR, 'negative', f'negative_{task}.txt'),
+    }
+
+# --- 2. SQLite 任務資料庫 ---
+
+class TaskStore:
+    """
+    將每個任務的輸入、分數、Prompt 與產出圖片路徑存放在同一個 SQLite 檔案中，
+    取代 json/task/<id>/*.json 與 prompt/*/<id>.txt 的大量小檔案。
+
+    任務 ID 為主鍵，建立時間 (created) 有索引，可依時間範圍查詢；
+    put / put_many 只更新有給定的欄位，其他欄位保持不變。
+    """
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            " task TEXT PRIMARY KEY, created REAL, updated REAL NOT NULL,"
+            " input TEXT, score TEXT, total_score REAL, positive TEXT, negative TEXT, artifacts TEXT)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_created ON tasks (created)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_updated ON tasks (updated)")
+
+    # --- 寫入 ---
+
+    @staticmethod
+    def _row_values(task, fields):
+        values = {}
+        for name, value in fields.items():
+            if name not in FIELDS:
+                raise ValueError(f"未知的欄位: {name}")
+            values[name] = json.dumps(value, ensure_ascii=False) if name in _JSON_FIELDS and value is not None else value
+        if 'score' in fields and 'total_score' not in fields and isinstance(fields['score'], dict):
+            values['total_score'] = fields['score'].get('total_score')
+        return values
+
+    def put(self, task, **fields):
+        """新增或更新單一任務，只寫入有給定的欄位 (例如 put(task, positive=..., negative=...))。"""
+        self.put_many([dict(fields, task=task)])
+
+    def put_many(self, records):
+        """
+        批次新增或更新多個任務 (同一個交易)。
+
+        Args:
+            records (list): 每個元素為含 'task' 與任意 FIELDS 欄位的 dict。
+        """
+        now = time.time()
+        groups = {}
+        for record in records:
+            record = dict(record)
+            task = record.pop('task')
+            values = self._row_values(task, record)
+            values.setdefault('created', task_created_time(task) or now)
+            groups.setdefault(tuple(values), []).append((task, now) + tuple(values.values()))
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for names, rows in groups.items():
+                    # created 只在第一次建立時寫入；其他欄位以新值覆寫
+                    updates = ', '.join(f"{name} = excluded.{name}" for name in names if name != 'created')
+                    self._conn.executemany(
+                        f"INSERT INTO tasks (task, updated, {', '.join(names)}) "
+                        f"VALUES ({', '.join('?' * (len(names) + 2))}) "
+                        f"ON CONFLICT(task) DO UPDATE SET updated = excluded.updated"
+                        f"{', ' + updates if updates else ''}",
+                        rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, task):
+        with self._lock:
+            self._conn.execute("DELETE FROM tasks WHERE task = ?", (task,))
+
+    # --- 讀取 ---
+
+    @staticmethod
+    def _decode(row, names):
+        record = dict(zip(names, row))
+        for name in _JSON_FIELDS:
+            if record.get(name) is not None:
+                record[name] = json.loads(record[name])
+        return record
+
+    def _select(self, where='', params=(), columns=None):
+        names = ('task', 'updated') + tuple(columns or FIELDS)
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(names)} FROM tasks {where}", params).fetchall()
+        return [self._decode(row, names) for row in rows]
+
+    def get(self, task, columns=None):
+        """回傳單一任務的記錄 dict，不存在時回傳 None。"""
+        rows = self._select("WHERE task = ?", (task,), columns)
+        return rows[0] if rows else None
+
+    def get_many(self, tasks, columns=None):
+        """一次查詢多個任務，回傳 {任務 ID: 記錄} (不存在的任務不會出現在結果中)。"""
+        tasks = list(dict.fromkeys(tasks))
+        result = {}
+        for start in range(0, len(tasks), 500):     # SQLite 參數數量有上限，分批查詢
+            chunk = tasks[start:start + 500]
+            for record in self._select(f"WHERE task IN ({', '.join('?' * len(chunk))})", chunk, columns):
+                result[record['task']] = record
+        return result
+
+    def range(self, start=None, end=None, columns=None):
+        """依建立時間查詢 [start, end) 之間的任務 (依時間排序)。"""
+        start, end = parse_time(start), parse_time(end)
+        conditions, params = [], []
+        if start is not None:
+            conditions.append("created >= ?")
+            params.append(start)
+        if end is not None:
+            conditions.append("created < ?")
+            params.append(end)
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ''
+        return self._select(where + "ORDER BY created, task", params, columns)
+
+    def scores(self, tasks, check_files=None):
+        """
+        一次查詢多個任務的總分，回傳 {任務 ID: total_score} (沒有分數的任務不會出現在結果中)。
+        check_files (預設為 MIRROR_FILES) 時，output.json 比記錄新的任務也不會出現在結果中。
+        """
+        check_files = MIRROR_FILES if check_files is None else check_files
+        records = self.get_many(tasks, columns=('total_score',))
+        return {task: r['total_score'] for task, r in records.items()
+                if r['total_score'] is not None
+                and not (check_files and _newer_than(layout_paths(task)['score'], r['updated']))}
+
+    def prompts(self, task, check_files=None):
+        """
+        回傳 (positive, negative)，沒有記錄時回傳 (None, None)。
+        check_files (預設為 MIRROR_FILES) 時，Prompt 檔案比記錄新也回傳 (None, None)。
+        """
+        check_files = MIRROR_FILES if check_files is None else check_files
+        record = self.get(task, columns=('positive', 'negative'))
+        if record is None:
+            return None, None
+        if check_files:
+            paths = layout_paths(task)
+            if _newer_than(paths['positive'], record['updated']) or _newer_than(paths['negative'], record['updated']):
+                return None, None
+        return record['positive'], record['negative']
+
+    def tasks(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute("SELECT task FROM tasks ORDER BY task")]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- 匯入 / 匯出原本的檔案結構 ---
+
+    def import_layout(self, root='.'):
+        """
+        讀取 json/task/<id>/input.json、output.json 與 prompt/positive|negative/*.txt，
+        一次寫入資料庫，回傳匯入的任務數。
+        """
+        from donut_pipeline import task_paths as artifact_paths
+
+        tasks = set()
+        task_dir = os.path.join(root, TASK_JSON_DIR)
+        if os.path.isdir(task_dir):
+            tasks.update(e.name for e in os.scandir(task_dir) if e.is_dir())
+        for kind in ('positive', 'negative'):
+            prompt_dir = os.path.join(root, PROMPT_DIR, kind)
+            if os.path.isdir(prompt_dir):
+                prefix = f"{kind}_"
+                tasks.update(e.name[len(prefix):-4] for e in os.scandir(prompt_dir)
+                             if e.name.startswith(prefix) and e.name.endswith('.txt'))
+
+        records = []
+        for task in sorted(tasks):
+            paths = layout_paths(task, root)
+            record = {'task': task}
+            for name in ('input', 'score'):
+                data = _read_json(paths[name])
+                if data is not None:
+                    record[name] = data
+            for name in ('positive', 'negative'):
+                text = _read_text(paths[name])
+                if text is not None:
+                    record[name] = text
+            artifacts = {kind: path for kind, path in artifact_paths(task).items()
+                         if os.path.exists(os.path.join(root, path))}
+            if artifacts:
+                record['artifacts'] = artifacts
+            records.append(record)
+        self.put_many(records)
+        return len(records)
+
+    def export_layout(self, root='.', tasks=None):
+        """將資料庫的內容寫回原本的檔案結構，回傳寫出的任務數。"""
+        records = self.get_many(tasks).values() if tasks is not None else self._select("ORDER BY task")
+        for record in records:
+            write_layout(record['task'], record, root)
+        return len(records)
+
+def write_layout(task, record, root='.'):
+    """將一筆記錄中有值的欄位寫成原本的 input.json / output.json / Prompt 檔案。"""
+    paths = layout_paths(task, root)
+    for name in ('input', 'score'):
+        if record.get(name) is not None:
+            _write_json(paths[name], record[name])
+    for name in ('positive', 'negative'):
+        if record.get(name) is not None:
+            _write_text(paths[name], record[name])
+
+_default_store = None
+_default_lock = threading.Lock()
+
+def default_store(create=True):
+    """
+    模組共用的資料庫實例；ENABLED=False 時回傳 None。
+
+    Args:
+        create (bool): 資料庫檔案不存在時是否建立。只讀取的呼叫端傳 False，
+            沒有資料庫時回傳 None (改讀原本的檔案)，不會在目前目錄留下空的資料庫。
+    """
+    global _default_store
+    if not ENABLED:
+        return None
+    with _default_lock:
+        if _default_store is None and not create and not os.path.exists(DB_PATH):
+            return None
+        if _default_store is None:
+            _default_store = TaskStore()
+        return _default_store
+
+# --- 3. 命令列 ---
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="任務資料庫 (SQLite)：匯入 / 匯出原本的 json 與 prompt 檔案結構。")
+    parser.add_argument('--db', default=DB_PATH, help="資料庫路徑")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('import', help="匯入 json/task 與 prompt/ 底下的檔案")
+    p.add_argument('--root', default='.', help="專案根目錄")
+    p = sub.add_parser('export', help="將資料庫寫回原本的檔案結構")
+    p.add_argument('--root', default='.', help="輸出根目錄")
+    p.add_argument('tasks', nargs='*', help="只匯出指定的任務")
+    p = sub.add_parser('show', help="顯示單一任務的記錄")
+    p.add_argument('task')
+    p = sub.add_parser('list', help="依建立時間列出任務")
+    p.add_argument('--since', help="開始時間 (YYYYmmdd 或 YYYYmmdd_HHMMSS)")
+    p.add_argument('--until', help="結束時間 (不含)")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    # 用法:
+    #   python task_store.py import
+    #   python task_store.py list --since 20251213 --until 20251214
+    #   python task_store.py show task_20251213_045454
+    #   python task_store.py export --root exported
+    args = parse_args()
+    store = TaskStore(args.db)
+
+    if args.command == 'import':
+        t0 = time.perf_counter()
+        count = store.import_layout(args.root)
+        print(f"✅ 已匯入 {count} 個任務至 {args.db} ({time.perf_counter() - t0:.2f} 秒)")
+    elif args.command == 'export':
+        count = store.export_layout(args.root, args.tasks or None)
+        print(f"✅ 已匯出 {count} 個任務至 {os.path.abspath(args.root)}")
+    elif args.command == 'show':
+        record = store.get(args.task)
+        if record is None:
+            print(f"❌ 找不到任務: {args.task}")
+            sys.exit(1)
+        print(json.dumps(record, indent=4, ensure_ascii=False))
+    else:
+        for record in store.range(args.since, args.until, columns=('created', 'total_score')):
+            created = datetime.datetime.fromtimestamp(record['created']).strftime("%Y-%m-%d %H:%M:%S")
+            score = f"{record['total_score']:.2f}" if record['total_score'] is not None else '-'
+            print(f"{record['task']}  {created}  {score:>8}")
+    store.close()
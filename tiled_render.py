@@ -0,0 +1,312 @@
+from PIL import Image
+import numpy as np
+import argparse
+import os
+import struct
+import zlib
+
+from image_encoding import load_image
+from polar_index import build_polar_window, START_ANGLE_PIL
+from mask_engine import EDGE_OFFSET
+from tracing import traced
+
+# --- 全域配置 ---
+INNER_RADIUS_RATIO = 0.5
+MAX_MEMORY_MB = 256         # 分塊渲染的工作記憶體上限 (輸出條帶 + 單一區塊的暫存陣列)
+TILE_WIDTH = 1024           # 每個條帶再切成多寬的區塊 (完全落在洞內或圓外的區塊直接略過)
+PNG_COMPRESS_LEVEL = 6
+
+# 估計值：每個輸出像素在條帶緩衝區中的位元組數 (RGBA + Sub 濾波後的副本)
+_STRIP_BYTES_PER_PIXEL = 9
+# 估計值：每個區塊像素在計算時的暫存位元組數 (半徑、角度、遮罩與各圖層縮放後的來源)
+_TILE_BYTES_PER_PIXEL = 64
+
+# --- 1. 串流 PNG 寫入 ---
+
+class PngStreamWriter:
+    """
+    逐列寫入 RGBA PNG：每次交給 zlib 一段列資料就輸出對應的 IDAT 區塊，
+    整張圖片不需要同時存在記憶體中。先寫到暫存檔，close() 時才改名為正式檔名。
+    """
+
+    def __init__(self, path, width, height, compress_level=PNG_COMPRESS_LEVEL):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self._tmp_path = f"{path}.{os.getpid()}.tmp"
+        self._compressor = zlib.compressobj(compress_level)
+
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self._file = open(self._tmp_path, 'wb')
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        # 8 位元、色彩類型 6 (RGBA)、無交錯
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(kind)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)) & 0xFFFFFFFF))
+
+    def write_rows(self, rows):
+        """
+        寫入形狀為 (列數, 寬, 4) 的 uint8 陣列。每列使用 PNG 的 Sub 濾波
+        (與左方像素相減)，以 NumPy 一次算完整個條帶。
+        """
+        count = rows.shape[0]
+        filtered = np.empty((count, self.width * 4 + 1), dtype=np.uint8)
+        filtered[:, 0] = 1
+        body = filtered[:, 1:].reshape(count, self.width, 4)
+        body[:, 0] = rows[:, 0]
+        np.subtract(rows[:, 1:], rows[:, :-1], out=body[:, 1:])
+        data = self._compressor.compress(filtered)
+        if data:
+            self._chunk(b'IDAT', data)
+        self.rows_written += count
+
+    def close(self):
+        """補上剩餘的壓縮資料與 IEND，並將暫存檔改名為正式檔名。"""
+        if self.rows_written != self.height:
+            self.abort()
+            raise ValueError(f"PNG 列數不符: 已寫入 {self.rows_written} 列，應為 {self.height} 列")
+        self._chunk(b'IDAT', self._compressor.flush())
+        self._chunk(b'IEND', b'')
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """放棄寫入並刪除暫存檔。"""
+        if not self._file.closed:
+            self._file.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+# --- 2. 分塊渲染 ---
+
+def strip_rows(width, max_memory_mb=MAX_MEMORY_MB, tile_width=TILE_WIDTH):
+    """依記憶體上限決定每個條帶的列數 (至少 1 列)。"""
+    per_row = width * _STRIP_BYTES_PER_PIXEL + min(width, tile_width) * _TILE_BYTES_PER_PIXEL
+    return max(1, int(max_memory_mb * 1024 * 1024) // per_row)
+
+def tile_outside_ring(box, cx, cy, R, r):
+    """
+    區塊內所有像素中心是否都在圓環外 (完全在 R 外，或完全在內圓洞內)。
+
+    Args:
+        box (tuple): 區塊範圍 (left, top, right, bottom)，right / bottom 不含。
+    """
+    left, top, right, bottom = box
+    near_x = min(max(cx, left), right - 1) - cx
+    near_y = min(max(cy, top), bottom - 1) - cy
+    if near_x * near_x + near_y * near_y > (R + EDGE_OFFSET) ** 2:
+        return True
+    far_x = max(abs(left - cx), abs(right - 1 - cx))
+    far_y = max(abs(top - cy), abs(bottom - 1 - cy))
+    return far_x * far_x + far_y * far_y <= (r + EDGE_OFFSET) ** 2
+
+def _open_source(source):
+    if isinstance(source, Image.Image):
+        return source.convert("RGBA")
+    return load_image(source, "RGBA")
+
+def _sample_source(src, canvas_size, box):
+    """取出來源圖片對應到畫布 box 的區域；尺寸不同時以 LANCZOS 縮放 (只處理該區域)。"""
+    width, height = canvas_size
+    left, top, right, bottom = box
+    if src.size == canvas_size:
+        return np.asarray(src.crop(box))
+    sx = src.width / width
+    sy = src.height / height
+    region = src.resize((right - left, bottom - top), Image.Resampling.LANCZOS,
+                        box=(left * sx, top * sy, right * sx, bottom * sy))
+    return np.asarray(region)
+
+@traced('tiled_render')
+def render_tiled(layers, size, output_path, inner_radius_ratio=INNER_RADIUS_RATIO,
+                 crop_box=None, max_memory_mb=MAX_MEMORY_MB, tile_width=TILE_WIDTH,
+                 compress_level=PNG_COMPRESS_LEVEL):
+    """
+    以水平條帶分塊渲染甜甜圈並串流寫入 PNG，適合 8K ~ 16K 等超大輸出尺寸。
+
+    每個圖層指定一個來源圖片與一段逆時針角度範圍；落在範圍內且在圓環上的像素取該來源的顏色
+    (Alpha 設為 255)，其他像素為透明，與 putalpha / paste 的結果相同。
+    遮罩在每個區塊內即時計算，完全落在內圓洞內或外圓外的區塊不做任何計算。
+
+    Args:
+        layers (list): [(來源, 起點偏移, 終點偏移), ...]，來源為路徑或 Image，偏移單位為度
+            (從 12 點鐘方向逆時針量起)。來源會等比例對應到整張畫布，尺寸不同時自動縮放。
+        size (tuple): 畫布尺寸 (寬, 高)。
+        output_path (str): 輸出 PNG 路徑。
+        inner_radius_ratio (float): 內圓半徑與外圓半徑的比例。
+        crop_box (tuple, optional): 只輸出畫布中的這個範圍 (例如甜甜圈的外接正方形)。
+        max_memory_mb (float): 工作記憶體上限 (MB)，決定每個條帶的列數。
+            來源圖片本身 (通常為 1024x1024) 不計入。
+        tile_width (int): 區塊寬度。
+        compress_level (int): zlib 壓縮等級 (0 ~ 9)。
+
+    Returns:
+        str: 輸出路徑，若失敗則回傳 None。
+    """
+    width, height = size
+    R = min(width, height) // 2
+    r = int(R * inner_radius_ratio)
+    cx, cy = width // 2, height // 2
+    left, top, right, bottom = crop_box or (0, 0, width, height)
+    out_width, out_height = right - left, bottom - top
+
+    try:
+        sources = [(_open_source(src), start, end) for src, start, end in layers]
+    except Exception as e:
+        print(f"❌ 無法開啟來源圖片: {e}")
+        return None
+
+    rows_per_strip = strip_rows(out_width, max_memory_mb, tile_width)
+    print(f"--- 分塊渲染 {out_width}x{out_height}：每條帶 {rows_per_strip} 列，區塊寬 {tile_width} ---")
+
+    writer = PngStreamWriter(output_path, out_width, out_height, compress_level)
+    rendered = skipped = 0
+    try:
+        for y0 in range(top, bottom, rows_per_strip):
+            y1 = min(y0 + rows_per_strip, bottom)
+            strip = np.zeros((y1 - y0, out_width, 4), dtype=np.uint8)
+
+            for x0 in range(left, right, tile_width):
+                x1 = min(x0 + tile_width, right)
+                box = (x0, y0, x1, y1)
+                if tile_outside_ring(box, cx, cy, R, r):
+                    skipped += 1
+                    continue
+                rendered += 1
+
+                index = build_polar_window(width, height, box, START_ANGLE_PIL)
+                ring = index.ring(R, r)
+                if not ring.any():
+                    continue
+                tile = strip[:, x0 - left:x1 - left]
+                for src, start, end in sources:
+                    selected = index.sector(start, end) & ring
+                    if not selected.any():
+                        continue
+                    tile[selected] = _sample_source(src, size, box)[selected]
+                    tile[selected, 3] = 255
+
+            writer.write_rows(strip)
+        writer.close()
+    except Exception as e:
+        writer.abort()
+        print(f"❌ 分塊渲染失敗: {e}")
+        return None
+
+    print(f"✅ 已輸出 {output_path} (計算 {rendered} 個區塊，略過 {skipped} 個洞內/圓外區塊)")
+    return output_path
+
+# --- 3. 常用輸出 ---
+
+def donut_crop_box(size):
+    """與 cut_donut 相同的外接正方形 (cx - R, cy - R, cx + R, cy + R)。"""
+    width, height = size
+    R = min(width, height) // 2
+    return (width // 2 - R, height // 2 - R, width // 2 + R, height // 2 + R)
+
+def scaled_size(source, size):
+    """輸出尺寸：size 為整數時視為較長邊長度，依來源圖片比例換算。"""
+    if isinstance(size, (tuple, list)):
+        return tuple(size)
+    if isinstance(source, Image.Image):
+        source_width, source_height = source.size
+    else:
+        with Image.open(source) as img:
+            source_width, source_height = img.size
+    scale = size / max(source_width, source_height)
+    return (round(source_width * scale), round(source_height * scale))
+
+def render_donut_tiled(image, size, output_path, **kwargs):
+    """大尺寸版的 crop_to_donut：整圈圓環，輸出裁切到甜甜圈的外接正方形。"""
+    size = scaled_size(image, size)
+    return render_tiled([(image, 0.0, 360.0)], size, output_path,
+                        crop_box=donut_crop_box(size), **kwargs)
+
+def render_filled_tiled(image, total_score, full_score, size, output_path, **kwargs):
+    """大尺寸版的 crop_filled_sector：只輸出已完成的扇形。"""
+    size = scaled_size(image, size)
+    filled = min(total_score / full_score, 1.0) * 360
+    return render_tiled([(image, 0.0, filled)], size, output_path, **kwargs)
+
+def render_ratio_tiled(color_image, gray_image, total_score, full_score, size, output_path, **kwargs):
+    """大尺寸版的 merge_donut_parts：彩色已完成扇形 + 灰色缺失扇形。"""
+    size = scaled_size(color_image, size)
+    filled = min(total_score / full_score, 1.0) * 360
+    return render_tiled([(color_image, 0.0, filled), (gray_image, filled, 360.0)],
+                        size, output_path, **kwargs)
+
+def render_merge_tiled(segments_list, size, output_path, **kwargs):
+    """大尺寸版的 merge_segments：沿用 plan_segments 的角度分配。"""
+    from merge_segment import plan_segments
+
+    if not segments_list:
+        print("❌ 錯誤：片段列表為空，無法合併。")
+        return None
+    size = scaled_size(segments_list[0]['image_path'], size)
+    plan = plan_segments(segments_list)
+    layers = [(item['image_path'], item['start_offset'], item['end_offset'])
+              for item in plan if item['image_path']]
+    return render_tiled(layers, size, output_path, **kwargs)
+
+def render_task_tiled(task, size, output_path=None, **kwargs):
+    """
+    以任務 ID 輸出大尺寸 donut_ratio：直接沿用已存在的 donut 與 donut_gray (1024 解析度)
+    作為來源，放大後在輸出解析度重新計算遮罩。
+    """
+    from donut_pipeline import task_paths
+    from generate_donut_ratio import read_task_score, FULL_SCORE
+
+    paths = task_paths(task)
+    for key in ('donut', 'gray'):
+        if not os.path.exists(paths[key]):
+            print(f"❌ 找不到 {paths[key]}，請先執行 donut_pipeline.py {task}")
+            return None
+    if output_path is None:
+        output_path = os.path.join('images', 'donut_ratio_large', f'donut_donut_ratio_{task}_{size}.png')
+    score = read_task_score(task, paths['score'])
+    return render_ratio_tiled(paths['donut'], paths['gray'], score, FULL_SCORE, size, output_path, **kwargs)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="以分塊方式輸出超大尺寸的甜甜圈圖片 (記憶體用量有上限)。")
+    parser.add_argument('mode', choices=('ratio', 'donut', 'merge'),
+                        help="ratio: 任務的比例甜甜圈；donut: 單張圖片裁成甜甜圈；merge: 依設定檔合併片段")
+    parser.add_argument('source', help="ratio: 任務 ID；donut: 圖片路徑；merge: merge_input.json 路徑")
+    parser.add_argument('--size', type=int, default=8192, help="輸出較長邊的像素數 (預設 8192)")
+    parser.add_argument('-o', '--output', help="輸出 PNG 路徑")
+    parser.add_argument('--max-memory-mb', type=float, default=MAX_MEMORY_MB, help="工作記憶體上限 (MB)")
+    parser.add_argument('--tile-width', type=int, default=TILE_WIDTH, help="區塊寬度 (像素)")
+    parser.add_argument('--compress-level', type=int, default=PNG_COMPRESS_LEVEL, help="PNG 壓縮等級 0 ~ 9")
+    parser.add_argument('--profile', default=None,
+                        help="以編碼設定檔決定壓縮等級 (只支援 RGBA PNG 的設定檔，見 image_encoding.py)")
+    args = parser.parse_args(argv)
+    if args.profile:
+        from image_encoding import png_compress_level
+        try:
+            args.compress_level = png_compress_level(args.profile)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    options = {'max_memory_mb': args.max_memory_mb, 'tile_width': args.tile_width,
+               'compress_level': args.compress_level}
+
+    if args.mode == 'ratio':
+        render_task_tiled(args.source, args.size, args.output, **options)
+    elif args.mode == 'donut':
+        output = args.output or os.path.splitext(args.source)[0] + f'_donut_{args.size}.png'
+        render_donut_tiled(args.source, args.size, output, **options)
+    else:
+        from merge_segment import load_config_and_prepare_segments
+        segments, default_output = load_config_and_prepare_segments(args.source)
+        if segments:
+            output = args.output or os.path.splitext(default_output)[0] + f'_{args.size}.png'
+            render_merge_tiled(segments, args.size, output, **options)
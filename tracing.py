@@ -0,0 +1,360 @@
+import argparse
+import contextvars
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+# 這個檔案只匯入標準函式庫，image_encoding 等所有模組都可以放心匯入。
+# 未啟用時 span() 回傳共用的空物件，各階段的額外成本只有一次函式呼叫。
+
+# --- 全域配置 ---
+# 設定環境變數 DONUT_TRACE=<路徑> (或 donut.py --trace) 後，每個階段都會以一行 JSON 寫入該檔案。
+# 環境變數會傳給子程序，因此 sdxl_daemon、watch_tasks 等啟動的程序也寫入同一個檔案與同一個 run。
+TRACE_PATH = os.environ.get('DONUT_TRACE', '')
+TRACE_MEMORY = os.environ.get('DONUT_TRACE_MEMORY', '1') != '0'   # 以 tracemalloc 記錄 Python 配置的峰值
+DEFAULT_TRACE_PATH = os.path.join('json', 'trace.jsonl')
+
+# 報告中歸類為圖片讀寫的階段，其餘為運算 (合成、裁切、擴散等)
+IO_STAGES = ('encode', 'decode')
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+_enabled = False
+_run_id = None
+_memory = False
+_fd = None
+_write_lock = threading.Lock()
+_ids = itertools.count(1)
+# 目前所在的區段：contextvars 讓每個執行緒與每個 asyncio 工作各自有獨立的巢狀關係
+_current = contextvars.ContextVar('tracing_span', default=None)
+
+# --- 1. 記憶體 ---
+
+def rss_mb():
+    """目前程序的常駐記憶體 (MB)，只支援有 /proc 的系統，其餘回傳 None。"""
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+# --- 2. 區段 ---
+
+class Span:
+    """
+    一個階段的執行紀錄。以 with 使用，結束時寫出一行 JSON：
+    開始時間、耗時、tracemalloc 峰值、RSS 變化，以及以 set() 補上的圖片尺寸、讀寫位元組數等欄位。
+
+    巢狀區段的 tracemalloc 峰值各自獨立計算 (子區段開始時會重設峰值，結束時再併回父區段)。
+    tracemalloc 是整個程序共用的，多執行緒或 asyncio 工作同時執行時峰值只是近似值。
+    """
+    __slots__ = ('stage', 'attrs', 'id', 'parent', 'start', '_parent_span', '_token',
+                 '_t0', '_rss0', '_traced0', '_child_peak')
+
+    def __init__(self, stage, attrs):
+        self.stage = stage
+        self.attrs = attrs
+        self.id = next(_ids)
+        self.parent = None
+        self._child_peak = 0
+
+    def set(self, **attrs):
+        """補上欄位 (例如 size=img.size、bytes_written=len(data))，值為 None 的欄位不寫出。"""
+        self.attrs.update(attrs)
+        return self
+
+    def __enter__(self):
+        parent = self._parent_span = _current.get()
+        self.parent = parent.id if parent else None
+        if _memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if parent:
+                parent._child_peak = max(parent._child_peak, peak)
+            tracemalloc.reset_peak()
+            self._traced0 = current
+        else:
+            self._traced0 = None
+        self._token = _current.set(self)
+        self._rss0 = rss_mb()
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self._t0
+        _current.reset(self._token)
+        record = {
+            'run': _run_id, 'pid': os.getpid(), 'thread': threading.current_thread().name,
+            'id': self.id, 'parent': self.parent, 'stage': self.stage,
+            'start': round(self.start, 6), 'duration_ms': round(duration * 1000, 3),
+        }
+        if self._traced0 is not None and tracemalloc.is_tracing():
+            peak = max(tracemalloc.get_traced_memory()[1], self._child_peak)
+            record['py_peak_mb'] = round((peak - self._traced0) / (1024 * 1024), 3)
+            if self._parent_span:
+                self._parent_span._child_peak = max(self._parent_span._child_peak, peak)
+        rss = rss_mb()
+        if rss is not None:
+            record['rss_mb'] = round(rss, 1)
+            record['rss_delta_mb'] = round(rss - self._rss0, 1)
+        for key, value in self.attrs.items():
+            if value is not None:
+                record[key] = value
+        if exc_type is not None:
+            record['error'] = exc_type.__name__
+        _write(record)
+        return False
+
+class _NullSpan:
+    """未啟用時使用的空區段。"""
+    __slots__ = ()
+
+    def set(self, **attrs):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+def span(stage, **attrs):
+    """
+    建立一個階段的區段，用法: with tracing.span('donut_crop', path=p) as s: ...; s.set(size=img.size)
+
+    Args:
+        stage (str): 階段名稱 (報告依此分組)。
+        **attrs: 額外欄位，必須可以轉成 JSON。
+
+    Returns:
+        Span: 未啟用時回傳不做任何事的空區段。
+    """
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(stage, attrs)
+
+def traced(stage):
+    """
+    裝飾器：整個函式呼叫記錄為一個區段；回傳值是圖片時 (有 size 屬性) 一併記錄尺寸。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with Span(stage, {}) as s:
+                result = func(*args, **kwargs)
+                size = getattr(result, 'size', None)
+                if isinstance(size, tuple):
+                    s.set(size=list(size))
+                return result
+        return wrapper
+    return decorator
+
+# --- 3. 啟用與寫出 ---
+
+def enabled():
+    return _enabled
+
+def run_id():
+    """目前的 run ID (同一次執行啟動的子程序共用)，未啟用時為 None。"""
+    return _run_id
+
+def enable(path=None, memory=None, run=None):
+    """
+    開始記錄區段並寫入 path (預設 json/trace.jsonl)，同時設定環境變數讓子程序沿用。
+
+    Args:
+        path (str, optional): JSON Lines 輸出路徑，附加寫入。
+        memory (bool, optional): 是否啟動 tracemalloc (預設依 DONUT_TRACE_MEMORY)。
+        run (str, optional): run ID，預設沿用 DONUT_TRACE_RUN 或產生新的。
+    """
+    global _enabled, _run_id, _memory, _fd, TRACE_PATH
+    disable()
+    TRACE_PATH = path or TRACE_PATH or DEFAULT_TRACE_PATH
+    _memory = TRACE_MEMORY if memory is None else memory
+    _run_id = run or os.environ.get('DONUT_TRACE_RUN') or time.strftime('%Y%m%d_%H%M%S_') + uuid.uuid4().hex[:6]
+
+    output_dir = os.path.dirname(TRACE_PATH)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    # O_APPEND: 多個程序同時寫入同一個檔案時，每一行都是一次完整的 write
+    _fd = os.open(TRACE_PATH, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    if _memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    os.environ['DONUT_TRACE'] = TRACE_PATH
+    os.environ['DONUT_TRACE_RUN'] = _run_id
+    os.environ['DONUT_TRACE_MEMORY'] = '1' if _memory else '0'
+    _enabled = True
+    return _run_id
+
+def disable():
+    """停止記錄並關閉檔案 (不會停止 tracemalloc)。"""
+    global _enabled, _fd
+    _enabled = False
+    with _write_lock:
+        if _fd is not None:
+            os.close(_fd)
+            _fd = None
+
+def _write(record):
+    line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+    with _write_lock:
+        if _fd is not None:
+            os.write(_fd, line)
+
+# 以環境變數啟用時 (包含由 enable() 的程序啟動的子程序)，匯入時就開始記錄
+if TRACE_PATH:
+    enable(TRACE_PATH)
+
+# --- 4. 報告 ---
+
+def load_spans(path=DEFAULT_TRACE_PATH):
+    """讀取 JSON Lines 區段紀錄，略過寫到一半或格式錯誤的行。"""
+    spans = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    spans.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        print(f"❌ 找不到紀錄檔 {path}")
+    return spans
+
+def list_runs(spans):
+    """依第一個區段的開始時間排列的 [(run, 區段數, 開始時間, 最外層區段總秒數)]。"""
+    runs = {}
+    for s in spans:
+        entry = runs.setdefault(s.get('run'), [0, s['start'], 0.0])
+        entry[0] += 1
+        entry[1] = min(entry[1], s['start'])
+        if s.get('parent') is None:
+            entry[2] += s['duration_ms'] / 1000
+    return sorted(((run, n, start, seconds) for run, (n, start, seconds) in runs.items()), key=lambda r: r[2])
+
+def select_run(spans, run):
+    """只保留指定 run 的區段；run 為 'last' 時取最後開始的 run。"""
+    if run == 'last':
+        runs = list_runs(spans)
+        run = runs[-1][0] if runs else None
+    return [s for s in spans if s.get('run') == run]
+
+def percentile(values, q):
+    """線性內插的百分位數 (與 numpy.percentile 預設相同)，values 必須已排序。"""
+    if not values:
+        return 0.0
+    k = (len(values) - 1) * q / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def self_times(spans):
+    """
+    每個區段扣掉直接子區段後的時間 (ms)。子區段在其他執行緒並行時加總可能超過父區段，此時視為 0。
+    """
+    children = {}
+    for s in spans:
+        if s.get('parent') is not None:
+            key = (s.get('run'), s.get('pid'), s['parent'])
+            children[key] = children.get(key, 0.0) + s['duration_ms']
+    return [max(0.0, s['duration_ms'] - children.get((s.get('run'), s.get('pid'), s['id']), 0.0)) for s in spans]
+
+def aggregate(spans, stages=None):
+    """
+    依階段彙總區段。自身時間以全部區段計算，stages 只決定要列出哪些階段。
+
+    Returns:
+        dict: {stage: {'count', 'total_ms', 'self_ms', 'p50_ms', 'p95_ms', 'max_ms',
+                       'bytes_read', 'bytes_written', 'py_peak_mb', 'rss_delta_mb', 'errors'}}
+    """
+    groups = {}
+    for s, own in zip(spans, self_times(spans)):
+        if stages and s['stage'] not in stages:
+            continue
+        g = groups.setdefault(s['stage'], {'durations': [], 'self_ms': 0.0, 'bytes_read': 0, 'bytes_written': 0,
+                                           'py_peak_mb': None, 'rss_delta_mb': None, 'errors': 0})
+        g['durations'].append(s['duration_ms'])
+        g['self_ms'] += own
+        g['bytes_read'] += s.get('bytes_read') or 0
+        g['bytes_written'] += s.get('bytes_written') or 0
+        for key in ('py_peak_mb', 'rss_delta_mb'):
+            if s.get(key) is not None:
+                g[key] = s[key] if g[key] is None else max(g[key], s[key])
+        g['errors'] += 1 if s.get('error') else 0
+
+    result = {}
+    for stage, g in groups.items():
+        durations = sorted(g.pop('durations'))
+        result[stage] = dict(count=len(durations), total_ms=sum(durations), p50_ms=percentile(durations, 50),
+                             p95_ms=percentile(durations, 95), max_ms=durations[-1], **g)
+    return result
+
+def _format_bytes(n):
+    if not n:
+        return '-'
+    return f"{n / (1024 * 1024):.1f}M" if n >= 1024 * 1024 else f"{n / 1024:.0f}K"
+
+def _format_mb(value):
+    return '-' if value is None else f"{value:.1f}"
+
+def print_report(spans, stages=None):
+    """印出各階段的次數、p50 / p95 / 最大耗時、讀寫量與記憶體峰值，以及讀寫與運算的時間比例。"""
+    if not spans:
+        print("❗ 沒有任何區段紀錄")
+        return {}
+    stats = aggregate(spans, stages)
+    # 欄位: 次數、總耗時、自身耗時 (扣掉子區段)、p50 / p95 / 最大耗時、讀取 / 寫出量、tracemalloc 峰值、RSS 增加量
+    print(f"{'stage':<20}{'count':>6}{'total ms':>11}{'self ms':>11}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}"
+          f"{'read':>8}{'written':>8}{'py MB':>10}{'RSS+MB':>8}")
+    for stage, g in sorted(stats.items(), key=lambda item: -item[1]['self_ms']):
+        errors = f"  ❌ {g['errors']} 次錯誤" if g['errors'] else ''
+        print(f"{stage:<20}{g['count']:>6}{g['total_ms']:>11.1f}{g['self_ms']:>11.1f}{g['p50_ms']:>10.1f}"
+              f"{g['p95_ms']:>10.1f}{g['max_ms']:>10.1f}{_format_bytes(g['bytes_read']):>8}"
+              f"{_format_bytes(g['bytes_written']):>8}{_format_mb(g['py_peak_mb']):>10}"
+              f"{_format_mb(g['rss_delta_mb']):>8}{errors}")
+
+    # 以自身時間 (不重複計算巢狀區段) 比較圖片讀寫與其他階段
+    total = sum(g['self_ms'] for g in stats.values())
+    io = sum(g['self_ms'] for stage, g in stats.items() if stage in IO_STAGES)
+    if total > 0:
+        print(f"\n🖼️ 圖片讀寫 (編碼/解碼) {io:.0f} ms ({io / total:.0%})，"
+              f"其他階段 {total - io:.0f} ms ({(total - io) / total:.0%})")
+    return stats
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="彙總 DONUT_TRACE 記錄的各階段耗時與記憶體")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('report', help="依階段彙總 p50 / p95 耗時")
+    p.add_argument('path', nargs='?', default=DEFAULT_TRACE_PATH, help=f"紀錄檔 (預設 {DEFAULT_TRACE_PATH})")
+    p.add_argument('--run', default=None, help="只彙總指定的 run ID ('last' 為最後一次執行，預設全部)")
+    p.add_argument('--stage', nargs='+', default=None, help="只列出指定的階段")
+
+    p = sub.add_parser('runs', help="列出紀錄檔中的每一次執行")
+    p.add_argument('path', nargs='?', default=DEFAULT_TRACE_PATH, help=f"紀錄檔 (預設 {DEFAULT_TRACE_PATH})")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    spans = load_spans(args.path)
+    if args.command == 'runs':
+        for run, n, start, seconds in list_runs(spans):
+            print(f"{run}  {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))}  "
+                  f"{n:>6} 個區段  {seconds:>9.2f} s")
+        sys.exit(0)
+
+    if args.run:
+        spans = select_run(spans, args.run)
+        print(f"run {spans[0]['run'] if spans else args.run}: {len(spans)} 個區段")
+    sys.exit(0 if print_report(spans, args.stage) else 1)
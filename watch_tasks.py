@@ -0,0 +1,160 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import threading
+import time
+
+from donut_pipeline import render_task, render_task_ratio, MASK_PATH
+
+# --- 全域配置 ---
+GENERATED_DIR = os.path.join('images', 'generated_images')
+TASK_JSON_DIR = os.path.join('json', 'task')
+
+GENERATED_PREFIX = 'generated_image_'
+POLL_INTERVAL = 0.25      # 輪詢間隔 (秒)
+DEBOUNCE_SECONDS = 0.3    # 檔案大小與修改時間需維持不變多久才視為寫入完成
+MAX_WORKERS = 2           # 同時處理的任務數量上限
+
+# 事件種類：'full' = 生成圖變動，需要重跑整條管線；'ratio' = 只有分數變動
+_PRIORITY = {'ratio': 1, 'full': 2}
+
+# --- 1. 檔案掃描 ---
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def scan_sources():
+    """
+    只掃描兩個固定位置 (不走訪整個專案目錄)：
+    images/generated_images/generated_image_<task>.png 與 json/task/<task>/output.json。
+
+    Returns:
+        dict: {路徑: (任務 ID, 事件種類, (檔案大小, 修改時間))}
+    """
+    found = {}
+    if os.path.isdir(GENERATED_DIR):
+        with os.scandir(GENERATED_DIR) as it:
+            for entry in it:
+                name = entry.name
+                if not (entry.is_file() and name.startswith(GENERATED_PREFIX) and name.endswith('.png')):
+                    continue
+                task = name[len(GENERATED_PREFIX):-len('.png')]
+                st = entry.stat()
+                found[entry.path] = (task, 'full', (st.st_size, st.st_mtime_ns))
+
+    if os.path.isdir(TASK_JSON_DIR):
+        with os.scandir(TASK_JSON_DIR) as it:
+            for entry in it:
+                if not entry.is_dir():
+                    continue
+                path = os.path.join(entry.path, 'output.json')
+                sig = _signature(path)
+                if sig is not None:
+                    found[path] = (entry.name, 'ratio', sig)
+    return found
+
+# --- 2. 監看器 ---
+
+class TaskWatcher:
+    """
+    輪詢生成圖與分數檔，只針對有變動的任務重新產生 donut / donut_gray / donut_ratio。
+
+    - 防抖：檔案的大小與修改時間需連續 debounce 秒不變，才視為寫入完成。
+    - 有界工作池：最多 workers 個任務同時處理；同一任務在處理中又有新事件時，
+      只記錄一次，等目前這次處理完成後再重跑，不會無限堆積。
+    """
+
+    def __init__(self, interval=POLL_INTERVAL, debounce=DEBOUNCE_SECONDS,
+                 workers=MAX_WORKERS, mask_path=MASK_PATH, process_existing=False):
+        self.interval = interval
+        self.debounce = debounce
+        self.mask_path = mask_path
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self._running = set()     # 正在處理的任務
+        self._again = {}          # 處理中又收到事件的任務 -> 事件種類
+        self._pending = {}        # 路徑 -> (任務, 種類, 簽章, 最後變動時間)
+        self._seen = {}           # 路徑 -> 已處理過的簽章
+        if not process_existing:
+            self._seen = {path: sig for path, (_, _, sig) in scan_sources().items()}
+
+    def poll_once(self):
+        """掃描一次並派送已經穩定的事件，回傳本次派送的任務數量。"""
+        now = time.monotonic()
+        for path, (task, kind, sig) in scan_sources().items():
+            if self._seen.get(path) == sig:
+                self._pending.pop(path, None)
+                continue
+            pending = self._pending.get(path)
+            if pending is None or pending[2] != sig:
+                self._pending[path] = (task, kind, sig, now)
+
+        ready = {}
+        for path, (task, kind, sig, changed_at) in list(self._pending.items()):
+            if now - changed_at < self.debounce:
+                continue
+            del self._pending[path]
+            self._seen[path] = sig
+            if _PRIORITY[kind] > _PRIORITY.get(ready.get(task), 0):
+                ready[task] = kind
+
+        for task, kind in ready.items():
+            self.submit(task, kind)
+        return len(ready)
+
+    def submit(self, task, kind):
+        with self._lock:
+            if task in self._running:
+                if _PRIORITY[kind] > _PRIORITY.get(self._again.get(task), 0):
+                    self._again[task] = kind
+                return
+            self._running.add(task)
+        self.executor.submit(self._process, task, kind)
+
+    def _process(self, task, kind):
+        while True:
+            print(f"\n🔄 偵測到 {task} 變動 ({'生成圖' if kind == 'full' else '分數'})，開始處理...")
+            try:
+                if kind == 'full':
+                    render_task(task, self.mask_path)
+                else:
+                    render_task_ratio(task)
+            except Exception as e:
+                print(f"❌ 處理 {task} 時發生錯誤: {e}")
+
+            with self._lock:
+                kind = self._again.pop(task, None)
+                if kind is None:
+                    self._running.discard(task)
+                    return
+
+    def run(self, stop_event=None):
+        """持續輪詢直到 stop_event 被設定 (或 Ctrl+C)。"""
+        print(f"👀 監看 {GENERATED_DIR} 與 {TASK_JSON_DIR}/*/output.json (Ctrl+C 結束)")
+        try:
+            while stop_event is None or not stop_event.is_set():
+                self.poll_once()
+                time.sleep(self.interval)
+        except KeyboardInterrupt:
+            print("\n--- 停止監看 ---")
+        finally:
+            self.executor.shutdown(wait=True)
+
+def watch(interval=POLL_INTERVAL, debounce=DEBOUNCE_SECONDS, workers=MAX_WORKERS, process_existing=False):
+    TaskWatcher(interval, debounce, workers, process_existing=process_existing).run()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="監看新的生成圖與分數檔，增量產生甜甜圈圖片。")
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help="輪詢間隔 (秒)")
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS, help="寫入完成判定時間 (秒)")
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS, help="同時處理的任務數量上限")
+    parser.add_argument('--process-existing', action='store_true', help="啟動時也處理已存在的檔案")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    watch(args.interval, args.debounce, args.workers, args.process_existing)